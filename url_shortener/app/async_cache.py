@@ -0,0 +1,454 @@
+import time
+import asyncio
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ResponseError, ConnectionError as RedisConnectionError
+from typing import Optional
+from datetime import datetime, timezone
+
+from app.config import settings
+from app.metrics import (
+    REDIS_COMMAND_DURATION, REDIRECT_CACHE_LOOKUPS,
+    REDIS_POOL_CHECKOUT_WAIT, REDIS_POOL_TIMEOUTS, REDIS_POOL_CONNECTIONS
+)
+from app.cache import (
+    redis_connection_kwargs, url_l1_cache, get_url_cache_key, get_link_info_cache_key, get_search_cache_key, build_click_record,
+    l1_ttl_from_pttl, get_l1_cache_stats, URL_INVALIDATION_CHANNEL,
+    USER_INVALIDATION_CHANNEL, user_l1_cache,
+    RECORD_CLICK_SCRIPT, record_click_script_keys, record_click_script_args,
+    RESET_BUFFERED_STATS_SCRIPT, parse_last_access, CLICK_STREAM_GROUP,
+    get_click_stream_key, get_click_stream_keys, parse_click_events, group_click_event_ids,
+    INTERN_CLICK_TEXT_SCRIPT, CLICK_DICT_FIELDS, click_text_ids, get_click_dict_keys, is_click_dict_text,
+    get_unresolved_click_text_ids, apply_click_texts, cache_click_texts,
+    CLICK_DICT_EPOCH_SCRIPT, CLICK_DICT_EPOCH_KEY, STALE_CLICK_DICT, click_dict_state, new_click_dict_epoch,
+    set_click_dict_epoch, combine_click_text_ids
+)
+
+class InstrumentedPipeline(Pipeline):
+    """Конвейер, время выполнения которого попадает в метрики как одна команда PIPELINE"""
+
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_COMMAND_DURATION.labels("PIPELINE").observe(time.perf_counter() - started)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """Клиент Redis, замеряющий время каждой команды"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# Статистика пула соединений Redis
+redis_pool_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+}
+
+
+class InstrumentedConnectionPool(aioredis.BlockingConnectionPool):
+    """Ограниченный пул, замеряющий ожидание соединения и считающий таймауты"""
+
+    async def get_connection(self, command_name=None, *keys, **options):
+        started = time.perf_counter()
+        try:
+            # redis 5.0-5.2 требует command_name, а начиная с 5.3 не передает его и предупреждает о нем
+            if command_name is None:
+                return await super().get_connection()
+            return await super().get_connection(command_name, *keys, **options)
+        except RedisConnectionError as e:
+            if isinstance(e.__cause__, asyncio.TimeoutError):
+                redis_pool_stats["timeouts"] += 1
+                REDIS_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            redis_pool_stats["checkouts"] += 1
+            redis_pool_stats["wait_time_total"] += wait
+            redis_pool_stats["wait_time_max"] = max(redis_pool_stats["wait_time_max"], wait)
+            REDIS_POOL_CHECKOUT_WAIT.observe(wait)
+
+    def get_connection_counts(self) -> dict:
+        return {"in_use": len(self._in_use_connections), "idle": len(self._available_connections)}
+
+
+# Общий пул соединений для всех корутин процесса
+redis_pool = InstrumentedConnectionPool(
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    **redis_connection_kwargs
+)
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
+# Поток кликов хранит двоичные записи и читается без декодирования ответов
+redis_binary_pool = InstrumentedConnectionPool(
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    **{**redis_connection_kwargs, "decode_responses": False}
+)
+redis_binary_client = InstrumentedRedis(connection_pool=redis_binary_pool)
+
+REDIS_POOL_CONNECTIONS.set_function(
+    lambda: {(state,): count for state, count in redis_pool.get_connection_counts().items()}
+)
+
+def get_redis_pool_stats() -> dict:
+    """Настройки и загрузка пула соединений Redis"""
+    checkouts = redis_pool_stats["checkouts"]
+    return {
+        "max_connections": redis_pool.max_connections,
+        "timeout": redis_pool.timeout,
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+        **redis_pool.get_connection_counts(),
+        **redis_pool_stats,
+        "wait_time_avg": redis_pool_stats["wait_time_total"] / checkouts if checkouts else 0.0,
+    }
+
+record_click_script = redis_client.register_script(RECORD_CLICK_SCRIPT)
+reset_buffered_stats_script = redis_client.register_script(RESET_BUFFERED_STATS_SCRIPT)
+intern_click_text_script = redis_client.register_script(INTERN_CLICK_TEXT_SCRIPT)
+click_dict_epoch_script = redis_client.register_script(CLICK_DICT_EPOCH_SCRIPT)
+
+async def get_cached_url(short_code: str) -> Optional[str]:
+    """Получает оригинальный URL из кеша по короткому коду (сначала L1, затем Redis)"""
+    original_url = url_l1_cache.get(short_code)
+    if original_url is not None:
+        return original_url
+
+    key = get_url_cache_key(short_code)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    original_url, ttl_ms = await pipe.execute()
+
+    if original_url:
+        url_l1_cache.set(short_code, original_url, l1_ttl_from_pttl(ttl_ms))
+
+    return original_url
+
+async def get_click_dict_epoch() -> int:
+    """Текущая эпоха словарей; запрашивается у Redis, только пока неизвестна процессу"""
+    if click_dict_state["epoch"] is None:
+        set_click_dict_epoch(await click_dict_epoch_script(
+            keys=[CLICK_DICT_EPOCH_KEY], args=[new_click_dict_epoch()], client=redis_client
+        ))
+    return click_dict_state["epoch"]
+
+async def get_click_text_id(epoch: int, field: str, text: Optional[str]) -> int:
+    """id текста в словаре поля; 0 — текст хранится в самой записи клика"""
+    if not is_click_dict_text(text):
+        return 0
+    text_id = click_text_ids.get((field, text))
+    if text_id is None:
+        text_id = await intern_click_text_script(
+            keys=[CLICK_DICT_EPOCH_KEY, *get_click_dict_keys(epoch, field)],
+            args=[epoch, text, settings.CLICK_DICT_MAX_SIZE], client=redis_client
+        )
+        if text_id == STALE_CLICK_DICT:
+            set_click_dict_epoch(None)
+            return 0
+        # Заполненный словарь тоже кешируется, чтобы не спрашивать Redis на каждом клике
+        click_text_ids.set((field, text), text_id)
+    return text_id
+
+async def get_click_text_ids(client_info: dict) -> tuple:
+    """Эпоха словарей и id user-agent и referer клика; знакомые тексты берутся из кеша процесса без запросов"""
+    epoch = await get_click_dict_epoch()
+    return combine_click_text_ids(
+        epoch, [await get_click_text_id(epoch, field, client_info.get(field)) for field in CLICK_DICT_FIELDS]
+    )
+
+async def run_record_click_script(short_code: str, client_info: dict, resolve: bool):
+    """Выполняет скрипт записи клика; если словари в Redis пересозданы, повторяет его с текстами в записи"""
+    keys = record_click_script_keys(short_code)
+    text_ids = await get_click_text_ids(client_info)
+    result = await record_click_script(keys=keys, args=record_click_script_args(short_code, client_info, resolve, text_ids),
+                                       client=redis_client)
+    if result == STALE_CLICK_DICT:
+        set_click_dict_epoch(None)
+        result = await record_click_script(keys=keys, args=record_click_script_args(short_code, client_info, resolve),
+                                           client=redis_client)
+    return result
+
+async def resolve_and_record_click(short_code: str, client_info: dict) -> Optional[str]:
+    """Возвращает URL из кеша и учитывает клик за один запрос; None при промахе кеша"""
+    original_url = url_l1_cache.get(short_code)
+    if original_url is not None:
+        REDIRECT_CACHE_LOOKUPS.labels("l1").inc()
+        await run_record_click_script(short_code, client_info, False)
+        return original_url
+
+    result = await run_record_click_script(short_code, client_info, True)
+    if not result:
+        REDIRECT_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    REDIRECT_CACHE_LOOKUPS.labels("redis").inc()
+
+    original_url, ttl_ms = result
+    url_l1_cache.set(short_code, original_url, l1_ttl_from_pttl(ttl_ms))
+    return original_url
+
+async def record_click(short_code: str, client_info: dict) -> None:
+    """Учитывает клик в буфере без чтения URL из кеша"""
+    await run_record_click_script(short_code, client_info, False)
+
+async def invalidate_url_cache(short_code: str) -> None:
+    """Инвалидирует кеш URL при обновлении или удалении"""
+    url_l1_cache.delete(short_code)
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(get_url_cache_key(short_code), get_link_info_cache_key(short_code))
+    pipe.publish(URL_INVALIDATION_CHANNEL, short_code)
+    await pipe.execute()
+
+async def add_popular_url(short_code: str) -> None:
+    """Добавляет URL в список популярных"""
+    await redis_client.sadd("popular_urls", short_code)
+
+async def is_popular_url(short_code: str) -> bool:
+    """Проверяет, является ли URL популярным"""
+    return bool(await redis_client.sismember("popular_urls", short_code))
+
+async def increment_access_counter(short_code: str) -> int:
+    """Инкрементирует счетчик доступов и отмечает для синхронизации"""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.incr(f"clicks:{short_code}")
+    pipe.set(f"last_access:{short_code}", datetime.now(timezone.utc).isoformat())
+    pipe.sadd("links_to_sync", short_code)
+    count, _, _ = await pipe.execute()
+    return count
+
+async def get_links_to_sync(limit: Optional[int] = None) -> set:
+    """Получает ссылки, требующие синхронизации; с limit — не больше limit случайных, не читая все множество"""
+    if limit is None:
+        return await redis_client.smembers("links_to_sync")
+    return set(await redis_client.srandmember("links_to_sync", limit))
+
+async def get_sync_backlog() -> dict:
+    """Размер несинхронизированного буфера и время самого старого события клика в нем (мс Unix или None)"""
+    streams = get_click_stream_keys()
+    # Записи двоичные, поэтому XRANGE читается клиентом без декодирования
+    pipe = redis_binary_client.pipeline(transaction=False)
+    pipe.scard("links_to_sync")
+    for stream in streams:
+        pipe.xlen(stream)
+        pipe.xrange(stream, count=1)
+    results = await pipe.execute()
+
+    # Обработанные события удаляются из потока, поэтому первая запись — самый старый несохраненный клик,
+    # а миллисекунды ее ID — время добавления
+    lengths = results[1::2]
+    oldest = [int(entries[0][0].split(b"-")[0]) for entries in results[2::2] if entries]
+    return {
+        "links": results[0],
+        "clicks": sum(lengths),
+        "oldest_ms": min(oldest) if oldest else None,
+    }
+
+async def get_buffered_clicks(short_code: str) -> int:
+    """Получает количество буферизованных кликов из Redis"""
+    count = await redis_client.get(f"clicks:{short_code}")
+    return int(count) if count else 0
+
+async def get_buffered_last_access(short_code: str) -> Optional[datetime]:
+    """Получает буферизованное время последнего доступа из Redis"""
+    return parse_last_access(await redis_client.get(f"last_access:{short_code}"))
+
+async def get_buffered_stats_bulk(short_codes: list) -> dict:
+    """Читает буферизованные клики и время доступа пачки ссылок за один запрос"""
+    if not short_codes:
+        return {}
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.mget([f"clicks:{short_code}" for short_code in short_codes])
+    pipe.mget([f"last_access:{short_code}" for short_code in short_codes])
+    clicks, last_access = await pipe.execute()
+
+    return {
+        short_code: (int(count) if count else 0, parse_last_access(accessed))
+        for short_code, count, accessed in zip(short_codes, clicks, last_access)
+    }
+
+async def reset_buffered_stats(short_code: str) -> None:
+    """Сбрасывает буферизованную статистику для ссылки"""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(f"clicks:{short_code}", f"last_access:{short_code}")
+    pipe.srem("links_to_sync", short_code)
+    await pipe.execute()
+
+async def reset_buffered_stats_bulk(flushed: dict) -> None:
+    """Вычитает записанные в БД клики из буфера; полностью сброшенные ссылки снимаются с синхронизации"""
+    if not flushed:
+        return
+
+    keys = ["links_to_sync"]
+    args = []
+    for short_code, clicks in flushed.items():
+        keys.extend((f"clicks:{short_code}", f"last_access:{short_code}"))
+        args.extend((short_code, clicks))
+
+    await reset_buffered_stats_script(keys=keys, args=args, client=redis_client)
+
+async def add_click_details(short_code: str, client_info: dict) -> None:
+    """Добавляет информацию о клике в поток кликов"""
+    click_record = build_click_record(short_code, client_info, await get_click_text_ids(client_info))
+    await redis_client.xadd(
+        get_click_stream_key(short_code), {"data": click_record},
+        maxlen=settings.CLICK_STREAM_MAXLEN, approximate=True
+    )
+
+async def ensure_click_stream_group() -> None:
+    """Создает группу потребителей для всех шардов потока кликов"""
+    for stream in get_click_stream_keys():
+        try:
+            await redis_client.xgroup_create(stream, CLICK_STREAM_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+async def read_click_events(consumer: str, count: int) -> list:
+    """Читает пачку событий кликов, сначала забирая зависшие у упавших потребителей"""
+    events = []
+    for stream in get_click_stream_keys():
+        # Redis 7 добавляет в ответ третий элемент — удаленные записи, Redis 6.2 возвращает два
+        reply = await redis_binary_client.xautoclaim(
+            stream, CLICK_STREAM_GROUP, consumer,
+            min_idle_time=settings.CLICK_STREAM_CLAIM_IDLE_MS, count=count
+        )
+        events.extend(parse_click_events(stream, reply[1]))
+
+    if len(events) < count:
+        response = await redis_binary_client.xreadgroup(
+            CLICK_STREAM_GROUP, consumer,
+            {stream: ">" for stream in get_click_stream_keys()},
+            count=count - len(events)
+        )
+        for stream, entries in response or []:
+            events.extend(parse_click_events(stream, entries))
+
+    await resolve_click_texts(events)
+    return events
+
+async def resolve_click_texts(events: list) -> None:
+    """Подставляет в события user-agent и referer из словарей одним запросом на поле"""
+    unresolved = get_unresolved_click_text_ids(events)
+    if unresolved:
+        pipe = redis_client.pipeline(transaction=False)
+        for (epoch, field), ids in unresolved.items():
+            pipe.hmget(get_click_dict_keys(epoch, field)[1], ids)
+        for ((epoch, field), ids), texts in zip(unresolved.items(), await pipe.execute()):
+            cache_click_texts(epoch, field, ids, texts)
+    apply_click_texts(events)
+
+async def ack_click_events(events: list) -> None:
+    """Подтверждает и удаляет обработанные события кликов"""
+    if not events:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for stream, entry_ids in group_click_event_ids(events).items():
+        pipe.xack(stream, CLICK_STREAM_GROUP, *entry_ids)
+        pipe.xdel(stream, *entry_ids)
+    await pipe.execute()
+
+async def invalidate_url_cache_bulk(short_codes: list) -> None:
+    """Инвалидирует кеш URL пачки ссылок за один запрос"""
+    if not short_codes:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for short_code in short_codes:
+        url_l1_cache.delete(short_code)
+        pipe.delete(get_url_cache_key(short_code), get_link_info_cache_key(short_code))
+        pipe.publish(URL_INVALIDATION_CHANNEL, short_code)
+    await pipe.execute()
+
+async def purge_link_keys(short_codes: list) -> None:
+    """Удаляет кеш и буферизованную статистику удаленных ссылок за один запрос"""
+    if not short_codes:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for short_code in short_codes:
+        url_l1_cache.delete(short_code)
+        pipe.delete(
+            get_url_cache_key(short_code), get_link_info_cache_key(short_code),
+            f"clicks:{short_code}", f"last_access:{short_code}"
+        )
+        pipe.publish(URL_INVALIDATION_CHANNEL, short_code)
+    pipe.srem("links_to_sync", *short_codes)
+    await pipe.execute()
+
+async def cache_urls_if_missing(entries: list) -> None:
+    """Кеширует пары (short_code, original_url, expire), которых еще нет в Redis"""
+    if not entries:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for short_code, original_url, expire in entries:
+        pipe.set(get_url_cache_key(short_code), original_url, ex=expire or settings.CACHE_EXPIRY, nx=True)
+    await pipe.execute()
+
+async def cache_url(short_code: str, original_url: str, expire: Optional[int] = None) -> None:
+    """Кеширует соответствие короткого кода оригинальному URL с опциональным TTL"""
+    key = get_url_cache_key(short_code)
+    await redis_client.set(key, original_url, ex=expire or settings.CACHE_EXPIRY)
+    url_l1_cache.set(short_code, original_url, expire or settings.CACHE_EXPIRY)
+
+async def get_cached_link_info(short_code: str) -> Optional[str]:
+    """Получает закешированный JSON информации о ссылке"""
+    return await redis_client.get(get_link_info_cache_key(short_code))
+
+async def cache_link_info(short_code: str, link_info: str, expire: int) -> None:
+    """Кеширует JSON информации о ссылке на короткое время"""
+    await redis_client.set(get_link_info_cache_key(short_code), link_info, ex=expire)
+
+async def get_cached_search(url_hash: str) -> Optional[str]:
+    """Получает закешированный JSON результатов поиска по отпечатку URL"""
+    return await redis_client.get(get_search_cache_key(url_hash))
+
+async def cache_search(url_hash: str, search_result: str, expire: int) -> None:
+    """Кеширует JSON результатов поиска на короткое время"""
+    await redis_client.set(get_search_cache_key(url_hash), search_result, ex=expire)
+
+async def invalidate_search_cache(*url_hashes: Optional[str]) -> None:
+    """Сбрасывает результаты поиска для отпечатков измененных ссылок"""
+    keys = [get_search_cache_key(url_hash) for url_hash in url_hashes if url_hash]
+    if keys:
+        await redis_client.delete(*keys)
+
+async def run_invalidation_listener() -> None:
+    """Слушает каналы инвалидации и сбрасывает записи кешей этого воркера"""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(URL_INVALIDATION_CHANNEL, USER_INVALIDATION_CHANNEL)
+        while True:
+            message = await pubsub.get_message(timeout=1.0)
+            if not message or not isinstance(message.get("data"), str):
+                continue
+            if message.get("channel") == USER_INVALIDATION_CHANNEL:
+                user_l1_cache.delete(message["data"])
+            else:
+                url_l1_cache.delete(message["data"])
+    finally:
+        await pubsub.aclose()
+
+async def close() -> None:
+    """Закрывает соединения общего пула"""
+    await redis_client.aclose()
+    await redis_binary_client.aclose()
+    # Клиент, созданный поверх готового пула, сам пул не закрывает
+    await redis_pool.disconnect()
+    await redis_binary_pool.disconnect()
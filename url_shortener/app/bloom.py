@@ -0,0 +1,209 @@
+import math
+import os
+import hashlib
+from sqlalchemy import select
+
+from app import async_cache
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Link
+from app.metrics import KNOWN_CODES_CHECKS
+
+KNOWN_CODES_KEY = "known_codes"  # Считающий фильтр Блума известных коротких кодов
+KNOWN_CODES_BUILD_KEY = "known_codes:building"  # Фильтр, который сейчас перестраивается
+KNOWN_CODES_META_KEY = "known_codes:meta"  # Параметры, с которыми построен фильтр
+KNOWN_CODES_LOCK_KEY = "known_codes:lock"  # Не дает нескольким воркерам строить фильтр одновременно
+
+COUNTER_BITS = 4
+COUNTER_MAX = 2 ** COUNTER_BITS - 1
+COUNTER_TYPE = f"u{COUNTER_BITS}"
+REBUILD_CHUNK_SIZE = 5000
+
+# Добавляет код в фильтр и в перестраиваемую копию, если они существуют.
+# Пока фильтр не построен, ключа нет, и проверки считают любой код возможным.
+# KEYS: фильтр, перестраиваемый фильтр; ARGV: битовые смещения счетчиков
+ADD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for i = 1, #ARGV do
+            redis.call('BITFIELD', key, 'OVERFLOW', 'SAT', 'INCRBY', 'u4', ARGV[i], 1)
+        end
+    end
+end
+return true
+"""
+
+# Уменьшает счетчики удаленного кода; насыщенные счетчики не трогаются,
+# иначе можно получить ложноотрицательный ответ для других кодов.
+# KEYS: фильтр; ARGV: битовые смещения счетчиков
+REMOVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+for i = 1, #ARGV do
+    local value = redis.call('BITFIELD', KEYS[1], 'GET', 'u4', ARGV[i])[1]
+    if value > 0 and value < 15 then
+        redis.call('BITFIELD', KEYS[1], 'INCRBY', 'u4', ARGV[i], -1)
+    end
+end
+return true
+"""
+
+add_script = async_cache.redis_client.register_script(ADD_SCRIPT)
+remove_script = async_cache.redis_client.register_script(REMOVE_SCRIPT)
+
+# Проверки фильтра и избежанные обращения к БД
+known_codes_stats = {"checks": 0, "db_lookups_avoided": 0}
+KNOWN_CODES_CHECKS.set_function(lambda: {(result,): value for result, value in known_codes_stats.items()})
+
+def bloom_parameters(expected_items: int, false_positive_rate: float) -> tuple:
+    """Подбирает число счетчиков и хеш-функций под объем и долю ложных срабатываний"""
+    expected_items = max(expected_items, 1)
+    num_counters = math.ceil(-expected_items * math.log(false_positive_rate) / math.log(2) ** 2)
+    num_hashes = max(1, round(num_counters / expected_items * math.log(2)))
+    return num_counters, num_hashes
+
+NUM_COUNTERS, NUM_HASHES = bloom_parameters(
+    settings.BLOOM_EXPECTED_ITEMS,
+    settings.BLOOM_FALSE_POSITIVE_RATE
+)
+FILTER_SIGNATURE = f"{NUM_COUNTERS}:{NUM_HASHES}:{COUNTER_BITS}"
+
+def get_counter_offsets(short_code: str) -> list:
+    """Битовые смещения счетчиков кода (двойное хеширование)"""
+    digest = hashlib.blake2b(short_code.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [((h1 + i * h2) % NUM_COUNTERS) * COUNTER_BITS for i in range(NUM_HASHES)]
+
+async def might_exist(short_code: str) -> bool:
+    """False только если кода точно нет; пока фильтр не готов, всегда True"""
+    offsets = get_counter_offsets(short_code)
+    command = ["BITFIELD", KNOWN_CODES_KEY]
+    for offset in offsets:
+        command.extend(("GET", COUNTER_TYPE, offset))
+
+    pipe = async_cache.redis_client.pipeline(transaction=False)
+    pipe.get(KNOWN_CODES_META_KEY)
+    pipe.exists(KNOWN_CODES_KEY)
+    pipe.execute_command(*command)
+    signature, exists, counters = await pipe.execute()
+
+    # Фильтр с другими параметрами дал бы ложноотрицательные ответы
+    if not exists or signature != FILTER_SIGNATURE:
+        return True
+
+    known_codes_stats["checks"] += 1
+    if all(counters):
+        return True
+
+    known_codes_stats["db_lookups_avoided"] += 1
+    return False
+
+async def add_known_code(short_code: str) -> None:
+    """Добавляет код в фильтр; вызывается до коммита новой ссылки"""
+    await add_script(
+        keys=[KNOWN_CODES_KEY, KNOWN_CODES_BUILD_KEY],
+        args=get_counter_offsets(short_code),
+        client=async_cache.redis_client
+    )
+
+async def add_known_codes(short_codes: list) -> None:
+    """Добавляет пачку новых кодов в фильтр за один запрос"""
+    if not short_codes:
+        return
+
+    pipe = async_cache.redis_client.pipeline(transaction=False)
+    for short_code in short_codes:
+        await add_script(keys=[KNOWN_CODES_KEY, KNOWN_CODES_BUILD_KEY], args=get_counter_offsets(short_code), client=pipe)
+    await pipe.execute()
+
+async def remove_known_code(short_code: str) -> None:
+    """Убирает удаленный код из фильтра"""
+    await remove_script(
+        keys=[KNOWN_CODES_KEY],
+        args=get_counter_offsets(short_code),
+        client=async_cache.redis_client
+    )
+
+async def remove_known_codes(short_codes: list) -> None:
+    """Убирает пачку удаленных кодов из фильтра за один запрос"""
+    if not short_codes:
+        return
+
+    pipe = async_cache.redis_client.pipeline(transaction=False)
+    for short_code in short_codes:
+        await remove_script(keys=[KNOWN_CODES_KEY], args=get_counter_offsets(short_code), client=pipe)
+    await pipe.execute()
+
+async def rebuild_known_codes() -> int:
+    """Строит фильтр заново по таблице links и атомарно подменяет им текущий"""
+    client = async_cache.redis_client
+
+    # Пустой ключ нужен сразу, чтобы коды, созданные во время перестройки, попали в новый фильтр
+    pipe = client.pipeline(transaction=False)
+    pipe.delete(KNOWN_CODES_BUILD_KEY)
+    pipe.execute_command("BITFIELD", KNOWN_CODES_BUILD_KEY, "SET", COUNTER_TYPE, 0, 0)
+    await pipe.execute()
+
+    total = 0
+    last_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            rows = (await db.execute(
+                select(Link.id, Link.short_code)
+                .filter(Link.id > last_id)
+                .order_by(Link.id)
+                .limit(REBUILD_CHUNK_SIZE)
+            )).all()
+            if not rows:
+                break
+
+            pipe = client.pipeline(transaction=False)
+            for row in rows:
+                command = ["BITFIELD", KNOWN_CODES_BUILD_KEY, "OVERFLOW", "SAT"]
+                for offset in get_counter_offsets(row.short_code):
+                    command.extend(("INCRBY", COUNTER_TYPE, offset, 1))
+                pipe.execute_command(*command)
+            await pipe.execute()
+
+            total += len(rows)
+            last_id = rows[-1].id
+
+    pipe = client.pipeline(transaction=True)
+    pipe.rename(KNOWN_CODES_BUILD_KEY, KNOWN_CODES_KEY)
+    pipe.set(KNOWN_CODES_META_KEY, FILTER_SIGNATURE)
+    await pipe.execute()
+
+    return total
+
+async def ensure_known_codes(force: bool = False) -> bool:
+    """Строит фильтр, если его нет, он построен с другими параметрами или force=True"""
+    client = async_cache.redis_client
+
+    pipe = client.pipeline(transaction=False)
+    pipe.get(KNOWN_CODES_META_KEY)
+    pipe.exists(KNOWN_CODES_KEY)
+    signature, exists = await pipe.execute()
+    if not force and exists and signature == FILTER_SIGNATURE:
+        return False
+
+    if not await client.set(KNOWN_CODES_LOCK_KEY, os.getpid(), nx=True, ex=600):
+        return False
+
+    try:
+        total = await rebuild_known_codes()
+        print(f"Фильтр известных кодов построен: {total} ссылок")
+    finally:
+        await client.delete(KNOWN_CODES_LOCK_KEY)
+
+    return True
+
+def get_known_codes_stats() -> dict:
+    """Возвращает параметры фильтра и число избежанных запросов к БД"""
+    return {
+        "counters": NUM_COUNTERS,
+        "hashes": NUM_HASHES,
+        "false_positive_rate": settings.BLOOM_FALSE_POSITIVE_RATE,
+        **known_codes_stats
+    }
@@ -1,40 +1,256 @@
-import json
+import os
 import redis
+import socket
+import secrets
 import hashlib
+import struct
+import zlib
 from app.config import settings
 from app.json_utils import dumps, loads
+from app.local_cache import LocalCache
+from app.metrics import L1_CACHE_EVENTS, L1_CACHE_ENTRIES
+from app.click_codec import encode_click, decode_click
 from typing import Optional
 from datetime import datetime, timezone
 
-redis_client = redis.Redis(
+redis_connection_kwargs = dict(
     host=settings.REDIS_HOST,
     port=settings.REDIS_PORT,
     db=settings.REDIS_DB,
     username=settings.REDIS_USERNAME if settings.REDIS_USERNAME else None,
     password=settings.REDIS_PASSWORD if settings.REDIS_PASSWORD else None,
-    decode_responses=True
+    decode_responses=True,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL
 )
 
+# Пул ограничен: при нехватке соединений команды ждут до REDIS_POOL_TIMEOUT секунд, а не открывают новые
+redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    **redis_connection_kwargs
+))
+# Записи потока кликов двоичные, а decode_responses декодирует ответы как UTF-8, поэтому поток читается этим клиентом
+redis_binary_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    **{**redis_connection_kwargs, "decode_responses": False}
+))
+
 URL_CACHE_PREFIX = "url:"  # Для кеширования соответствия short_code -> original_url
+LINK_INFO_CACHE_PREFIX = "link_info:"  # Для кеширования ответа GET /links/{short_code}
+SEARCH_CACHE_PREFIX = "search:"  # Для кеширования ответа GET /links/search по отпечатку URL
+URL_INVALIDATION_CHANNEL = "url_invalidation"  # Канал pub/sub для сброса L1-кеша во всех воркерах
+USER_CACHE_PREFIX = "user:"  # Для кеширования пользователя по user_id
+USER_INVALIDATION_CHANNEL = "user_invalidation"  # Канал pub/sub для сброса кеша пользователей во всех воркерах
+CLICK_STREAM_KEY = "click_stream"  # Поток событий кликов (или префикс шардов)
+CLICK_STREAM_GROUP = "stats_sync"  # Группа потребителей, переносящих клики в БД
+CLICK_DICT_PREFIX = "click_dict:"  # Словари user-agent и referer по эпохам: текст -> id и id -> текст
+CLICK_DICT_EPOCH_KEY = "click_dict:epoch"  # Текущая эпоха словарей; новая, если словари пропали из Redis
+CLICK_DICT_FIELDS = ("user_agent", "referer")
+STALE_CLICK_DICT = -1  # Ответ скриптов, если эпоха словарей в Redis сменилась
+
+# L1-кеш в памяти процесса перед ключами url: в Redis
+url_l1_cache = LocalCache(
+    max_size=settings.L1_CACHE_MAX_SIZE,
+    ttl=settings.L1_CACHE_TTL
+)
+
+# Пользователи по user_id и расшифрованные токены до их exp
+user_l1_cache = LocalCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.USER_CACHE_TTL
+)
+token_l1_cache = LocalCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+)
+
+# Записи словарей кликов не меняются, поэтому кешируются в процессе в обе стороны:
+# id текстов текущей эпохи и тексты по (эпоха, поле, id)
+click_text_ids = LocalCache(
+    max_size=settings.CLICK_DICT_CACHE_SIZE,
+    ttl=settings.CLICK_DICT_CACHE_TTL
+)
+click_texts = LocalCache(
+    max_size=settings.CLICK_DICT_CACHE_SIZE,
+    ttl=settings.CLICK_DICT_CACHE_TTL
+)
+# Эпоха словарей, к которой относятся id в click_text_ids; None — еще не известна
+click_dict_state = {"epoch": None}
+
+# Счетчики L1-кешей попадают в /metrics без отдельного учета
+L1_CACHES = {
+    "url": url_l1_cache, "user": user_l1_cache, "token": token_l1_cache,
+    "click_text_ids": click_text_ids, "click_texts": click_texts
+}
+L1_CACHE_EVENT_NAMES = ("hits", "misses", "evictions", "expirations", "invalidations")
+L1_CACHE_EVENTS.set_function(lambda: {
+    (name, event): getattr(cache, event) for name, cache in L1_CACHES.items() for event in L1_CACHE_EVENT_NAMES
+})
+L1_CACHE_ENTRIES.set_function(lambda: {(name,): len(cache) for name, cache in L1_CACHES.items()})
+
+def get_click_stream_key(short_code: str) -> str:
+    """Возвращает ключ шарда потока кликов для короткого кода"""
+    if settings.CLICK_STREAM_SHARDS <= 1:
+        return CLICK_STREAM_KEY
+    shard = zlib.crc32(short_code.encode()) % settings.CLICK_STREAM_SHARDS
+    return f"{CLICK_STREAM_KEY}:{shard}"
+
+def get_click_stream_keys() -> list:
+    """Возвращает ключи всех шардов потока кликов"""
+    if settings.CLICK_STREAM_SHARDS <= 1:
+        return [CLICK_STREAM_KEY]
+    return [f"{CLICK_STREAM_KEY}:{shard}" for shard in range(settings.CLICK_STREAM_SHARDS)]
+
+def get_click_consumer_name() -> str:
+    """Имя потребителя потока кликов для текущего процесса"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def parse_click_events(stream, entries: list) -> list:
+    """Превращает записи потока, прочитанные двоичным клиентом, в тройки (поток, id записи, данные клика)"""
+    if isinstance(stream, bytes):
+        stream = stream.decode()
+    events = []
+    for entry_id, fields in entries:
+        try:
+            data = decode_click(fields[b"data"]) if fields else None
+        except (KeyError, ValueError, IndexError, struct.error):
+            data = None
+        # Поврежденные записи тоже возвращаются, чтобы их можно было подтвердить
+        events.append((stream, entry_id.decode() if isinstance(entry_id, bytes) else entry_id, data))
+    return events
+
+def get_click_dict_keys(epoch: int, field: str) -> list:
+    """Ключи словаря поля в эпохе: текст -> id, id -> текст и счетчик id"""
+    prefix = f"{CLICK_DICT_PREFIX}{epoch}:{field}"
+    return [prefix, f"{prefix}:ids", f"{prefix}:next"]
+
+def new_click_dict_epoch() -> int:
+    """Случайная эпоха, чтобы после потери Redis не повторить прежнюю"""
+    return secrets.randbelow(0xFFFFFFFF) + 1
+
+def set_click_dict_epoch(epoch: Optional[int]) -> None:
+    """Сбрасывает кеши словарей процесса, если эпоха словарей сменилась"""
+    if epoch != click_dict_state["epoch"]:
+        click_text_ids.clear()
+        click_texts.clear()
+        click_dict_state["epoch"] = epoch
+
+def is_click_dict_text(text: Optional[str]) -> bool:
+    """Слишком длинные значения хранятся в записи, чтобы уникальные referer не раздували словарь"""
+    return bool(text) and len(text) <= settings.CLICK_DICT_MAX_TEXT_LENGTH
+
+def get_unresolved_click_text_ids(events: list) -> dict:
+    """id словарей, текстов которых нет в кеше процесса: {(эпоха, поле): [id, ...]}"""
+    unresolved = {}
+    for _, _, data in events:
+        if not data:
+            continue
+        for field in CLICK_DICT_FIELDS:
+            text_id = data[f"{field}_id"]
+            if text_id and click_texts.get((data["dict_epoch"], field, text_id)) is None:
+                unresolved.setdefault((data["dict_epoch"], field), set()).add(text_id)
+    return {key: list(ids) for key, ids in unresolved.items()}
+
+def apply_click_texts(events: list) -> None:
+    """Подставляет тексты из кеша процесса по id; id, пропавшие из словаря, дают None"""
+    for _, _, data in events:
+        if not data:
+            continue
+        epoch = data.pop("dict_epoch")
+        for field in CLICK_DICT_FIELDS:
+            text_id = data.pop(f"{field}_id")
+            if text_id:
+                data[field] = click_texts.get((epoch, field, text_id))
+
+def cache_click_texts(epoch: int, field: str, ids: list, texts: list) -> None:
+    for text_id, text in zip(ids, texts):
+        if text is not None:
+            click_texts.set((epoch, field, text_id), text)
+            if epoch == click_dict_state["epoch"]:
+                click_text_ids.set((field, text), text_id)
+
+def group_click_event_ids(events: list) -> dict:
+    """Группирует id событий по шардам потока"""
+    grouped = {}
+    for stream, entry_id, _ in events:
+        grouped.setdefault(stream, []).append(entry_id)
+    return grouped
 
 def get_url_cache_key(short_code: str) -> str:
     """Формирует ключ кеша для короткого кода"""
     return f"{URL_CACHE_PREFIX}{short_code}"
 
+def get_search_cache_key(url_hash: str) -> str:
+    """Формирует ключ для кеширования результатов поиска по отпечатку URL"""
+    return f"{SEARCH_CACHE_PREFIX}{url_hash}"
+
+def get_link_info_cache_key(short_code: str) -> str:
+    """Формирует ключ кеша информации о ссылке"""
+    return f"{LINK_INFO_CACHE_PREFIX}{short_code}"
+
 def get_cached_url(short_code: str) -> str:
-    """Получает оригинальный URL из кеша по короткому коду"""
+    """Получает оригинальный URL из кеша по короткому коду (сначала L1, затем Redis)"""
+    original_url = url_l1_cache.get(short_code)
+    if original_url is not None:
+        return original_url
+
     key = get_url_cache_key(short_code)
-    return redis_client.get(key)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    original_url, ttl_ms = pipe.execute()
+
+    if original_url:
+        # TTL ключа в Redis учитывает срок действия ссылки, поэтому L1 не переживет его
+        url_l1_cache.set(short_code, original_url, l1_ttl_from_pttl(ttl_ms))
+
+    return original_url
 
 def invalidate_url_cache(short_code: str) -> None:
     """Инвалидирует кеш URL при обновлении или удалении"""
     keys = [
-        get_url_cache_key(short_code)
+        get_url_cache_key(short_code),
+        get_link_info_cache_key(short_code)
     ]
 
+    url_l1_cache.delete(short_code)
+
     if keys:
-        redis_client.delete(*keys)
-    
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.publish(URL_INVALIDATION_CHANNEL, short_code)
+        pipe.execute()
+
+def l1_ttl_from_pttl(ttl_ms: Optional[int]) -> Optional[float]:
+    """Переводит PTTL ключа Redis в TTL записи L1-кеша"""
+    return ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else None
+
+def _handle_invalidation_message(message: dict) -> None:
+    """Сбрасывает запись L1-кеша по сообщению из канала инвалидации"""
+    short_code = message.get("data")
+    if isinstance(short_code, str):
+        url_l1_cache.delete(short_code)
+
+def _handle_user_invalidation_message(message: dict) -> None:
+    """Сбрасывает пользователя в кеше процесса по сообщению из канала инвалидации"""
+    user_id = message.get("data")
+    if isinstance(user_id, str):
+        user_l1_cache.delete(user_id)
+
+def start_invalidation_listener():
+    """Подписывается на каналы инвалидации и обрабатывает сообщения в фоновом потоке"""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{
+        URL_INVALIDATION_CHANNEL: _handle_invalidation_message,
+        USER_INVALIDATION_CHANNEL: _handle_user_invalidation_message
+    })
+    return pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+def get_l1_cache_stats() -> dict:
+    """Возвращает счетчики L1-кеша для подбора его размера"""
+    return url_l1_cache.stats()
+
 def add_popular_url(short_code: str) -> None:
     """Добавляет URL в список популярных"""
     redis_client.sadd("popular_urls", short_code)
@@ -55,9 +271,11 @@ def increment_access_counter(short_code: str) -> int:
     
     return count
 
-def get_links_to_sync() -> set:
-    """Получает множество ссылок, требующих синхронизации"""
-    return redis_client.smembers("links_to_sync")
+def get_links_to_sync(limit: Optional[int] = None) -> set:
+    """Получает ссылки, требующие синхронизации; с limit — не больше limit случайных, не читая все множество"""
+    if limit is None:
+        return redis_client.smembers("links_to_sync")
+    return set(redis_client.srandmember("links_to_sync", limit))
 
 def get_buffered_clicks(short_code: str) -> int:
     """Получает количество буферизованных кликов из Redis"""
@@ -65,10 +283,8 @@ def get_buffered_clicks(short_code: str) -> int:
     count = redis_client.get(counter_key)
     return int(count) if count else 0
 
-def get_buffered_last_access(short_code: str) -> Optional[datetime]:
-    """Получает буферизованное время последнего доступа из Redis"""
-    last_access_key = f"last_access:{short_code}"
-    last_access_str = redis_client.get(last_access_key)
+def parse_last_access(last_access_str: Optional[str]) -> Optional[datetime]:
+    """Разбирает буферизованное время последнего доступа"""
     if last_access_str:
         try:
             return datetime.fromisoformat(last_access_str)
@@ -76,6 +292,11 @@ def get_buffered_last_access(short_code: str) -> Optional[datetime]:
             return None
     return None
 
+def get_buffered_last_access(short_code: str) -> Optional[datetime]:
+    """Получает буферизованное время последнего доступа из Redis"""
+    last_access_key = f"last_access:{short_code}"
+    return parse_last_access(redis_client.get(last_access_key))
+
 def reset_buffered_stats(short_code: str) -> None:
     """Сбрасывает буферизованную статистику для ссылки"""
     counter_key = f"clicks:{short_code}"
@@ -83,32 +304,245 @@ def reset_buffered_stats(short_code: str) -> None:
     redis_client.delete(counter_key, last_access_key)
     redis_client.srem("links_to_sync", short_code)
 
+# Разрешает URL и записывает клик за один запрос к Redis.
+# Запись с id словарей не добавляется, если их эпоха уже не текущая: возвращается -1.
+# KEYS: url:, clicks:, last_access:, links_to_sync, поток кликов, эпоха словарей
+# ARGV: short_code, время доступа, запись клика (click_codec), 1 - разрешать URL / 0 - только записать клик,
+#       ограничение длины потока, эпоха словарей записи (0 - запись без id словарей)
+RECORD_CLICK_SCRIPT = """
+if ARGV[6] ~= '0' and redis.call('GET', KEYS[6]) ~= ARGV[6] then
+    return -1
+end
+local url = false
+if ARGV[4] == '1' then
+    url = redis.call('GET', KEYS[1])
+    if not url then
+        return false
+    end
+end
+redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[3], ARGV[2])
+redis.call('SADD', KEYS[4], ARGV[1])
+redis.call('XADD', KEYS[5], 'MAXLEN', '~', ARGV[5], '*', 'data', ARGV[3])
+if url then
+    return {url, redis.call('PTTL', KEYS[1])}
+end
+return true
+"""
+
+record_click_script = redis_client.register_script(RECORD_CLICK_SCRIPT)
+
+# Возвращает текущую эпоху словарей кликов, создавая ее при первом обращении или после потери Redis.
+# KEYS: эпоха словарей
+# ARGV: новая эпоха
+CLICK_DICT_EPOCH_SCRIPT = """
+local epoch = redis.call('GET', KEYS[1])
+if epoch then
+    return tonumber(epoch)
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return tonumber(ARGV[1])
+"""
+
+click_dict_epoch_script = redis_client.register_script(CLICK_DICT_EPOCH_SCRIPT)
+
+# Возвращает id текста в словаре поля, добавляя новый текст; 0, если словарь заполнен;
+# -1, если эпоха словарей уже не текущая.
+# KEYS: эпоха словарей, текст -> id, id -> текст, счетчик id
+# ARGV: эпоха словаря, текст, предельный размер словаря
+INTERN_CLICK_TEXT_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+local id = redis.call('HGET', KEYS[2], ARGV[2])
+if id then
+    return tonumber(id)
+end
+if redis.call('HLEN', KEYS[2]) >= tonumber(ARGV[3]) then
+    return 0
+end
+id = redis.call('INCR', KEYS[4])
+redis.call('HSET', KEYS[2], ARGV[2], id)
+redis.call('HSET', KEYS[3], id, ARGV[2])
+return id
+"""
+
+intern_click_text_script = redis_client.register_script(INTERN_CLICK_TEXT_SCRIPT)
+
+# Сбрасывает буферизованную статистику пачки ссылок после записи в БД.
+# Счетчик уменьшается на записанное значение, поэтому клики, пришедшие во время
+# синхронизации, не теряются: такая ссылка остается в links_to_sync.
+# KEYS: links_to_sync, затем пары clicks:, last_access: для каждой ссылки
+# ARGV: пары short_code, записанное количество кликов
+RESET_BUFFERED_STATS_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local clicks_key = KEYS[i + 1]
+    local flushed = tonumber(ARGV[i + 1])
+    local left
+    if flushed > 0 then
+        left = redis.call('DECRBY', clicks_key, flushed)
+    else
+        left = tonumber(redis.call('GET', clicks_key) or '0')
+    end
+    if left <= 0 then
+        redis.call('DEL', clicks_key, KEYS[i + 2])
+        redis.call('SREM', KEYS[1], ARGV[i])
+    end
+end
+return true
+"""
+
+def record_click_script_keys(short_code: str) -> list:
+    """Ключи, которые затрагивает скрипт записи клика"""
+    return [
+        get_url_cache_key(short_code),
+        f"clicks:{short_code}",
+        f"last_access:{short_code}",
+        "links_to_sync",
+        get_click_stream_key(short_code),
+        CLICK_DICT_EPOCH_KEY
+    ]
+
+def record_click_script_args(short_code: str, client_info: dict, resolve: bool, text_ids: tuple = (0, 0, 0)) -> list:
+    """Аргументы скрипта записи клика"""
+    clicked_at = datetime.now(timezone.utc)
+    return [
+        short_code, clicked_at.isoformat(), build_click_record(short_code, client_info, text_ids, clicked_at),
+        "1" if resolve else "0", settings.CLICK_STREAM_MAXLEN, text_ids[0]
+    ]
+
+def combine_click_text_ids(epoch: int, text_ids: list) -> tuple:
+    """Эпоха и id клика; если эпоха сменилась, пока тексты добавлялись в словари, тексты остаются в записи"""
+    if epoch != click_dict_state["epoch"] or not any(text_ids):
+        return 0, 0, 0
+    return (epoch, *text_ids)
+
+def get_click_dict_epoch() -> int:
+    """Текущая эпоха словарей; запрашивается у Redis, только пока неизвестна процессу"""
+    if click_dict_state["epoch"] is None:
+        set_click_dict_epoch(click_dict_epoch_script(
+            keys=[CLICK_DICT_EPOCH_KEY], args=[new_click_dict_epoch()], client=redis_client
+        ))
+    return click_dict_state["epoch"]
+
+def get_click_text_id(epoch: int, field: str, text: Optional[str]) -> int:
+    """id текста в словаре поля; 0 — текст хранится в самой записи клика"""
+    if not is_click_dict_text(text):
+        return 0
+    text_id = click_text_ids.get((field, text))
+    if text_id is None:
+        text_id = intern_click_text_script(
+            keys=[CLICK_DICT_EPOCH_KEY, *get_click_dict_keys(epoch, field)],
+            args=[epoch, text, settings.CLICK_DICT_MAX_SIZE], client=redis_client
+        )
+        if text_id == STALE_CLICK_DICT:
+            set_click_dict_epoch(None)
+            return 0
+        # Заполненный словарь тоже кешируется, чтобы не спрашивать Redis на каждом клике
+        click_text_ids.set((field, text), text_id)
+    return text_id
+
+def get_click_text_ids(client_info: dict) -> tuple:
+    """Эпоха словарей и id user-agent и referer клика в ее словарях"""
+    epoch = get_click_dict_epoch()
+    return combine_click_text_ids(
+        epoch, [get_click_text_id(epoch, field, client_info.get(field)) for field in CLICK_DICT_FIELDS]
+    )
+
+def run_record_click_script(short_code: str, client_info: dict, resolve: bool):
+    """Выполняет скрипт записи клика; если словари в Redis пересозданы, повторяет его с текстами в записи"""
+    keys = record_click_script_keys(short_code)
+    result = record_click_script(
+        keys=keys, args=record_click_script_args(short_code, client_info, resolve, get_click_text_ids(client_info)),
+        client=redis_client
+    )
+    if result == STALE_CLICK_DICT:
+        set_click_dict_epoch(None)
+        result = record_click_script(keys=keys, args=record_click_script_args(short_code, client_info, resolve),
+                                     client=redis_client)
+    return result
+
+def resolve_and_record_click(short_code: str, client_info: dict) -> Optional[str]:
+    """Возвращает URL из кеша и учитывает клик за один запрос; None при промахе кеша"""
+    original_url = url_l1_cache.get(short_code)
+    if original_url is not None:
+        run_record_click_script(short_code, client_info, False)
+        return original_url
+
+    result = run_record_click_script(short_code, client_info, True)
+    if not result:
+        return None
+
+    original_url, ttl_ms = result
+    url_l1_cache.set(short_code, original_url, l1_ttl_from_pttl(ttl_ms))
+    return original_url
+
+def build_click_record(short_code: str, client_info: dict, text_ids: tuple = (0, 0, 0),
+                       clicked_at: Optional[datetime] = None) -> bytes:
+    """Формирует двоичную запись о клике для буфера в Redis"""
+    clicked_at = clicked_at or datetime.now(timezone.utc)
+    dict_epoch, user_agent_id, referer_id = text_ids
+    return encode_click(
+        short_code, int(clicked_at.timestamp() * 1000), client_info.get("ip_address"),
+        dict_epoch, user_agent_id, client_info.get("user_agent"), referer_id, client_info.get("referer")
+    )
+
 def add_click_details(short_code: str, client_info: dict) -> None:
-    """Добавляет информацию о клике в список ожидающих"""
-    click_data = {
-        "short_code": short_code,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "ip_address": client_info.get("ip_address", ""),
-        "user_agent": client_info.get("user_agent", ""),
-        "referer": client_info.get("referer", "")
-    }
-    redis_client.lpush(f"click_details:{short_code}", json.dumps(click_data))
-
-def get_and_clear_click_details(short_code: str, limit: int = 100) -> list:
-    """Получает и удаляет информацию о кликах"""
-    key = f"click_details:{short_code}"
-    details = []
-    
-    for _ in range(limit):
-        data = redis_client.rpop(key)
-        if not data:
-            break
+    """Добавляет информацию о клике в поток кликов"""
+    click_record = build_click_record(short_code, client_info, get_click_text_ids(client_info))
+    redis_client.xadd(
+        get_click_stream_key(short_code), {"data": click_record},
+        maxlen=settings.CLICK_STREAM_MAXLEN, approximate=True
+    )
+
+def ensure_click_stream_group() -> None:
+    """Создает группу потребителей для всех шардов потока кликов"""
+    for stream in get_click_stream_keys():
         try:
-            details.append(json.loads(data))
-        except json.JSONDecodeError:
-            continue
-    
-    return details
+            redis_client.xgroup_create(stream, CLICK_STREAM_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+def read_click_events(consumer: str, count: int) -> list:
+    """Читает пачку событий кликов, сначала забирая зависшие у упавших потребителей"""
+    events = []
+    for stream in get_click_stream_keys():
+        # Redis 7 добавляет в ответ третий элемент — удаленные записи, Redis 6.2 возвращает два
+        reply = redis_binary_client.xautoclaim(
+            stream, CLICK_STREAM_GROUP, consumer,
+            min_idle_time=settings.CLICK_STREAM_CLAIM_IDLE_MS, count=count
+        )
+        events.extend(parse_click_events(stream, reply[1]))
+
+    if len(events) < count:
+        response = redis_binary_client.xreadgroup(
+            CLICK_STREAM_GROUP, consumer,
+            {stream: ">" for stream in get_click_stream_keys()},
+            count=count - len(events)
+        )
+        for stream, entries in response or []:
+            events.extend(parse_click_events(stream, entries))
+
+    resolve_click_texts(events)
+    return events
+
+def resolve_click_texts(events: list) -> None:
+    """Подставляет в события user-agent и referer из словарей"""
+    for (epoch, field), ids in get_unresolved_click_text_ids(events).items():
+        cache_click_texts(epoch, field, ids, redis_client.hmget(get_click_dict_keys(epoch, field)[1], ids))
+    apply_click_texts(events)
+
+def ack_click_events(events: list) -> None:
+    """Подтверждает и удаляет обработанные события кликов"""
+    if not events:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for stream, entry_ids in group_click_event_ids(events).items():
+        pipe.xack(stream, CLICK_STREAM_GROUP, *entry_ids)
+        pipe.xdel(stream, *entry_ids)
+    pipe.execute()
 
 def cache_url(short_code: str, original_url: str, expire: Optional[int] = None) -> None:
     """Кеширует соответствие короткого кода оригинальному URL с опциональным TTL"""
@@ -116,4 +550,6 @@ def cache_url(short_code: str, original_url: str, expire: Optional[int] = None)
     if expire:
         redis_client.set(key, original_url, ex=expire)
     else:
-        redis_client.set(key, original_url, ex=settings.CACHE_EXPIRY)
\ No newline at end of file
+        redis_client.set(key, original_url, ex=settings.CACHE_EXPIRY)
+
+    url_l1_cache.set(short_code, original_url, expire or settings.CACHE_EXPIRY)
\ No newline at end of file
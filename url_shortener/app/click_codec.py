@@ -0,0 +1,116 @@
+import socket
+import struct
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.json_utils import loads
+
+CLICK_RECORD_VERSION = 1
+
+# Запись версии 1:
+#   заголовок <BQIII: версия, время клика в мс Unix, эпоха словарей (0 — записи не нужны словари),
+#   id user-agent и id referer в словарях этой эпохи (0 — текст в записи);
+#   IP: байт вида (0 — нет, 4 — IPv4, 6 — IPv6, 1 — текст) и 4/16 байт адреса или байт длины и текст;
+#   user-agent и referer с id 0: длина <H и UTF-8 (нулевая длина — значения нет);
+#   остаток записи — short_code в UTF-8.
+HEADER = struct.Struct("<BQIII")
+TEXT_LENGTH = struct.Struct("<H")
+MAX_INLINE_TEXT_BYTES = 0xFFFF
+
+IP_NONE = 0
+IP_TEXT = 1
+IP_V4 = 4
+IP_V6 = 6
+IP_NONE_BYTES = bytes((IP_NONE,))
+IP_V4_PREFIX = bytes((IP_V4,))
+IP_V6_PREFIX = bytes((IP_V6,))
+EMPTY_TEXT = TEXT_LENGTH.pack(0)
+
+def pack_ip(ip_address: Optional[str]) -> bytes:
+    """IP в 4 или 16 байтах; то, что не разбирается как адрес (например, имя хоста), хранится текстом"""
+    if not ip_address:
+        return IP_NONE_BYTES
+    try:
+        return IP_V4_PREFIX + socket.inet_pton(socket.AF_INET, ip_address)
+    except OSError:
+        pass
+    try:
+        return IP_V6_PREFIX + socket.inet_pton(socket.AF_INET6, ip_address)
+    except OSError:
+        encoded = ip_address.encode()[:255]
+        return bytes((IP_TEXT, len(encoded))) + encoded
+
+def unpack_ip(record: bytes, offset: int) -> tuple:
+    """Возвращает IP в текстовом виде и смещение после него"""
+    kind = record[offset]
+    offset += 1
+    if kind == IP_V4:
+        return socket.inet_ntop(socket.AF_INET, record[offset:offset + 4]), offset + 4
+    if kind == IP_V6:
+        return socket.inet_ntop(socket.AF_INET6, record[offset:offset + 16]), offset + 16
+    if kind == IP_TEXT:
+        length = record[offset]
+        offset += 1
+        return record[offset:offset + length].decode(errors="replace"), offset + length
+    if kind == IP_NONE:
+        return None, offset
+    raise ValueError(f"Неизвестный вид IP: {kind}")
+
+def pack_text(text: Optional[str]) -> bytes:
+    if not text:
+        return EMPTY_TEXT
+    encoded = text.encode()[:MAX_INLINE_TEXT_BYTES]
+    return TEXT_LENGTH.pack(len(encoded)) + encoded
+
+def unpack_text(record: bytes, offset: int) -> tuple:
+    (length,) = TEXT_LENGTH.unpack_from(record, offset)
+    offset += TEXT_LENGTH.size
+    if not length:
+        return None, offset
+    # Обрезка длинного текста могла разрезать символ UTF-8
+    return record[offset:offset + length].decode(errors="ignore"), offset + length
+
+def encode_click(short_code: str, timestamp_ms: int, ip_address: Optional[str], dict_epoch: int,
+                 user_agent_id: int, user_agent: Optional[str], referer_id: int, referer: Optional[str]) -> bytes:
+    """Кодирует клик в запись версии 1; тексты с ненулевым id в запись не попадают"""
+    parts = [HEADER.pack(CLICK_RECORD_VERSION, timestamp_ms, dict_epoch, user_agent_id, referer_id), pack_ip(ip_address)]
+    if not user_agent_id:
+        parts.append(pack_text(user_agent))
+    if not referer_id:
+        parts.append(pack_text(referer))
+    parts.append(short_code.encode())
+    return b"".join(parts)
+
+def decode_click(record: bytes) -> dict:
+    """Разбирает запись клика; user_agent и referer из словарей эпохи dict_epoch нужно подставить
+    по user_agent_id и referer_id.
+
+    Записи в JSON, оставшиеся в потоке с прошлых версий, тоже разбираются.
+    """
+    if record[:1] == b"{":
+        data = loads(record)
+        data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+        data["dict_epoch"] = data["user_agent_id"] = data["referer_id"] = 0
+        return data
+
+    version, timestamp_ms, dict_epoch, user_agent_id, referer_id = HEADER.unpack_from(record)
+    if version != CLICK_RECORD_VERSION:
+        raise ValueError(f"Неизвестная версия записи клика: {version}")
+
+    ip_address, offset = unpack_ip(record, HEADER.size)
+    user_agent = referer = None
+    if not user_agent_id:
+        user_agent, offset = unpack_text(record, offset)
+    if not referer_id:
+        referer, offset = unpack_text(record, offset)
+
+    return {
+        "short_code": record[offset:].decode(),
+        "timestamp": datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc),
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "referer": referer,
+        "dict_epoch": dict_epoch,
+        "user_agent_id": user_agent_id,
+        "referer_id": referer_id,
+    }
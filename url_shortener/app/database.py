@@ -1,27 +1,142 @@
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
 from app.config import settings
+from app.metrics import DB_QUERY_DURATION, DB_POOL_CHECKOUT_WAIT, DB_POOL_TIMEOUTS, DB_POOL_CONNECTIONS
 import os
 
 TESTING = os.environ.get("TESTING", "False") == "True"
 
+def get_async_database_url(database_url: str) -> str:
+    """Подставляет асинхронный драйвер в URL базы данных"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if database_url.startswith(prefix):
+            return "postgresql+asyncpg://" + database_url[len(prefix):]
+    if database_url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + database_url[len("sqlite://"):]
+    return database_url
+
+# Статистика асинхронного пула соединений
+db_pool_stats = {
+    "checkouts": 0,
+    "in_use": 0,
+    "timeouts": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+}
+
+class CheckoutTimingMixin:
+    """Замеряет ожидание соединения из пула и считает таймауты"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            db_pool_stats["timeouts"] += 1
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            db_pool_stats["checkouts"] += 1
+            db_pool_stats["wait_time_total"] += wait
+            db_pool_stats["wait_time_max"] = max(db_pool_stats["wait_time_max"], wait)
+            DB_POOL_CHECKOUT_WAIT.observe(wait)
+
+class InstrumentedAsyncQueuePool(CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+class InstrumentedNullPool(CheckoutTimingMixin, NullPool):
+    pass
+
 if TESTING:
     DATABASE_URL = "sqlite:///./test.db"
     engine = create_engine(
         DATABASE_URL,
         connect_args={"check_same_thread": False}
     )
+    # Каждый тест работает в своем цикле событий, поэтому соединения не переиспользуются
+    async_engine = create_async_engine(
+        get_async_database_url(DATABASE_URL),
+        poolclass=InstrumentedNullPool
+    )
 else:
-    engine = create_engine(settings.DATABASE_URL)
+    # Скриптам и миграциям хватает пула по умолчанию, но мертвые соединения им тоже не нужны
+    engine = create_engine(
+        settings.DATABASE_URL,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING
+    )
+    async_engine = create_async_engine(
+        get_async_database_url(settings.DATABASE_URL),
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING
+    )
+
+@event.listens_for(async_engine.sync_engine, "checkout")
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    db_pool_stats["in_use"] += 1
+
+@event.listens_for(async_engine.sync_engine, "checkin")
+def count_checkin(dbapi_connection, connection_record):
+    db_pool_stats["in_use"] -= 1
+
+def get_idle_connections() -> int:
+    pool = async_engine.pool
+    return pool.checkedin() if isinstance(pool, QueuePool) else 0
+
+DB_POOL_CONNECTIONS.set_function(lambda: {
+    ("in_use",): db_pool_stats["in_use"],
+    ("idle",): get_idle_connections(),
+})
 
+def get_db_pool_stats() -> dict:
+    """Настройки и загрузка асинхронного пула соединений с БД"""
+    pool = async_engine.pool
+    checkouts = db_pool_stats["checkouts"]
+    limits = {
+        "size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "timeout": settings.DB_POOL_TIMEOUT,
+        "recycle": settings.DB_POOL_RECYCLE,
+        "pre_ping": settings.DB_POOL_PRE_PING,
+    } if isinstance(pool, QueuePool) else {}
+    return {
+        "pool": type(pool).__name__,
+        **limits,
+        **db_pool_stats,
+        "idle": get_idle_connections(),
+        "wait_time_avg": db_pool_stats["wait_time_total"] / checkouts if checkouts else 0.0,
+    }
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def observe_query_time(conn, cursor, statement, parameters, context, executemany):
+    """Время запроса по типу оператора (SELECT, INSERT, ...) для /metrics"""
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_QUERY_DURATION.labels(operation).observe(time.perf_counter() - context.query_started)
+
+# Синхронные сессии остаются для скриптов и миграций
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -1,19 +1,20 @@
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from jose import JWTError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
 from app.models import User, Link
 from app.schemas import TokenData
-from app.config import settings
 from app.utils import extract_client_info
+from app.user_cache import decode_access_token, get_cached_user, cache_user
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получает текущего пользователя по токену"""
     if token is None:
@@ -26,9 +27,7 @@ async def get_current_user(
     )
     
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
+        payload = decode_access_token(token)
         username = payload.get("sub")
         user_id = payload.get("user_id")
         
@@ -39,10 +38,16 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == token_data.user_id).first()
+    # Опрашивающие API клиенты не должны каждый раз читать пользователя из БД
+    user = await get_cached_user(token_data.user_id)
+    if user is not None:
+        return user
+    
+    user = await db.scalar(select(User).filter(User.id == token_data.user_id))
     if user is None:
         raise credentials_exception
     
+    await cache_user(user)
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -57,10 +62,20 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
         )
     return current_user
 
+async def get_required_user(current_user: User = Depends(get_current_active_user)):
+    """Требует аутентифицированного пользователя"""
+    if current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Требуется аутентификация",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return current_user
+
 async def get_link_owner_or_admin(
     short_code: str,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Проверяет, что текущий пользователь является владельцем ссылки"""
     if current_user is None:
@@ -70,7 +85,7 @@ async def get_link_owner_or_admin(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    link = db.query(Link).filter(Link.short_code == short_code).first()
+    link = await db.scalar(select(Link).filter(Link.short_code == short_code))
     if not link:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,120 @@
+import os
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import select
+
+from app import async_cache
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Link
+from app.async_cache import purge_link_keys
+from app.bloom import remove_known_codes
+from app.purge import delete_expired_links, links_table
+
+EXPIRY_SCHEDULE_KEY = "link_expiry"  # Отсортированное множество short_code по времени истечения
+EXPIRY_SCHEDULE_READY_KEY = "link_expiry:ready"  # Расписание заполнено по таблице links
+EXPIRY_SCHEDULE_LOCK_KEY = "link_expiry:lock"  # Не дает нескольким воркерам заполнять расписание одновременно
+BACKFILL_CHUNK_SIZE = 5000
+
+# Атомарно забирает наступившие сроки, поэтому каждую ссылку обрабатывает один воркер.
+# KEYS: расписание; ARGV: текущее время, максимум записей
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+for i = 1, #due, 2 do
+    redis.call('ZREM', KEYS[1], due[i])
+end
+return due
+"""
+
+pop_due_script = async_cache.redis_client.register_script(POP_DUE_SCRIPT)
+
+def expiry_score(expires_at: datetime) -> float:
+    """Время истечения в секундах Unix; наивные даты считаются UTC"""
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at.timestamp()
+
+async def schedule_expiry(short_code: str, expires_at: Optional[datetime]) -> None:
+    """Ставит ссылку в расписание истечения или убирает из него бессрочную"""
+    if expires_at is None:
+        await async_cache.redis_client.zrem(EXPIRY_SCHEDULE_KEY, short_code)
+    else:
+        await async_cache.redis_client.zadd(EXPIRY_SCHEDULE_KEY, {short_code: expiry_score(expires_at)})
+
+async def schedule_expiries(expires_at_by_code: dict) -> None:
+    """Ставит в расписание пачку ссылок одним ZADD; бессрочные пропускаются"""
+    scores = {code: expiry_score(expires_at) for code, expires_at in expires_at_by_code.items() if expires_at}
+    if scores:
+        await async_cache.redis_client.zadd(EXPIRY_SCHEDULE_KEY, scores)
+
+async def unschedule_expiry(short_code: str) -> None:
+    """Убирает удаленную ссылку из расписания"""
+    await async_cache.redis_client.zrem(EXPIRY_SCHEDULE_KEY, short_code)
+
+async def pop_due_expiries(now: datetime, count: int) -> dict:
+    """Забирает из расписания до count ссылок со сроком не позже now"""
+    due = await pop_due_script(
+        keys=[EXPIRY_SCHEDULE_KEY],
+        args=[now.timestamp(), count],
+        client=async_cache.redis_client
+    )
+    return {due[i]: float(due[i + 1]) for i in range(0, len(due), 2)}
+
+async def expire_due_links() -> list:
+    """Удаляет ссылки, срок которых наступил; возвращает удаленные short_code"""
+    now = datetime.now(timezone.utc)
+    due = await pop_due_expiries(now, settings.EXPIRY_BATCH_SIZE)
+    if not due:
+        return []
+
+    try:
+        async with AsyncSessionLocal() as db:
+            short_codes = await delete_expired_links(db, links_table.c.short_code.in_(list(due)), now)
+    except Exception:
+        # Возвращаем сроки в расписание, чтобы следующий опрос повторил удаление
+        await async_cache.redis_client.zadd(EXPIRY_SCHEDULE_KEY, due)
+        raise
+
+    await purge_link_keys(short_codes)
+    await remove_known_codes(short_codes)
+    return short_codes
+
+async def backfill_expiry_schedule() -> int:
+    """Заполняет расписание сроками уже существующих ссылок"""
+    client = async_cache.redis_client
+    total = 0
+    last_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            rows = (await db.execute(
+                select(Link.id, Link.short_code, Link.expires_at)
+                .filter(Link.id > last_id, Link.expires_at.is_not(None))
+                .order_by(Link.id)
+                .limit(BACKFILL_CHUNK_SIZE)
+            )).all()
+            if not rows:
+                break
+
+            await client.zadd(EXPIRY_SCHEDULE_KEY, {row.short_code: expiry_score(row.expires_at) for row in rows})
+            total += len(rows)
+            last_id = rows[-1].id
+
+    await client.set(EXPIRY_SCHEDULE_READY_KEY, 1)
+    return total
+
+async def ensure_expiry_schedule() -> bool:
+    """Один раз заполняет расписание по таблице links; новые ссылки попадают в него при создании"""
+    client = async_cache.redis_client
+    if await client.exists(EXPIRY_SCHEDULE_READY_KEY):
+        return False
+
+    if not await client.set(EXPIRY_SCHEDULE_LOCK_KEY, os.getpid(), nx=True, ex=600):
+        return False
+
+    try:
+        total = await backfill_expiry_schedule()
+        print(f"Расписание истечения заполнено: {total} ссылок")
+    finally:
+        await client.delete(EXPIRY_SCHEDULE_LOCK_KEY)
+
+    return True
@@ -0,0 +1,70 @@
+import time
+from urllib.parse import quote
+
+from app.config import settings
+from app.async_cache import resolve_and_record_click
+from app.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS
+from app.utils import extract_client_info_from_scope
+
+REDIRECT_ROUTE = "/{short_code}"  # Шаблон маршрута в метриках, как у redirect_to_url
+# Те же безопасные символы, что у RedirectResponse, чтобы заголовок Location совпадал
+LOCATION_SAFE_CHARS = ":/%#?=@[]!$&'()*+,;"
+# Ключ состояния запроса: быстрый путь уже проверил кеш, и redirect_to_url не повторяет скрипт
+REDIRECT_CACHE_MISSED = "redirect_cache_missed"
+
+
+class RedirectFastPath:
+    """ASGI-обработчик перенаправлений перед роутером: попадание в кеш отвечает сразу, промах уходит в redirect_to_url.
+
+    Пропускает зависимости FastAPI, сессию БД и объект Request; клик учитывается тем же скриптом,
+    что и в полном обработчике, поэтому статистика не зависит от пути.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.static_paths = None
+
+    def get_static_paths(self, scope: dict) -> frozenset:
+        """Пути маршрутов без параметров (/, /metrics, /docs...), которые /{short_code} не должен перехватывать"""
+        if self.static_paths is None:
+            self.static_paths = frozenset(
+                route.path for route in scope["app"].routes if "{" not in getattr(route, "path", "{")
+            )
+        return self.static_paths
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not settings.REDIRECT_FAST_PATH
+            or scope["type"] != "http"
+            # HEAD не обслуживается: redirect_to_url отвечает на него 405, а клики от ботов превью не учитываются
+            or scope["method"] != "GET"
+        ):
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        short_code = path[1:]
+        if not short_code or "/" in short_code or path in self.get_static_paths(scope):
+            return await self.app(scope, receive, send)
+        # Заголовки CORS для запросов с Origin добавляет CORSMiddleware в полном стеке
+        if any(name == b"origin" for name, _ in scope["headers"]):
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        original_url = await resolve_and_record_click(short_code, extract_client_info_from_scope(scope))
+        if original_url is None:
+            # Промах: фильтр известных кодов, загрузка из БД и 404/410 остаются в полном обработчике
+            scope.setdefault("state", {})[REDIRECT_CACHE_MISSED] = True
+            return await self.app(scope, receive, send)
+
+        await send({
+            "type": "http.response.start",
+            "status": 307,
+            "headers": [
+                (b"content-length", b"0"),
+                (b"location", quote(original_url, safe=LOCATION_SAFE_CHARS).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+        HTTP_REQUEST_DURATION.labels(scope["method"], REDIRECT_ROUTE).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(scope["method"], REDIRECT_ROUTE, "307").inc()
@@ -0,0 +1,115 @@
+import asyncio
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from app import async_cache
+from app.config import settings
+from app.cache import get_click_consumer_name
+from app.metrics import BACKGROUND_JOB_LEADER, LEADER_TRANSITIONS
+
+LEADER_KEY_PREFIX = "leader:"  # Аренда фоновой задачи: значение — токен процесса-лидера
+
+# Продлевает аренду, только если ее держит этот процесс.
+# KEYS: ключ аренды; ARGV: токен, срок в миллисекундах
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Снимает аренду, только если ее держит этот процесс.
+# KEYS: ключ аренды; ARGV: токен
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+renew_lease_script = async_cache.redis_client.register_script(RENEW_LEASE_SCRIPT)
+release_lease_script = async_cache.redis_client.register_script(RELEASE_LEASE_SCRIPT)
+
+# Задачи, аренду которых держит процесс
+leader_jobs: set = set()
+
+def get_leader_key(name: str) -> str:
+    return f"{LEADER_KEY_PREFIX}{name}"
+
+def new_lease_token() -> str:
+    """Токен аренды: имя процесса для диагностики и случайная часть для уникальности"""
+    return f"{get_click_consumer_name()}:{uuid.uuid4().hex}"
+
+async def acquire_lease(name: str, token: str, ttl: float) -> bool:
+    """Захватывает аренду задачи, если она свободна"""
+    return bool(await async_cache.redis_client.set(get_leader_key(name), token, nx=True, px=int(ttl * 1000)))
+
+async def renew_lease(name: str, token: str, ttl: float) -> bool:
+    """Продлевает аренду; False, если она истекла или перешла к другому процессу"""
+    renewed = await renew_lease_script(
+        keys=[get_leader_key(name)],
+        args=[token, int(ttl * 1000)],
+        client=async_cache.redis_client
+    )
+    return bool(renewed)
+
+async def release_lease(name: str, token: str) -> None:
+    """Отпускает аренду, чтобы другой процесс подхватил задачу без ожидания TTL"""
+    await release_lease_script(keys=[get_leader_key(name)], args=[token], client=async_cache.redis_client)
+
+async def get_lease_holder(name: str) -> Optional[str]:
+    return await async_cache.redis_client.get(get_leader_key(name))
+
+def set_leader(name: str, is_leader: bool) -> None:
+    if is_leader:
+        leader_jobs.add(name)
+    else:
+        leader_jobs.discard(name)
+    BACKGROUND_JOB_LEADER.labels(name).set(1 if is_leader else 0)
+    LEADER_TRANSITIONS.labels(name, "acquired" if is_leader else "released").inc()
+
+async def lead(name: str, job: Callable[[], Awaitable], token: str, ttl: float, renew_interval: float) -> None:
+    """Выполняет job, продлевая аренду; задача отменяется, как только аренда потеряна"""
+    set_leader(name, True)
+    task = asyncio.create_task(job())
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=renew_interval)
+            if done:
+                print(f"Фоновая задача {name} завершилась")
+                return
+            if not await renew_lease(name, token, ttl):
+                print(f"Аренда задачи {name} потеряна")
+                return
+    finally:
+        set_leader(name, False)
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            await release_lease(name, token)
+        except Exception as e:
+            print(f"Не удалось отпустить аренду задачи {name}: {e}")
+
+async def run_as_leader(name: str, job: Callable[[], Awaitable], ttl: Optional[float] = None,
+                        renew_interval: Optional[float] = None) -> None:
+    """Выполняет job только в процессе, который держит аренду name; остальные ждут ее освобождения.
+
+    Аренда продлевается каждые renew_interval секунд и истекает через ttl без продления,
+    поэтому при падении лидера задача переходит к другому процессу не позже чем через ttl.
+    """
+    ttl = ttl or settings.LEADER_LEASE_TTL
+    renew_interval = renew_interval or settings.LEADER_RENEW_INTERVAL
+    token = new_lease_token()
+    while True:
+        try:
+            if await acquire_lease(name, token, ttl):
+                print(f"Процесс {token} выполняет фоновую задачу {name}")
+                await lead(name, job, token, ttl, renew_interval)
+            await asyncio.sleep(renew_interval)
+        except asyncio.CancelledError:
+            print(f"Выборы лидера задачи {name} остановлены")
+            raise
+        except Exception as e:
+            print(f"Ошибка выборов лидера задачи {name}: {e}")
+            await asyncio.sleep(renew_interval)
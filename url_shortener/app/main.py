@@ -3,20 +3,36 @@ from fastapi import FastAPI, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import time
+import math
 import asyncio
-from sqlalchemy.orm import Session
-from datetime import datetime, timezone, timedelta
+from typing import Optional
+from sqlalchemy import select, update, insert, bindparam, func, DateTime
+from datetime import timedelta
 
-from app.database import engine, Base, get_db, SessionLocal
+from app.database import engine, Base, get_db, AsyncSessionLocal, get_db_pool_stats
 from app.routers import auth, links
 from app.models import Link, Click
 from app.config import settings
-from app.cache import (
-    get_links_to_sync, get_buffered_clicks, get_buffered_last_access,
-    reset_buffered_stats, get_and_clear_click_details, cache_url, invalidate_url_cache,
-    get_cached_url
+from app import async_cache
+from app.async_cache import (
+    get_links_to_sync, get_buffered_stats_bulk, get_sync_backlog,
+    reset_buffered_stats_bulk, invalidate_url_cache_bulk,
+    cache_urls_if_missing, run_invalidation_listener, get_l1_cache_stats, get_redis_pool_stats,
+    ensure_click_stream_group, read_click_events, ack_click_events
+)
+from app.cache import get_click_consumer_name
+from app.bloom import ensure_known_codes, get_known_codes_stats
+from app.purge import purge_expired_links
+from app.expiry import ensure_expiry_schedule, expire_due_links
+from app.utils import is_expired, get_cache_ttl
+from app.rollups import add_clicks_to_rollups
+from app.leader import run_as_leader
+from app.fast_redirect import RedirectFastPath
+from app.metrics import (
+    REGISTRY, CONTENT_TYPE, HTTP_REQUEST_DURATION, HTTP_REQUESTS,
+    SYNC_DURATION, SYNC_BATCH_SIZE, SYNC_BATCH_DURATION, SYNC_LINKS, SYNC_CLICKS, SYNC_TRIGGERS, SYNC_BACKOFF,
+    LINKS_TO_SYNC, SYNC_BACKLOG_CLICKS, SYNC_LAG
 )
-from app.utils import is_expired
 
 
 @asynccontextmanager
@@ -24,26 +40,17 @@ async def lifespan(app: FastAPI):
     """Управляет жизненным циклом приложения"""
     print("Запуск приложения...")
     
-    with SessionLocal() as db:
-        expired_links = db.query(Link).filter(
-            Link.expires_at < datetime.now(timezone.utc)
-        ).all()
-        
-        for link in expired_links:
-            invalidate_url_cache(link.short_code)
-            reset_buffered_stats(link.short_code)
-            db.delete(link)
-        
-        db.commit()
-        print(f"Удалено {len(expired_links)} истекших ссылок")
-    
-    cleanup_task = asyncio.create_task(periodically_cleanup_expired_links())
-    sync_task = asyncio.create_task(periodically_sync_stats())
+    invalidation_task = asyncio.create_task(periodically_listen_invalidations())
+    # Пока фильтр строится, проверки пропускают все коды в БД
+    known_codes_task = asyncio.create_task(build_known_codes())
     
     app.state.background_tasks = {
-        "cleanup": cleanup_task,
-        "sync": sync_task
+        "invalidation": invalidation_task,
+        "known_codes": known_codes_task
     }
+    # Периодические задачи выполняет один процесс из всех; без них веб-процесс только обслуживает запросы
+    if settings.RUN_BACKGROUND_JOBS:
+        app.state.background_tasks.update(start_leader_jobs())
     
     yield
     
@@ -56,6 +63,8 @@ async def lifespan(app: FastAPI):
                 await asyncio.wait_for(task, timeout=5.0)
             except (asyncio.CancelledError, asyncio.TimeoutError):
                 print(f"Задача {name} остановлена")
+    
+    await async_cache.close()
 
 
 Base.metadata.create_all(bind=engine)
@@ -75,34 +84,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+async def update_sync_backlog() -> None:
+    """Обновляет размер и возраст буфера статистики перед выдачей метрик"""
+    backlog = await get_sync_backlog()
+    LINKS_TO_SYNC.set(backlog["links"])
+    SYNC_BACKLOG_CLICKS.set(backlog["clicks"])
+    lag = time.time() - backlog["oldest_ms"] / 1000 if backlog["oldest_ms"] is not None else 0.0
+    SYNC_LAG.set(max(lag, 0.0))
+
+
+REGISTRY.add_collector(update_sync_backlog)
+
+
+# Объявляется до роутеров, иначе путь перехватит перенаправление /{short_code}
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return Response(content=await REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
 app.include_router(auth.router)
 app.include_router(links.router)
 
 
 async def periodically_cleanup_expired_links():
-    """Периодически удаляет ссылки с истекшим сроком действия"""
+    """Удаляет истекшие ссылки при старте и затем раз в PURGE_INTERVAL секунд"""
     while True:
         try:
-            await asyncio.sleep(86400)  # 24 часа
+            result = await purge_expired_links()
+            if result["deleted"]:
+                print(f"Удалено {result['deleted']} истекших ссылок за {result['duration']:.2f} с")
             
-            print(f"Запуск плановой очистки истекших ссылок ({datetime.now(timezone.utc)})")
-            with SessionLocal() as db:
-                expired_links = db.query(Link).filter(
-                    Link.expires_at < datetime.now(timezone.utc)
-                ).all()
-                
-                if not expired_links:
-                    print("Истекших ссылок не найдено")
-                    continue
-                
-                for link in expired_links:
-                    invalidate_url_cache(link.short_code)
-                    reset_buffered_stats(link.short_code)
-                    db.delete(link)
-                
-                db.commit()
-                print(f"Удалено {len(expired_links)} истекших ссылок")
-                
+            if not result["finished"]:
+                # Бюджет прохода исчерпан: продолжаем после короткой паузы
+                await asyncio.sleep(1)
+                continue
+            
+            await asyncio.sleep(settings.PURGE_INTERVAL)
         except asyncio.CancelledError:
             print("Задача очистки истекших ссылок отменена")
             break
@@ -111,92 +130,303 @@ async def periodically_cleanup_expired_links():
             await asyncio.sleep(3600)
 
 
+async def periodically_expire_links():
+    """Каждые EXPIRY_POLL_INTERVAL секунд удаляет ссылки, срок которых наступил"""
+    try:
+        await ensure_expiry_schedule()
+    except asyncio.CancelledError:
+        print("Задача истечения ссылок отменена")
+        return
+    except Exception as e:
+        print(f"Ошибка при заполнении расписания истечения: {e}")
+    
+    while True:
+        try:
+            short_codes = await expire_due_links()
+            if short_codes:
+                print(f"Истекло {len(short_codes)} ссылок")
+            
+            # Полная пачка означает, что в расписании остались наступившие сроки
+            if len(short_codes) < settings.EXPIRY_BATCH_SIZE:
+                await asyncio.sleep(settings.EXPIRY_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            print("Задача истечения ссылок отменена")
+            break
+        except Exception as e:
+            print(f"Ошибка при удалении истекших ссылок: {e}")
+            await asyncio.sleep(settings.EXPIRY_POLL_INTERVAL)
+
+
+def get_sync_trigger(backlog: dict, now_ms: float) -> Optional[str]:
+    """Причина синхронизации: size — буфер достиг порога, age — самый старый клик ждет дольше SYNC_MAX_AGE"""
+    if max(backlog["links"], backlog["clicks"]) >= settings.SYNC_BACKLOG_THRESHOLD:
+        return "size"
+    if backlog["oldest_ms"] is not None and now_ms - backlog["oldest_ms"] >= settings.SYNC_MAX_AGE * 1000:
+        return "age"
+    return None
+
+
+def next_sync_backoff(backoff: float, slowest_batch: float) -> float:
+    """Пауза перед следующим проходом: удваивается, пока пачки пишутся медленно, и сбрасывается, когда БД успевает"""
+    if slowest_batch <= settings.SYNC_SLOW_BATCH_SECONDS:
+        return 0.0
+    return min(max(backoff * 2, settings.SYNC_CHECK_INTERVAL), settings.SYNC_MAX_BACKOFF)
+
+
 async def periodically_sync_stats():
-    """Периодически синхронизирует статистику из Redis в БД"""
+    """Синхронизирует статистику, как только буфер в Redis достигает порога по размеру или возрасту"""
+    backoff = 0.0
+    # Ссылки без событий в потоке (например, после обрезки по MAXLEN) стареют с момента, когда их заметили
+    links_pending_since = None
     while True:
         try:
-            await asyncio.sleep(300)
-            sync_stats_with_db()
+            await asyncio.sleep(settings.SYNC_CHECK_INTERVAL + backoff)
+            backlog = await get_sync_backlog()
+            now_ms = time.time() * 1000
+            if backlog["links"] and backlog["oldest_ms"] is None:
+                links_pending_since = links_pending_since or now_ms
+                backlog["oldest_ms"] = links_pending_since
+            else:
+                links_pending_since = None
+            
+            trigger = get_sync_trigger(backlog, now_ms)
+            if trigger is None:
+                continue
+            
+            SYNC_TRIGGERS.labels(trigger).inc()
+            result = await sync_stats_with_db(max_batches=settings.SYNC_MAX_BATCHES)
+            backoff = next_sync_backoff(backoff, result["slowest_batch"])
+            if backoff:
+                print(f"Запись пачки заняла {result['slowest_batch']:.2f} с, следующий проход через {backoff:.0f} с")
         except asyncio.CancelledError:
             print("Задача синхронизации статистики отменена")
             break
         except Exception as e:
             print(f"Ошибка при синхронизации статистики: {e}")
-            await asyncio.sleep(60)  # Повторная попытка через минуту
+            backoff = next_sync_backoff(backoff, math.inf)
+        finally:
+            SYNC_BACKOFF.set(backoff)
 
 
-def sync_stats_with_db():
-    """Синхронизирует статистику из Redis в базу данных"""
-    links_to_sync = get_links_to_sync()
-    if not links_to_sync:
-        return
-        
-    print(f"Синхронизация статистики для {len(links_to_sync)} ссылок")
-    
-    db = SessionLocal()
+# Задачи, которые должен выполнять ровно один процесс: каждая под своей арендой в Redis
+LEADER_JOBS = {
+    "cleanup": periodically_cleanup_expired_links,
+    "expiry": periodically_expire_links,
+    "sync": periodically_sync_stats,
+}
+
+
+def start_leader_jobs() -> dict:
+    """Запускает выборы лидера для каждой периодической задачи"""
+    return {name: asyncio.create_task(run_as_leader(name, job)) for name, job in LEADER_JOBS.items()}
+
+
+async def build_known_codes():
+    """Строит фильтр известных кодов при старте, если он отсутствует"""
     try:
-        for short_code in links_to_sync:
-            clicks = get_buffered_clicks(short_code)
-            last_access = get_buffered_last_access(short_code)
-            
-            if clicks <= 0:
-                reset_buffered_stats(short_code)
-                continue
-                
-            link = db.query(Link).filter(Link.short_code == short_code).first()
-            if not link:
-                reset_buffered_stats(short_code)
-                invalidate_url_cache(short_code)
-                continue
-            
-            if is_expired(link.expires_at):
-                reset_buffered_stats(short_code)
-                invalidate_url_cache(short_code)
-                continue
+        await ensure_known_codes()
+    except asyncio.CancelledError:
+        print("Построение фильтра известных кодов отменено")
+    except Exception as e:
+        print(f"Ошибка при построении фильтра известных кодов: {e}")
+
+
+async def periodically_listen_invalidations():
+    """Держит подписку на инвалидацию L1-кеша, переподключаясь при ошибках"""
+    while True:
+        try:
+            await run_invalidation_listener()
+        except asyncio.CancelledError:
+            print("Задача инвалидации L1-кеша отменена")
+            break
+        except Exception as e:
+            # Пока подписка не работает, чужие изменения могут быть не видны
+            async_cache.url_l1_cache.clear()
+            print(f"Ошибка подписки на инвалидацию L1-кеша: {e}")
+            await asyncio.sleep(5)
+
+
+async def sync_stats_with_db(max_batches: Optional[int] = None) -> dict:
+    """Синхронизирует статистику из Redis в базу данных пакетами; не больше max_batches пачек каждого вида"""
+    started = time.perf_counter()
+    # Остаток останется в links_to_sync до следующего прохода
+    limit = max_batches * settings.SYNC_BATCH_SIZE if max_batches is not None else None
+    short_codes = list(await get_links_to_sync(limit))
+    if short_codes:
+        backlog = await get_sync_backlog()
+        print(f"Синхронизация статистики для {backlog['links']} ссылок")
+    
+    synced = 0
+    batch_times = []
+    for start in range(0, len(short_codes), settings.SYNC_BATCH_SIZE):
+        batch = short_codes[start:start + settings.SYNC_BATCH_SIZE]
+        SYNC_BATCH_SIZE.observe(len(batch))
+        batch_started = time.perf_counter()
+        try:
+            synced += await sync_stats_batch(batch)
+        except Exception as e:
+            # Ссылки пачки остались в links_to_sync; недоступная БД считается медленной, чтобы планировщик отступил
+            print(f"Ошибка при синхронизации: {e}")
+            batch_times.append(math.inf)
+            break
+        batch_times.append(time.perf_counter() - batch_started)
+        SYNC_BATCH_DURATION.labels("links").observe(batch_times[-1])
+    
+    saved = await sync_click_events(max_batches, batch_times)
+    
+    duration = time.perf_counter() - started
+    SYNC_LINKS.inc(synced)
+    SYNC_CLICKS.inc(saved)
+    SYNC_DURATION.observe(duration)
+    print(f"Синхронизация завершена: обновлено {synced} ссылок, сохранено {saved} кликов")
+    return {
+        "links": synced,
+        "clicks": saved,
+        "batches": len(batch_times),
+        "slowest_batch": max(batch_times, default=0.0),
+        "duration": duration,
+    }
+
+
+# Обновление счетчиков всех ссылок пачки одним executemany
+link_stats_update = (
+    update(Link.__table__)
+    .where(Link.__table__.c.id == bindparam("b_id"))
+    .values(
+        click_count=Link.__table__.c.click_count + bindparam("b_clicks"),
+        last_accessed=func.coalesce(
+            bindparam("b_last_accessed", type_=DateTime(timezone=True)),
+            Link.__table__.c.last_accessed
+        )
+    )
+)
+
+
+async def sync_stats_batch(short_codes: list) -> int:
+    """Переносит буферизованную статистику пачки ссылок в БД за фиксированное число запросов"""
+    buffered = await get_buffered_stats_bulk(short_codes)
+    pending = {code: stats for code, stats in buffered.items() if stats[0] > 0}
+    flushed = {code: stats[0] for code, stats in buffered.items()}
+    
+    if not pending:
+        await reset_buffered_stats_bulk(flushed)
+        return 0
+    
+    async with AsyncSessionLocal() as db:
+        try:
+            rows = (await db.execute(
+                select(Link.id, Link.short_code, Link.original_url, Link.expires_at, Link.click_count)
+                .filter(Link.short_code.in_(list(pending)))
+            )).all()
             
-            link.click_count += clicks
-            if last_access:
-                link.last_accessed = last_access
+            live_links = [row for row in rows if not is_expired(row.expires_at)]
+            live_codes = {row.short_code for row in live_links}
+            stale_codes = [code for code in pending if code not in live_codes]
             
-            click_details = get_and_clear_click_details(short_code)
-            for detail in click_details:
-                try:
-                    click = Click(
-                        link_id=link.id,
-                        timestamp=datetime.fromisoformat(detail.get("timestamp", "")),
-                        ip_address=detail.get("ip_address", ""),
-                        user_agent=detail.get("user_agent", ""),
-                        referer=detail.get("referer", "")
-                    )
-                    db.add(click)
-                except Exception as e:
-                    print(f"Ошибка при добавлении клика: {e}")
+            updates = []
+            for row in live_links:
+                count, last_access = pending[row.short_code]
+                updates.append({"b_id": row.id, "b_clicks": count, "b_last_accessed": last_access})
             
-            reset_buffered_stats(short_code)
+            if updates:
+                await db.execute(link_stats_update, updates)
             
-            if link.click_count >= settings.POPULAR_URL_THRESHOLD and not get_cached_url(short_code):
-                expire = None
-                if link.expires_at:
-                    now = datetime.now(timezone.utc)
-                    if link.expires_at > now:
-                        expire = int((link.expires_at - now).total_seconds())
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    
+    await reset_buffered_stats_bulk(flushed)
+    await invalidate_url_cache_bulk(stale_codes)
+    
+    await cache_urls_if_missing([
+        (row.short_code, row.original_url, get_cache_ttl(row.expires_at))
+        for row in live_links
+        if row.click_count + pending[row.short_code][0] >= settings.POPULAR_URL_THRESHOLD
+    ])
+    
+    return len(updates)
+
+
+async def sync_click_events(max_batches: Optional[int] = None, batch_times: Optional[list] = None) -> int:
+    """Переносит события кликов из потока в БД; события подтверждаются только после коммита.
+    
+    Время записи каждой пачки добавляется в batch_times, если список передан.
+    """
+    await ensure_click_stream_group()
+    consumer = get_click_consumer_name()
+    saved = 0
+    batches = 0
+    
+    while max_batches is None or batches < max_batches:
+        events = await read_click_events(consumer, settings.CLICK_STREAM_BATCH_SIZE)
+        if not events:
+            break
+        batches += 1
+        batch_started = time.perf_counter()
+        
+        short_codes = {data["short_code"] for _, _, data in events if data and data.get("short_code")}
+        
+        async with AsyncSessionLocal() as db:
+            try:
+                link_ids = dict((await db.execute(
+                    select(Link.short_code, Link.id).filter(Link.short_code.in_(list(short_codes)))
+                )).all()) if short_codes else {}
+                
+                clicks = []
+                for _, _, data in events:
+                    link_id = link_ids.get(data.get("short_code")) if data else None
+                    if link_id is None:
+                        continue
+                    try:
+                        clicks.append({
+                            "link_id": link_id,
+                            "timestamp": data["timestamp"],
+                            "ip_address": data.get("ip_address", ""),
+                            "user_agent": data.get("user_agent", ""),
+                            "referer": data.get("referer", "")
+                        })
+                    except Exception as e:
+                        print(f"Ошибка при добавлении клика: {e}")
                 
-                cache_url(short_code, link.original_url, expire)
+                if clicks:
+                    await db.execute(insert(Click.__table__), clicks)
+                    # Агрегаты обновляются в той же транзакции, что и сырые клики
+                    await add_clicks_to_rollups(db, clicks)
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                # Неподтвержденные события будут забраны повторно после CLICK_STREAM_CLAIM_IDLE_MS
+                print(f"Ошибка при сохранении кликов: {e}")
+                # Недоступная БД считается медленной, чтобы планировщик отступил
+                if batch_times is not None:
+                    batch_times.append(math.inf)
+                break
         
-        db.commit()
-        print("Синхронизация завершена успешно")
-    except Exception as e:
-        db.rollback()
-        print(f"Ошибка при синхронизации: {e}")
-    finally:
-        db.close()
+        await ack_click_events(events)
+        saved += len(clicks)
+        batch_time = time.perf_counter() - batch_started
+        SYNC_BATCH_DURATION.labels("clicks").observe(batch_time)
+        if batch_times is not None:
+            batch_times.append(batch_time)
+        
+        if len(events) < settings.CLICK_STREAM_BATCH_SIZE:
+            break
+    
+    return saved
 
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
     response = await call_next(request)
-    process_time = time.time() - start_time
+    process_time = time.perf_counter() - start_time
+    
+    # Шаблон маршрута вместо пути, чтобы число рядов метрик не зависело от коротких кодов
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    HTTP_REQUEST_DURATION.labels(request.method, route_path).observe(process_time)
+    HTTP_REQUESTS.labels(request.method, route_path, str(response.status_code)).inc()
     
     if request.url.path.startswith("/links") or request.url.path.startswith("/auth"):
         print(f"{request.method} {request.url.path} - {response.status_code} - {process_time:.4f}s")
@@ -204,6 +434,10 @@ async def log_requests(request: Request, call_next):
     return response
 
 
+# Добавляется последним, поэтому оборачивает остальные middleware и видит запрос первым
+app.add_middleware(RedirectFastPath)
+
+
 @app.get("/", tags=["root"])
 async def root():
     return {
@@ -213,5 +447,23 @@ async def root():
     }
 
 
+@app.get("/cache/stats", tags=["root"])
+async def cache_stats():
+    """Счетчики L1-кеша перенаправлений и фильтра известных кодов"""
+    return {
+        "l1": get_l1_cache_stats(),
+        "known_codes": get_known_codes_stats()
+    }
+
+
+@app.get("/diagnostics/pools", tags=["root"])
+async def pool_diagnostics():
+    """Настройки и загрузка пулов соединений процесса с БД и Redis"""
+    return {
+        "db": get_db_pool_stats(),
+        "redis": get_redis_pool_stats()
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
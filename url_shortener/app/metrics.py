@@ -0,0 +1,277 @@
+import abc
+import bisect
+import inspect
+import math
+from typing import Callable, Iterable, Optional
+
+# Метрики обновляются из цикла событий, поэтому обходятся без блокировок:
+# наблюдение — это поиск корзины и несколько сложений
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин задержки в секундах: от долей миллисекунды (L1, Redis) до секунд (БД под нагрузкой)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+def format_value(value: float) -> str:
+    """Число в текстовом формате Prometheus"""
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels: dict) -> str:
+    """Метки в текстовом формате Prometheus с экранированием значений"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        # Последняя ячейка — значения больше всех границ (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric(abc.ABC):
+    """Семейство метрик с одинаковыми именем и набором меток"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        self._function: Optional[Callable] = None
+        (registry or REGISTRY).register(self)
+
+    @abc.abstractmethod
+    def _new_value(self):
+        """Новое значение метрики для очередного набора меток"""
+
+    def labels(self, *values) -> object:
+        """Значение метрики для набора меток; создается при первом обращении"""
+        value = self._values.get(values)
+        if value is None:
+            value = self._values.setdefault(values, self._new_value())
+        return value
+
+    def set_function(self, function: Callable) -> None:
+        """Значения берутся при сборе из function: число или словарь {кортеж меток: число}"""
+        self._function = function
+
+    def collect(self) -> list:
+        """Возвращает пары (метки, значение) для всех наборов меток"""
+        if self._function is not None:
+            result = self._function()
+            items = result.items() if isinstance(result, dict) else [((), result)]
+            return [(labels if isinstance(labels, tuple) else (labels,), value) for labels, value in items]
+        return list(self._values.items())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.collect():
+            label_dict = dict(zip(self.labelnames, labels))
+            lines.extend(self.render_value(label_dict, value))
+        return lines
+
+    def render_value(self, labels: dict, value) -> list:
+        number = value.value if isinstance(value, CounterValue) else value
+        return [f"{self.name}{format_labels(labels)} {format_value(number)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_value(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_value(self):
+        return GaugeValue()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: tuple = LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def render_value(self, labels: dict, value: HistogramValue) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), value.counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': format_value(float(bound))})} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(value.sum)}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {value.count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса и функций, обновляющих их перед выдачей"""
+
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: list = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def add_collector(self, collector: Callable) -> None:
+        """Функция (обычная или корутина), вызываемая перед каждой выдачей метрик"""
+        self.collectors.append(collector)
+
+    async def render(self) -> str:
+        """Собирает все метрики в текстовом формате Prometheus"""
+        for collector in self.collectors:
+            try:
+                result = collector()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Ошибка сбора метрик: {e}")
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# HTTP
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Время обработки запроса по шаблону маршрута", ("method", "route")
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Число запросов по шаблону маршрута и коду ответа", ("method", "route", "status")
+)
+
+# Перенаправления
+REDIRECT_CACHE_LOOKUPS = Counter(
+    "redirect_cache_lookups_total", "Поиск URL для перенаправления: l1, redis или miss", ("result",)
+)
+
+# Redis и БД
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds", "Время команды Redis (PIPELINE — весь конвейер)", ("command",)
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запроса по типу оператора", ("statement",)
+)
+
+# Пулы соединений: ожидание включает установку нового соединения, если свободных нет
+DB_POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Ожидание соединения из пула БД")
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Выдачи соединения БД, не дождавшиеся DB_POOL_TIMEOUT")
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Соединения пула БД: in_use и idle", ("state",))
+REDIS_POOL_CHECKOUT_WAIT = Histogram("redis_pool_checkout_wait_seconds", "Ожидание соединения из пула Redis")
+REDIS_POOL_TIMEOUTS = Counter("redis_pool_timeouts_total", "Выдачи соединения Redis, не дождавшиеся REDIS_POOL_TIMEOUT")
+REDIS_POOL_CONNECTIONS = Gauge("redis_pool_connections", "Соединения пула Redis: in_use и idle", ("state",))
+
+# Синхронизация статистики
+SYNC_DURATION = Histogram(
+    "stats_sync_duration_seconds", "Длительность одного прохода синхронизации статистики",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+SYNC_BATCH_SIZE = Histogram(
+    "stats_sync_batch_size", "Число ссылок в пачке синхронизации счетчиков", buckets=SIZE_BUCKETS
+)
+SYNC_BATCH_DURATION = Histogram(
+    "stats_sync_batch_duration_seconds", "Время записи одной пачки в БД: links (счетчики) или clicks (события)", ("kind",)
+)
+SYNC_LINKS = Counter("stats_sync_links_total", "Ссылки, счетчики которых перенесены в БД")
+SYNC_CLICKS = Counter("stats_sync_clicks_total", "События кликов, сохраненные в БД")
+SYNC_TRIGGERS = Counter("stats_sync_triggers_total", "Проходы синхронизации по причине: size или age", ("reason",))
+SYNC_BACKOFF = Gauge("stats_sync_backoff_seconds", "Дополнительная пауза между проходами из-за медленной БД")
+LINKS_TO_SYNC = Gauge("links_to_sync", "Ссылки с несинхронизированными кликами (размер links_to_sync)")
+SYNC_BACKLOG_CLICKS = Gauge("stats_sync_backlog_clicks", "События кликов в потоке, еще не сохраненные в БД")
+SYNC_LAG = Gauge("stats_sync_lag_seconds", "Возраст самого старого несохраненного события клика")
+
+# Выборы лидера фоновых задач
+BACKGROUND_JOB_LEADER = Gauge("background_job_leader", "1, если процесс держит аренду фоновой задачи", ("job",))
+LEADER_TRANSITIONS = Counter(
+    "background_job_leader_transitions_total", "Получение (acquired) и утрата или освобождение (released) аренды задачи", ("job", "event")
+)
+
+# Счетчики, которые модули ведут сами; значения берутся при выдаче метрик
+L1_CACHE_EVENTS = Counter(
+    "l1_cache_events_total", "События L1-кешей процесса: hits, misses, evictions, expirations, invalidations",
+    ("cache", "event")
+)
+L1_CACHE_ENTRIES = Gauge("l1_cache_entries", "Записей в L1-кеше процесса", ("cache",))
+KNOWN_CODES_CHECKS = Counter(
+    "known_codes_checks_total", "Проверки фильтра известных кодов: checks и db_lookups_avoided", ("result",)
+)
+SINGLE_FLIGHT_EVENTS = Counter(
+    "single_flight_events_total", "Объединение промахов: loads, coalesced, lock_waits, lock_wait_hits", ("event",)
+)
+SINGLE_FLIGHT_IN_FLIGHT = Gauge("single_flight_in_flight", "Загрузки из БД, выполняющиеся в процессе")
+PASSWORD_HASHING_EVENTS = Counter(
+    "password_hashing_events_total", "Хеширование паролей: calls и rehashed", ("event",)
+)
+PASSWORD_HASHING_SECONDS = Counter(
+    "password_hashing_seconds_total", "Суммарное время хеширования: queue (ожидание) и hash (работа)", ("phase",)
+)
+PASSWORD_HASHING_QUEUE = Gauge(
+    "password_hashing_queue", "Хеширования в очереди (waiting) и в работе (running)", ("state",)
+)
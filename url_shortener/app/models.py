@@ -1,8 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 
 from app.database import Base
+from app.utils import url_fingerprint, URL_FINGERPRINT_LENGTH
+
+def default_url_hash(context) -> str:
+    """Отпечаток original_url для вставок, где url_hash не задан явно"""
+    return url_fingerprint(context.get_current_parameters()["original_url"])
 
 class User(Base):
     __tablename__ = "users"
@@ -11,7 +16,7 @@ class User(Base):
     username = Column(String(50), unique=True, index=True)
     email = Column(String(100), unique=True, index=True)
     hashed_password = Column(String(100))
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     is_active = Column(Boolean, default=True)
     
     links = relationship("Link", back_populates="owner")
@@ -22,6 +27,8 @@ class Link(Base):
     id = Column(Integer, primary_key=True, index=True)
     short_code = Column(String(20), unique=True, index=True, nullable=False)
     original_url = Column(Text, nullable=False)
+    # Индексированный отпечаток original_url для дедупликации и поиска
+    url_hash = Column(String(URL_FINGERPRINT_LENGTH), index=True, default=default_url_hash)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     expires_at = Column(DateTime(timezone=True), nullable=True)
     last_accessed = Column(DateTime(timezone=True), nullable=True)
@@ -31,15 +38,40 @@ class Link(Base):
     
     owner = relationship("User", back_populates="links")
     clicks = relationship("Click", back_populates="link", cascade="all, delete-orphan")
+    
+    # Постраничный список ссылок владельца идет по этому индексу без сортировки
+    __table_args__ = (Index("ix_links_owner_id_id", "owner_id", "id"),)
 
 class Click(Base):
     __tablename__ = "clicks"
 
     id = Column(Integer, primary_key=True, index=True)
     link_id = Column(Integer, ForeignKey("links.id"), nullable=False)
-    timestamp = Column(DateTime, default=datetime.now(timezone.utc))
+    timestamp = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     ip_address = Column(String(50), nullable=True)
     user_agent = Column(Text, nullable=True)
     referer = Column(Text, nullable=True)
     
-    link = relationship("Link", back_populates="clicks")
\ No newline at end of file
+    link = relationship("Link", back_populates="clicks")
+
+
+class HourlyClickRollup(Base):
+    __tablename__ = "click_rollups_hourly"
+
+    # Первичный ключ (link_id, bucket_start) служит индексом для выборки диапазона
+    link_id = Column(Integer, ForeignKey("links.id"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    clicks = Column(Integer, nullable=False, default=0)
+
+class DailyClickRollup(Base):
+    __tablename__ = "click_rollups_daily"
+
+    link_id = Column(Integer, ForeignKey("links.id"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    clicks = Column(Integer, nullable=False, default=0)
+
+class ShortCodeBlock(Base):
+    __tablename__ = "short_code_blocks"
+
+    # Конец блока идентификаторов, выданного счетчиком в Redis; максимум восстанавливает потерянный счетчик
+    end_id = Column(BigInteger, primary_key=True, autoincrement=False)
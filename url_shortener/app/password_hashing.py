@@ -0,0 +1,84 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from app.config import settings
+from app.utils import get_password_hash, verify_and_update_password
+from app.metrics import PASSWORD_HASHING_EVENTS, PASSWORD_HASHING_SECONDS, PASSWORD_HASHING_QUEUE
+
+# bcrypt отпускает GIL, поэтому пула потоков достаточно, чтобы не блокировать цикл событий
+_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+# Ограничивает число одновременных хеширований; остальные ждут в очереди
+_semaphore = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS)
+
+# Статистика очереди хеширования
+password_hashing_stats = {
+    "calls": 0,
+    "waiting": 0,
+    "running": 0,
+    "queue_time_total": 0.0,
+    "queue_time_max": 0.0,
+    "hash_time_total": 0.0,
+    "rehashed": 0,
+}
+PASSWORD_HASHING_EVENTS.set_function(lambda: {
+    ("calls",): password_hashing_stats["calls"],
+    ("rehashed",): password_hashing_stats["rehashed"],
+})
+PASSWORD_HASHING_SECONDS.set_function(lambda: {
+    ("queue",): password_hashing_stats["queue_time_total"],
+    ("hash",): password_hashing_stats["hash_time_total"],
+})
+PASSWORD_HASHING_QUEUE.set_function(lambda: {
+    ("waiting",): password_hashing_stats["waiting"],
+    ("running",): password_hashing_stats["running"],
+})
+
+async def run_in_hash_pool(func: Callable, *args):
+    """Выполняет хеширование в пуле потоков с ограничением параллелизма"""
+    queued_at = time.perf_counter()
+    password_hashing_stats["waiting"] += 1
+    try:
+        await _semaphore.acquire()
+    finally:
+        password_hashing_stats["waiting"] -= 1
+
+    try:
+        started = time.perf_counter()
+        queue_time = started - queued_at
+        password_hashing_stats["calls"] += 1
+        password_hashing_stats["running"] += 1
+        password_hashing_stats["queue_time_total"] += queue_time
+        password_hashing_stats["queue_time_max"] = max(password_hashing_stats["queue_time_max"], queue_time)
+
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        password_hashing_stats["running"] -= 1
+        password_hashing_stats["hash_time_total"] += time.perf_counter() - started
+        _semaphore.release()
+
+async def hash_password(password: str) -> str:
+    """Хеширует пароль вне цикла событий"""
+    return await run_in_hash_pool(get_password_hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> tuple:
+    """Проверяет пароль вне цикла событий; возвращает (верен ли, новый хеш или None)"""
+    verified, new_hash = await run_in_hash_pool(verify_and_update_password, plain_password, hashed_password)
+    if new_hash:
+        password_hashing_stats["rehashed"] += 1
+    return verified, new_hash
+
+def get_password_hashing_stats() -> dict:
+    """Возвращает длину очереди и среднее время ожидания и хеширования"""
+    calls = password_hashing_stats["calls"]
+    return {
+        "workers": settings.PASSWORD_HASH_WORKERS,
+        "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+        **password_hashing_stats,
+        "queue_time_avg": password_hashing_stats["queue_time_total"] / calls if calls else 0.0,
+        "hash_time_avg": password_hashing_stats["hash_time_total"] / calls if calls else 0.0,
+    }
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Link, Click
+from app.async_cache import purge_link_keys
+from app.bloom import remove_known_codes
+from app.rollups import delete_rollups
+
+links_table = Link.__table__
+clicks_table = Click.__table__
+
+async def delete_expired_links(db: AsyncSession, condition, now: datetime) -> list:
+    """Удаляет ссылки, подходящие под condition и истекшие к now; возвращает их short_code"""
+    # Срок ссылки мог быть продлен после выборки, поэтому истечение проверяется в самом DELETE
+    expired = (condition, links_table.c.expires_at < now)
+
+    # Удаление через Core не каскадируется на клики и агрегаты, поэтому они удаляются первыми
+    expired_ids = select(links_table.c.id).where(*expired)
+    await db.execute(delete(clicks_table).where(clicks_table.c.link_id.in_(expired_ids)))
+    await delete_rollups(db, expired_ids)
+    short_codes = (await db.scalars(
+        delete(links_table).where(*expired).returning(links_table.c.short_code)
+    )).all()
+    await db.commit()
+    return short_codes
+
+async def purge_expired_chunk(after_id: int, now: datetime) -> tuple:
+    """Удаляет пачку истекших ссылок с id > after_id; возвращает (short_codes, последний просмотренный id)"""
+    async with AsyncSessionLocal() as db:
+        ids = (await db.scalars(
+            select(links_table.c.id)
+            .where(links_table.c.expires_at < now, links_table.c.id > after_id)
+            .order_by(links_table.c.id)
+            .limit(settings.PURGE_CHUNK_SIZE)
+        )).all()
+        if not ids:
+            return [], None
+
+        short_codes = await delete_expired_links(db, links_table.c.id.in_(ids), now)
+
+    await purge_link_keys(short_codes)
+    await remove_known_codes(short_codes)
+    return short_codes, ids[-1]
+
+async def purge_expired_links(time_budget: Optional[float] = None) -> dict:
+    """Один проход очистки пачками, пока не кончатся истекшие ссылки или бюджет времени"""
+    time_budget = settings.PURGE_TIME_BUDGET if time_budget is None else time_budget
+    started = time.monotonic()
+    now = datetime.now(timezone.utc)
+
+    deleted = 0
+    last_id = 0
+    finished = False
+    while time.monotonic() - started < time_budget:
+        short_codes, last_id = await purge_expired_chunk(last_id, now)
+        if last_id is None:
+            finished = True
+            break
+        deleted += len(short_codes)
+        # Между пачками цикл событий обслуживает запросы
+        await asyncio.sleep(0)
+
+    return {
+        "deleted": deleted,
+        "finished": finished,
+        "duration": time.monotonic() - started
+    }
@@ -0,0 +1,75 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import HourlyClickRollup, DailyClickRollup
+
+# Таблица агрегатов и длина интервала для каждого размера корзины
+ROLLUP_TABLES = {
+    "hour": HourlyClickRollup.__table__,
+    "day": DailyClickRollup.__table__,
+}
+BUCKET_SIZES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+# Сколько последних корзин возвращается, если диапазон не задан
+DEFAULT_BUCKET_COUNTS = {
+    "hour": 24,
+    "day": 30,
+}
+
+def bucket_start(timestamp: datetime, bucket: str) -> datetime:
+    """Начало корзины, в которую попадает момент времени; наивные даты считаются UTC"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    timestamp = timestamp.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+def get_upsert(db: AsyncSession, table):
+    """INSERT ... ON CONFLICT, который прибавляет клики к существующей корзине"""
+    dialect_insert = postgresql_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    statement = dialect_insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.link_id, table.c.bucket_start],
+        set_={"clicks": table.c.clicks + statement.excluded.clicks}
+    )
+
+async def add_clicks_to_rollups(db: AsyncSession, clicks: list) -> None:
+    """Прибавляет пачку кликов к часовым и дневным агрегатам в текущей транзакции"""
+    for bucket, table in ROLLUP_TABLES.items():
+        counts = Counter((click["link_id"], bucket_start(click["timestamp"], bucket)) for click in clicks)
+        if counts:
+            await db.execute(get_upsert(db, table), [
+                {"link_id": link_id, "bucket_start": start, "clicks": count}
+                for (link_id, start), count in counts.items()
+            ])
+
+async def delete_rollups(db: AsyncSession, link_ids) -> None:
+    """Удаляет агрегаты ссылок; link_ids — список id или подзапрос"""
+    for table in ROLLUP_TABLES.values():
+        await db.execute(delete(table).where(table.c.link_id.in_(link_ids)))
+
+async def get_click_timeseries(db: AsyncSession, link_id: int, bucket: str, start: datetime, end: datetime) -> list:
+    """Клики по корзинам в [start, end], включая пустые; время ответа зависит только от числа корзин"""
+    table = ROLLUP_TABLES[bucket]
+    first = bucket_start(start, bucket)
+    last = bucket_start(end, bucket)
+
+    rows = (await db.execute(
+        select(table.c.bucket_start, table.c.clicks)
+        .where(table.c.link_id == link_id, table.c.bucket_start.between(first, last))
+    )).all()
+    counts = {bucket_start(row.bucket_start, bucket): row.clicks for row in rows}
+
+    points = []
+    current = first
+    while current <= last:
+        points.append((current, counts.get(current, 0)))
+        current += BUCKET_SIZES[bucket]
+    return points
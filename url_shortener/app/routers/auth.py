@@ -1,20 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
 from app.database import get_db
 from app.models import User
 from app.schemas import UserCreate, UserResponse, Token
-from app.utils import verify_password, get_password_hash, create_access_token
+from app.utils import create_access_token
+from app.password_hashing import hash_password, verify_password, get_password_hashing_stats
 from app.config import settings
+from app.dependencies import get_required_user
+from app.user_cache import invalidate_cached_user
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 @router.post("/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     """Регистрация нового пользователя"""
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
+    existing_user = await db.scalar(select(User).filter(User.username == user_data.username))
 
     if existing_user:
         raise HTTPException(
@@ -22,7 +26,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
             detail="Пользователь с таким именем уже существует"
         )
     
-    existing_email = db.query(User).filter(User.email == user_data.email).first()
+    existing_email = await db.scalar(select(User).filter(User.email == user_data.email))
 
     if existing_email:
         raise HTTPException(
@@ -30,7 +34,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
             detail="Пользователь с таким email уже существует"
         )
     
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
 
     new_user = User(
         username=user_data.username,
@@ -39,30 +43,59 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     return new_user
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение JWT токена доступа"""
-    user = db.query(User).filter(User.username == form_data.username).first()
+    user = await db.scalar(select(User).filter(User.username == form_data.username))
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    verified, new_hash = (False, None)
+    if user:
+        verified, new_hash = await verify_password(form_data.password, user.hashed_password)
+    
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверное имя пользователя или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Хеш с устаревшей стоимостью или схемой обновляется, пока известен пароль
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username, "user_id": user.id},
         expires_delta=access_token_expires
     )
     
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/hashing/stats")
+async def password_hashing_stats():
+    """Очередь и время хеширования паролей"""
+    return get_password_hashing_stats()
+
+@router.post("/deactivate", status_code=status.HTTP_204_NO_CONTENT)
+async def deactivate_account(
+    current_user: User = Depends(get_required_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Деактивирует учетную запись текущего пользователя"""
+    user = await db.scalar(select(User).filter(User.id == current_user.id))
+    user.is_active = False
+    await db.commit()
+    
+    # Иначе воркеры еще USER_CACHE_TTL секунд считали бы пользователя активным
+    await invalidate_cached_user(user.id)
+    
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
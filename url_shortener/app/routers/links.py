@@ -1,44 +1,91 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
-from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+import csv
+import io
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from sqlalchemy import select, insert, update, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 from datetime import datetime, timezone
 from app.config import settings
 
-from app.database import get_db
+from app.database import get_db, AsyncSessionLocal
 from app.models import Link, User, Click
-from app.schemas import LinkCreate, LinkResponse, LinkUpdate, LinkStats, LinkStatsDetailed, LinkSearchResponse
-from app.utils import generate_short_code, build_short_url, is_expired
-from app.dependencies import get_current_active_user, get_link_owner_or_admin, get_client_info
-from app.cache import (
-    cache_url, get_cached_url, invalidate_url_cache,
-    is_popular_url, increment_access_counter,
-    add_click_details, reset_buffered_stats, get_buffered_clicks,
-    get_buffered_last_access
+from app.schemas import (
+    LinkCreate, LinkResponse, LinkUpdate, LinkStats, LinkStatsDetailed, LinkSearchResponse,
+    LinkBatchCreate, LinkBatchResult, LinkBatchResponse, LinkListItem, LinkPage,
+    ClickTimeseries, ClickTimeseriesPoint, LinkStatsBatchRequest, LinkStatsBatchResponse
+)
+from app.utils import build_short_url, is_expired, get_cache_ttl, url_fingerprint
+from app.short_codes import allocate_short_code, allocate_short_codes
+from app.dependencies import get_current_active_user, get_required_user, get_link_owner_or_admin, get_client_info
+from app.bloom import might_exist, add_known_code, add_known_codes, remove_known_code
+from app.async_cache import (
+    cache_url, invalidate_url_cache, is_popular_url,
+    resolve_and_record_click, record_click, reset_buffered_stats, get_buffered_clicks,
+    get_buffered_last_access, get_cached_url, get_cached_link_info, cache_link_info,
+    get_cached_search, cache_search, invalidate_search_cache, cache_urls_if_missing, get_buffered_stats_bulk,
+    reset_buffered_stats_bulk
+)
+from app.cache import get_url_cache_key, get_link_info_cache_key, get_search_cache_key
+from app.single_flight import load_once
+from app.fast_redirect import REDIRECT_CACHE_MISSED
+from app.expiry import schedule_expiry, schedule_expiries, unschedule_expiry
+from app.purge import links_table
+from app.json_utils import dumps
+from app.rollups import (
+    bucket_start, get_click_timeseries, delete_rollups, BUCKET_SIZES, DEFAULT_BUCKET_COUNTS
 )
 
 router = APIRouter(tags=["links"])
 
+# Повторные попытки нужны только при совпадении с алиасом или старым случайным кодом
+MAX_SHORT_CODE_ATTEMPTS = 5
+
+# Колонки, которые читаются для списка и выгрузки ссылок пользователя
+LINK_EXPORT_COLUMNS = (
+    Link.id, Link.short_code, Link.original_url, Link.created_at,
+    Link.expires_at, Link.click_count, Link.last_accessed
+)
+LINK_LIST_FIELDS = list(LinkListItem.model_fields)
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
 # Перенаправление по короткой ссылке
 @router.get("/{short_code}", include_in_schema=False)
 async def redirect_to_url(
     short_code: str,
     request: Request,
-    db: Session = Depends(get_db),
     client_info: dict = Depends(get_client_info)
 ):
     """Перенаправляет по короткой ссылке с буферизацией статистики"""
-    original_url = get_cached_url(short_code)
+    # После промаха в RedirectFastPath кеш уже проверен тем же скриптом
+    if not getattr(request.state, REDIRECT_CACHE_MISSED, False):
+        original_url = await resolve_and_record_click(short_code, client_info)
+        if original_url:
+            return RedirectResponse(url=original_url)
     
-    if original_url:
-        increment_access_counter(short_code)
-        
-        add_click_details(short_code, client_info)
-        
-        return RedirectResponse(url=original_url)
+    # Точно несуществующие коды отсекаются без запроса к БД
+    if not await might_exist(short_code):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ссылка не найдена"
+        )
+    
+    # Одновременные промахи по одному коду загружают ссылку из БД один раз
+    original_url = await load_once(
+        get_url_cache_key(short_code),
+        lambda: load_redirect_url(short_code),
+        lambda: get_cached_url(short_code)
+    )
+    
+    # Клик каждого запроса уходит в тот же буфер, что и при попадании в кеш
+    await record_click(short_code, client_info)
     
-    link = db.query(Link).filter(Link.short_code == short_code).first()
+    return RedirectResponse(url=original_url)
+
+async def load_active_link(db: AsyncSession, short_code: str) -> Link:
+    """Загружает ссылку из БД; 404, если ее нет, и 410, если она истекла"""
+    link = await db.scalar(select(Link).filter(Link.short_code == short_code))
     
     if not link:
         raise HTTPException(
@@ -52,43 +99,55 @@ async def redirect_to_url(
             detail="Срок действия ссылки истек"
         )
     
-    original_url = link.original_url
+    return link
+
+async def load_redirect_url(short_code: str) -> str:
+    """Загружает URL из БД и сразу кеширует его, чтобы холодные ссылки не ходили в БД"""
+    # Загрузку ждут все объединенные запросы, поэтому она не зависит от сессии запроса, который ее начал
+    async with AsyncSessionLocal() as db:
+        link = await load_active_link(db, short_code)
     
-    link.click_count += 1
-    link.last_accessed = datetime.now(timezone.utc)
+    expire = settings.CACHE_EXPIRY
+    if link.expires_at:
+        # Ссылка, истекающая меньше чем через секунду, кешируется на одну секунду
+        expire = min(get_cache_ttl(link.expires_at) or 1, expire)
+    await cache_url(short_code, link.original_url, expire)
     
-    click = Click(
-        link_id=link.id,
-        ip_address=client_info.get("ip_address"),
-        user_agent=client_info.get("user_agent"),
-        referer=client_info.get("referer")
-    )
-    db.add(click)
-    db.commit()
-    
-    if link.click_count >= settings.POPULAR_URL_THRESHOLD:
-        expire = None
-        if link.expires_at:
-            now = datetime.now(timezone.utc)
-            if link.expires_at > now:
-                expire = int((link.expires_at - now).total_seconds())
-        
-        cache_url(short_code, original_url, expire)
+    return link.original_url
+
+async def load_link_info(short_code: str) -> str:
+    """Загружает информацию о ссылке из БД и кеширует ее JSON на короткое время"""
+    async with AsyncSessionLocal() as db:
+        link = await load_active_link(db, short_code)
     
-    return RedirectResponse(url=original_url)
+    link_info = LinkResponse(
+        short_code=link.short_code,
+        original_url=link.original_url,
+        short_url=build_short_url(link.short_code),
+        created_at=link.created_at,
+        expires_at=link.expires_at
+    ).model_dump_json()
+    
+    expire = settings.LINK_INFO_CACHE_TTL
+    if link.expires_at:
+        expire = min(get_cache_ttl(link.expires_at) or 0, expire)
+    if expire > 0:
+        await cache_link_info(short_code, link_info, expire)
+    
+    return link_info
 
 # Создание короткой ссылки
 @router.post("/links/shorten", response_model=LinkResponse, status_code=status.HTTP_201_CREATED)
 async def create_short_link(
     link_data: LinkCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Optional[User] = Depends(get_current_active_user)
 ):
     """Создает короткую ссылку"""
+    url_hash = url_fingerprint(link_data.original_url)
+    
     if link_data.custom_alias:
-        existing_alias = db.query(Link).filter(
-            Link.short_code == link_data.custom_alias
-        ).first()
+        existing_alias = await db.scalar(select(Link).filter(Link.short_code == link_data.custom_alias))
         
         if existing_alias:
             raise HTTPException(
@@ -102,43 +161,58 @@ async def create_short_link(
         new_link = Link(
             short_code=short_code,
             original_url=link_data.original_url,
+            url_hash=url_hash,
             expires_at=link_data.expires_at,
             owner_id=current_user.id if current_user else None
         )
         
+        await add_known_code(short_code)
         db.add(new_link)
-        db.commit()
-        db.refresh(new_link)
+        await db.commit()
+        await db.refresh(new_link)
+        await schedule_expiry(short_code, new_link.expires_at)
     else:
-        existing_link = db.query(Link).filter(Link.original_url == link_data.original_url).first()
+        existing_link = await db.scalar(select(Link).filter(Link.url_hash == url_hash).limit(1))
         
         if existing_link:
             if existing_link.expires_at and existing_link.expires_at < datetime.now(timezone.utc):
                 existing_link.expires_at = link_data.expires_at
-                db.commit()
-                db.refresh(existing_link)
+                await db.commit()
+                await db.refresh(existing_link)
+                await schedule_expiry(existing_link.short_code, existing_link.expires_at)
             
             new_link = existing_link
         else:
-            while True:
-                short_code = generate_short_code()
-                existing = db.query(Link).filter(Link.short_code == short_code).first()
-                if not existing:
+            for _ in range(MAX_SHORT_CODE_ATTEMPTS):
+                short_code = await allocate_short_code()
+                
+                new_link = Link(
+                    short_code=short_code,
+                    original_url=link_data.original_url,
+                    url_hash=url_hash,
+                    expires_at=link_data.expires_at,
+                    owner_id=current_user.id if current_user else None
+                )
+                
+                await add_known_code(short_code)
+                db.add(new_link)
+                try:
+                    await db.commit()
                     break
-            
-            new_link = Link(
-                short_code=short_code,
-                original_url=link_data.original_url,
-                expires_at=link_data.expires_at,
-                owner_id=current_user.id if current_user else None
-            )
-            
-            db.add(new_link)
-            db.commit()
-            db.refresh(new_link)
+                except IntegrityError:
+                    await db.rollback()
+            else:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Не удалось выделить короткий код"
+                )
+            await db.refresh(new_link)
+            await schedule_expiry(short_code, new_link.expires_at)
+    
+    await invalidate_search_cache(url_hash)
     
-    if link_data.custom_alias or is_popular_url(new_link.short_code):
-        cache_url(new_link.short_code, new_link.original_url)
+    if link_data.custom_alias or await is_popular_url(new_link.short_code):
+        await cache_url(new_link.short_code, new_link.original_url)
         
     response = LinkResponse(
         short_code=new_link.short_code,
@@ -150,17 +224,276 @@ async def create_short_link(
     
     return response
 
+# Пакетное создание коротких ссылок
+@router.post("/links/shorten/batch", response_model=LinkBatchResponse)
+async def create_short_links_batch(
+    batch: LinkBatchCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_current_active_user)
+):
+    """Создает пачку коротких ссылок: дедупликация одним запросом и одна многострочная вставка"""
+    items = batch.links
+    url_hashes = [url_fingerprint(item.original_url) for item in items]
+    results = [LinkBatchResult(index=index) for index in range(len(items))]
+    
+    # Алиасы, повторяющиеся в пакете или уже занятые, получают ошибку только в своем элементе
+    aliases = {}
+    for index, item in enumerate(items):
+        if not item.custom_alias:
+            continue
+        if item.custom_alias in aliases:
+            results[index].error = "Пользовательский алиас повторяется в пакете"
+        else:
+            aliases[item.custom_alias] = index
+    
+    for alias in await find_taken_aliases(db, list(aliases)):
+        results[aliases.pop(alias)].error = "Пользовательский алиас уже занят"
+    
+    # URL без алиаса дедуплицируются по отпечатку внутри пакета и с существующими ссылками
+    first_by_hash = {}
+    for index, item in enumerate(items):
+        if not item.custom_alias:
+            first_by_hash.setdefault(url_hashes[index], index)
+    
+    existing = {}
+    if first_by_hash:
+        for link in (await db.scalars(
+            select(Link).filter(Link.url_hash.in_(list(first_by_hash))).order_by(Link.id)
+        )).all():
+            existing.setdefault(link.url_hash, link)
+    
+    # Истекшая существующая ссылка продлевается сроком из запроса, как в POST /links/shorten
+    revived = []
+    revived_indexes = []
+    for url_hash, link in existing.items():
+        index = first_by_hash[url_hash]
+        expires_at = link.expires_at
+        if expires_at and is_expired(expires_at):
+            expires_at = items[index].expires_at
+            revived.append({"link_id": link.id, "new_expires_at": expires_at})
+            revived_indexes.append(index)
+        results[index].link = LinkResponse(
+            short_code=link.short_code,
+            original_url=link.original_url,
+            short_url=build_short_url(link.short_code),
+            created_at=link.created_at,
+            expires_at=expires_at
+        )
+    
+    pending = sorted(list(aliases.values()) + [
+        index for url_hash, index in first_by_hash.items() if url_hash not in existing
+    ])
+    owner_id = current_user.id if current_user else None
+    
+    for _ in range(MAX_SHORT_CODE_ATTEMPTS):
+        codes = iter(await allocate_short_codes(sum(1 for index in pending if not items[index].custom_alias)))
+        short_codes = [items[index].custom_alias or next(codes) for index in pending]
+        rows = [
+            {
+                "short_code": short_code,
+                "original_url": items[index].original_url,
+                "url_hash": url_hashes[index],
+                "expires_at": items[index].expires_at,
+                "owner_id": owner_id
+            } for index, short_code in zip(pending, short_codes)
+        ]
+        
+        await add_known_codes(short_codes)
+        try:
+            if revived:
+                await db.execute(
+                    update(links_table)
+                    .where(links_table.c.id == bindparam("link_id"))
+                    .values(expires_at=bindparam("new_expires_at")),
+                    revived
+                )
+            # Строки сопоставляются по short_code, поэтому порядок RETURNING не важен
+            inserted = dict((await db.execute(
+                insert(links_table).returning(links_table.c.short_code, links_table.c.created_at),
+                rows
+            )).all()) if rows else {}
+            await db.commit()
+            break
+        except IntegrityError:
+            # Алиас могли занять параллельно, а выделенный код — совпасть со старым; остальное повторяется
+            await db.rollback()
+            for alias in await find_taken_aliases(db, [items[index].custom_alias for index in pending if items[index].custom_alias]):
+                index = aliases.pop(alias)
+                results[index].error = "Пользовательский алиас уже занят"
+                pending.remove(index)
+    else:
+        # Продление истекших ссылок откатилось вместе со вставкой
+        for index in pending + revived_indexes:
+            results[index].link = None
+            results[index].error = "Не удалось выделить короткий код"
+        pending, rows, revived_indexes = [], [], []
+    
+    for index, row in zip(pending, rows):
+        results[index].created = True
+        results[index].link = LinkResponse(
+            short_code=row["short_code"],
+            original_url=row["original_url"],
+            short_url=build_short_url(row["short_code"]),
+            created_at=inserted[row["short_code"]],
+            expires_at=row["expires_at"]
+        )
+    
+    # Повторы URL внутри пакета получают результат первого вхождения
+    for index, item in enumerate(items):
+        first = first_by_hash.get(url_hashes[index]) if not item.custom_alias else index
+        if first != index:
+            results[index].link = results[first].link
+            results[index].error = results[first].error
+    
+    touched = [results[index].link for index in pending + revived_indexes]
+    await schedule_expiries({link.short_code: link.expires_at for link in touched})
+    await invalidate_search_cache(*{url_fingerprint(link.original_url) for link in touched})
+    await cache_urls_if_missing([
+        (results[index].link.short_code, results[index].link.original_url, get_cache_ttl(results[index].link.expires_at))
+        for index in aliases.values() if results[index].created
+    ])
+    
+    return LinkBatchResponse(
+        results=results,
+        created=sum(1 for result in results if result.created),
+        existing=sum(1 for result in results if result.link and not result.created),
+        failed=sum(1 for result in results if result.error)
+    )
+
+async def find_taken_aliases(db: AsyncSession, aliases: list) -> list:
+    """Возвращает алиасы из списка, которые уже заняты"""
+    if not aliases:
+        return []
+    return (await db.scalars(select(Link.short_code).filter(Link.short_code.in_(aliases)))).all()
+
+# Список ссылок текущего пользователя
+@router.get("/links/mine", response_model=LinkPage)
+async def list_my_links(
+    cursor: Optional[int] = Query(None, description="id последней ссылки предыдущей страницы"),
+    limit: int = Query(50, ge=1, le=settings.LINKS_PAGE_MAX_SIZE),
+    current_user: User = Depends(get_required_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Возвращает страницу ссылок пользователя; следующая страница начинается после next_cursor"""
+    query = select(*LINK_EXPORT_COLUMNS).filter(Link.owner_id == current_user.id)
+    if cursor is not None:
+        query = query.filter(Link.id > cursor)
+    
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = (await db.execute(query.order_by(Link.id).limit(limit + 1))).all()
+    page = rows[:limit]
+    
+    return LinkPage(
+        links=[LinkListItem(**item) for item in await merge_buffered_stats(page)],
+        next_cursor=page[-1].id if len(rows) > limit else None
+    )
+
+# Потоковая выгрузка ссылок текущего пользователя
+@router.get("/links/mine/export")
+async def export_my_links(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson или csv"),
+    current_user: User = Depends(get_required_user)
+):
+    """Выгружает все ссылки пользователя со статистикой, не собирая их в памяти"""
+    return StreamingResponse(
+        stream_links_export(current_user.id, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="links.{format}"'}
+    )
+
+# Статистика пачки ссылок
+@router.post("/links/stats/batch", response_model=LinkStatsBatchResponse)
+async def get_links_stats_batch(
+    request_data: LinkStatsBatchRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """Возвращает актуальную статистику пачки ссылок за один запрос к БД и один к Redis"""
+    short_codes = list(dict.fromkeys(request_data.short_codes))
+    rows = (await db.execute(
+        select(*LINK_EXPORT_COLUMNS).filter(Link.short_code.in_(short_codes))
+    )).all()
+    
+    stats = {item["short_code"]: item for item in await merge_buffered_stats(rows)}
+    
+    return LinkStatsBatchResponse(
+        links=[LinkStats(**stats[code]) for code in short_codes if code in stats],
+        missing=[code for code in short_codes if code not in stats]
+    )
+
+async def merge_buffered_stats(rows: list) -> list:
+    """Добавляет к строкам ссылок клики из буфера Redis, прочитанные одним MGET"""
+    # Если синхронизация перенесет буфер в БД между двумя чтениями, ответ
+    # может разово разойтись на одну пачку кликов; следующий запрос точен
+    buffered = await get_buffered_stats_bulk([row.short_code for row in rows])
+    items = []
+    for row in rows:
+        clicks, last_access = buffered[row.short_code]
+        items.append({
+            "short_code": row.short_code,
+            "original_url": row.original_url,
+            "short_url": build_short_url(row.short_code),
+            "created_at": row.created_at,
+            "expires_at": row.expires_at,
+            "click_count": (row.click_count or 0) + clicks,
+            "last_accessed": last_access or row.last_accessed
+        })
+    return items
+
+async def stream_links_export(owner_id: int, export_format: str):
+    """Читает ссылки серверным курсором пачками по EXPORT_CHUNK_SIZE и отдает их по мере чтения"""
+    # Своя сессия: сессия из зависимости закрывается до того, как отдано тело ответа
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            select(*LINK_EXPORT_COLUMNS)
+            .filter(Link.owner_id == owner_id)
+            .order_by(Link.id)
+            .execution_options(yield_per=settings.EXPORT_CHUNK_SIZE)
+        )
+        
+        if export_format == "csv":
+            yield ",".join(LINK_LIST_FIELDS) + "\r\n"
+        
+        async for rows in result.partitions():
+            items = await merge_buffered_stats(rows)
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for item in items:
+                    writer.writerow([
+                        value.isoformat() if isinstance(value, datetime) else value
+                        for value in (item[field] for field in LINK_LIST_FIELDS)
+                    ])
+                yield buffer.getvalue()
+            else:
+                yield "".join(dumps(item) + "\n" for item in items)
+
 # Поиск ссылки по оригинальному URL
 @router.get("/links/search", response_model=LinkSearchResponse)
-async def search_link_by_url(
-    original_url: str,
-    db: Session = Depends(get_db)
-):
+async def search_link_by_url(original_url: str):
     """Ищет короткие ссылки по оригинальному URL"""
-    links = db.query(Link).filter(
-        Link.original_url == original_url,
-        (Link.expires_at.is_(None) | (Link.expires_at > datetime.now(timezone.utc)))
-    ).all()
+    url_hash = url_fingerprint(original_url)
+    search_result = await get_cached_search(url_hash)
+    
+    if search_result is None:
+        search_result = await load_once(
+            get_search_cache_key(url_hash),
+            lambda: load_search_result(url_hash),
+            lambda: get_cached_search(url_hash)
+        )
+    
+    response = LinkSearchResponse.model_validate_json(search_result)
+    
+    # Закешированный результат мог устареть не раньше первой истекшей ссылки, но не позже
+    links = [link for link in response.links if not is_expired(link.expires_at)]
+    return LinkSearchResponse(links=links, count=len(links))
+
+async def load_search_result(url_hash: str) -> str:
+    """Загружает действующие ссылки по отпечатку URL и кеширует ответ поиска"""
+    async with AsyncSessionLocal() as db:
+        links = (await db.scalars(select(Link).filter(
+            Link.url_hash == url_hash,
+            (Link.expires_at.is_(None) | (Link.expires_at > datetime.now(timezone.utc)))
+        ).order_by(Link.id))).all()
     
     response_links = [
         LinkResponse(
@@ -172,46 +505,48 @@ async def search_link_by_url(
         ) for link in links
     ]
     
-    return LinkSearchResponse(links=response_links, count=len(response_links))
+    search_result = LinkSearchResponse(links=response_links, count=len(response_links)).model_dump_json()
+    
+    # Кеш не живет дольше самой ранней из найденных ссылок
+    expire = settings.SEARCH_CACHE_TTL
+    for link in links:
+        expire = min(expire, get_cache_ttl(link.expires_at) or expire)
+    await cache_search(url_hash, search_result, expire)
+    
+    return search_result
 
 # Получение информации о ссылке
 @router.get("/links/{short_code}", response_model=LinkResponse)
-async def get_link_info(
-    short_code: str,
-    db: Session = Depends(get_db)
-):
+async def get_link_info(short_code: str):
     """Получает информацию о короткой ссылке"""
-    link = db.query(Link).filter(Link.short_code == short_code).first()
+    link_info = await get_cached_link_info(short_code)
     
-    if not link:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Ссылка не найдена"
+    if link_info is None:
+        link_info = await load_once(
+            get_link_info_cache_key(short_code),
+            lambda: load_link_info(short_code),
+            lambda: get_cached_link_info(short_code)
         )
     
+    response = LinkResponse.model_validate_json(link_info)
+    
     # Проверяем срок действия
-    if is_expired(link.expires_at):
+    if is_expired(response.expires_at):
         raise HTTPException(
             status_code=status.HTTP_410_GONE,
             detail="Срок действия ссылки истек"
         )
     
-    return LinkResponse(
-        short_code=link.short_code,
-        original_url=link.original_url,
-        short_url=build_short_url(link.short_code),
-        created_at=link.created_at,
-        expires_at=link.expires_at
-    )
+    return response
 
 # Получение статистики по ссылке
 @router.get("/links/{short_code}/stats", response_model=LinkStatsDetailed)
 async def get_link_stats(
     short_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получает статистику использования короткой ссылки"""    
-    link = db.query(Link).filter(Link.short_code == short_code).first()
+    link = await db.scalar(select(Link).filter(Link.short_code == short_code))
     
     if not link:
         raise HTTPException(
@@ -219,37 +554,82 @@ async def get_link_stats(
             detail="Ссылка не найдена"
         )
     
-    recent_clicks = db.query(Click).filter(
+    recent_clicks = (await db.scalars(select(Click).filter(
         Click.link_id == link.id
-    ).order_by(Click.timestamp.desc()).limit(10).all()
+    ).order_by(Click.timestamp.desc()).limit(10))).all()
     
+    # Еще не синхронизированные клики из буфера Redis дают актуальные значения
     stats = LinkStatsDetailed(
-        short_code=link.short_code,
-        original_url=link.original_url,
-        created_at=link.created_at,
-        expires_at=link.expires_at,
-        click_count=link.click_count,
-        last_accessed=link.last_accessed,
+        **(await merge_buffered_stats([link]))[0],
         recent_clicks=recent_clicks
     )
     
     return stats
 
+# Клики по часам или дням из агрегатов
+@router.get("/links/{short_code}/stats/timeseries", response_model=ClickTimeseries)
+async def get_link_stats_timeseries(
+    short_code: str,
+    bucket: str = Query("hour", pattern="^(hour|day)$", description="hour или day"),
+    start: Optional[datetime] = Query(None, alias="from", description="Начало диапазона, по умолчанию 24 часа или 30 дней назад"),
+    end: Optional[datetime] = Query(None, alias="to", description="Конец диапазона, по умолчанию текущее время"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Возвращает число кликов по корзинам из таблиц агрегатов, не читая сырые клики"""
+    end = bucket_start(end or datetime.now(timezone.utc), bucket)
+    start = bucket_start(start, bucket) if start else end - BUCKET_SIZES[bucket] * (DEFAULT_BUCKET_COUNTS[bucket] - 1)
+    
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Начало диапазона позже конца"
+        )
+    if (end - start) / BUCKET_SIZES[bucket] + 1 > settings.TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Диапазон превышает {settings.TIMESERIES_MAX_BUCKETS} корзин"
+        )
+    
+    link_id = await db.scalar(select(Link.id).filter(Link.short_code == short_code))
+    if link_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ссылка не найдена"
+        )
+    
+    points = await get_click_timeseries(db, link_id, bucket, start, end)
+    
+    return ClickTimeseries(
+        short_code=short_code,
+        bucket=bucket,
+        start=start,
+        end=end,
+        total=sum(clicks for _, clicks in points),
+        points=[ClickTimeseriesPoint(bucket_start=point, clicks=clicks) for point, clicks in points]
+    )
+
 # Обновление ссылки
 @router.put("/links/{short_code}", response_model=LinkResponse)
 async def update_link(
     short_code: str,
     link_data: LinkUpdate,
     link: Link = Depends(get_link_owner_or_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Обновляет URL для короткой ссылки"""
+    old_url_hash = link.url_hash
     if link_data.original_url:
         link.original_url = link_data.original_url
+        link.url_hash = url_fingerprint(link_data.original_url)
+    
+    # Явно переданный null снимает срок действия
+    if "expires_at" in link_data.model_fields_set:
+        link.expires_at = link_data.expires_at
     
+    clicks = 0
     try:
-        clicks = get_buffered_clicks(short_code)
-        last_access = get_buffered_last_access(short_code)
+        clicks = await get_buffered_clicks(short_code)
+        last_access = await get_buffered_last_access(short_code)
         
         if clicks > 0:
             link.click_count += clicks
@@ -258,20 +638,17 @@ async def update_link(
     except Exception as e:
         print(f"Ошибка при синхронизации статистики: {e}")
     
-    db.commit()
-    db.refresh(link)
+    await db.commit()
+    await db.refresh(link)
     
-    invalidate_url_cache(short_code)
-    reset_buffered_stats(short_code)
+    await invalidate_url_cache(short_code)
+    await invalidate_search_cache(old_url_hash, link.url_hash)
+    # Вычитаются только перенесенные клики: пришедшие после чтения счетчика дождутся синхронизации
+    await reset_buffered_stats_bulk({short_code: clicks})
+    await schedule_expiry(short_code, link.expires_at)
     
-    if link.click_count >= settings.POPULAR_URL_THRESHOLD:
-        expire = None
-        if link.expires_at:
-            now = datetime.now(timezone.utc)
-            if link.expires_at > now:
-                expire = int((link.expires_at - now).total_seconds())
-        
-        cache_url(short_code, link.original_url, expire)
+    if link.click_count >= settings.POPULAR_URL_THRESHOLD and not is_expired(link.expires_at):
+        await cache_url(short_code, link.original_url, get_cache_ttl(link.expires_at))
     
     return LinkResponse(
         short_code=link.short_code,
@@ -286,14 +663,18 @@ async def update_link(
 async def delete_link(
     short_code: str,
     link: Link = Depends(get_link_owner_or_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Удаляет короткую ссылку"""
-    db.delete(link)
-    db.commit()
+    await delete_rollups(db, [link.id])
+    await db.delete(link)
+    await db.commit()
     
-    invalidate_url_cache(short_code)
+    await invalidate_url_cache(short_code)
+    await invalidate_search_cache(link.url_hash)
+    await remove_known_code(short_code)
+    await unschedule_expiry(short_code)
     
-    reset_buffered_stats(short_code)
+    await reset_buffered_stats(short_code)
     
     return Response(status_code=status.HTTP_204_NO_CONTENT)
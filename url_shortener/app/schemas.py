@@ -2,6 +2,7 @@ from pydantic import BaseModel, Field, field_validator, ConfigDict
 from typing import Optional, List
 from datetime import datetime
 import validators
+from app.config import settings
 
 class UserBase(BaseModel):
     username: str
@@ -42,8 +43,13 @@ class LinkCreate(LinkBase):
                                        description="Пользовательский алиас для короткой ссылки")
     expires_at: Optional[datetime] = Field(None, description="Время истечения срока действия ссылки")
 
+class LinkBatchCreate(BaseModel):
+    links: List[LinkCreate] = Field(..., min_length=1, max_length=settings.BATCH_SHORTEN_MAX_ITEMS,
+                                    description="Ссылки для создания одним запросом")
+
 class LinkUpdate(BaseModel):
     original_url: Optional[str] = Field(None, description="Новый оригинальный URL")
+    expires_at: Optional[datetime] = Field(None, description="Новое время истечения; null делает ссылку бессрочной")
     
     @field_validator('original_url')
     def validate_url(cls, v):
@@ -69,11 +75,38 @@ class LinkStats(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class LinkListItem(LinkStats):
+    short_url: str
+
+class LinkPage(BaseModel):
+    links: List[LinkListItem]
+    next_cursor: Optional[int] = Field(None, description="Передается в cursor для следующей страницы; null на последней")
+
+class LinkStatsBatchRequest(BaseModel):
+    short_codes: List[str] = Field(..., min_length=1, max_length=settings.STATS_BATCH_MAX_ITEMS,
+                                   description="Короткие коды ссылок")
+
+class LinkStatsBatchResponse(BaseModel):
+    links: List[LinkStats]
+    missing: List[str]
+
 class LinkStatsDetailed(LinkStats):
     recent_clicks: List[ClickInfo] = []
     
     model_config = ConfigDict(from_attributes=True)
 
+class ClickTimeseriesPoint(BaseModel):
+    bucket_start: datetime
+    clicks: int
+
+class ClickTimeseries(BaseModel):
+    short_code: str
+    bucket: str
+    start: datetime
+    end: datetime
+    total: int
+    points: List[ClickTimeseriesPoint]
+
 class LinkResponse(BaseModel):
     short_code: str
     original_url: str
@@ -85,4 +118,16 @@ class LinkResponse(BaseModel):
 
 class LinkSearchResponse(BaseModel):
     links: List[LinkResponse]
-    count: int
\ No newline at end of file
+    count: int
+
+class LinkBatchResult(BaseModel):
+    index: int
+    link: Optional[LinkResponse] = None
+    created: bool = False
+    error: Optional[str] = None
+
+class LinkBatchResponse(BaseModel):
+    results: List[LinkBatchResult]
+    created: int
+    existing: int
+    failed: int
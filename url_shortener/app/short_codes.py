@@ -0,0 +1,184 @@
+import abc
+import asyncio
+import hashlib
+import string
+from collections import deque
+from functools import lru_cache
+from sqlalchemy import text, select, insert, func
+
+from app import async_cache
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import ShortCodeBlock
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+FEISTEL_ROUNDS = 4
+
+SHORT_CODE_COUNTER_KEY = "short_code_counter"  # Счетчик выданных идентификаторов в Redis
+SHORT_CODE_SEQUENCE = "short_code_ids"  # Последовательность идентификаторов в Postgres
+
+# Выдает блок, только если счетчик существует; пропавший счетчик сначала восстанавливается из БД.
+# KEYS: счетчик
+# ARGV: размер блока
+LEASE_BLOCK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+lease_block_script = async_cache.redis_client.register_script(LEASE_BLOCK_SCRIPT)
+
+# Ключ перестановки; без него коды можно было бы перебирать подряд
+_round_hasher = hashlib.blake2b(
+    key=hashlib.sha256(settings.SHORT_CODE_SECRET.encode()).digest(),
+    digest_size=8
+)
+
+def encode_base62(number: int, length: int) -> str:
+    """Кодирует число в base62 с дополнением нулями слева до нужной длины"""
+    chars = []
+    while number:
+        number, remainder = divmod(number, BASE)
+        chars.append(ALPHABET[remainder])
+    return "".join(reversed(chars)).rjust(length, ALPHABET[0])
+
+def decode_base62(code: str) -> int:
+    """Обратное преобразование к encode_base62"""
+    number = 0
+    for char in code:
+        number = number * BASE + ALPHABET.index(char)
+    return number
+
+@lru_cache(maxsize=None)
+def _feistel_half_bits(length: int) -> int:
+    """Разрядность половины блока сети Фейстеля, покрывающей все коды длины length"""
+    bits = (BASE ** length - 1).bit_length()
+    return (bits + 1) // 2
+
+def _round(value: int, round_number: int, mask: int) -> int:
+    hasher = _round_hasher.copy()
+    hasher.update(value.to_bytes(8, "little") + bytes((round_number,)))
+    return int.from_bytes(hasher.digest(), "little") & mask
+
+def _feistel(value: int, half_bits: int) -> int:
+    mask = (1 << half_bits) - 1
+    left, right = value >> half_bits, value & mask
+    for round_number in range(FEISTEL_ROUNDS):
+        left, right = right, left ^ _round(right, round_number, mask)
+    return (left << half_bits) | right
+
+def permute(value: int, length: int) -> int:
+    """Биекция на [0, 62^length): сеть Фейстеля с повторным шифрованием выходов за диапазон"""
+    domain = BASE ** length
+    half_bits = _feistel_half_bits(length)
+    value = _feistel(value, half_bits)
+    while value >= domain:
+        value = _feistel(value, half_bits)
+    return value
+
+def encode_short_code(number: int, min_length: int = settings.DEFAULT_SHORT_CODE_LENGTH) -> str:
+    """Короткий код для идентификатора; коды удлиняются, когда исчерпан текущий диапазон"""
+    length = min_length
+    while number >= BASE ** length:
+        length += 1
+    return encode_base62(permute(number, length), length)
+
+
+class BlockAllocator(abc.ABC):
+    """Выдает идентификаторы из блоков, арендуемых у общего счетчика"""
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._ids: deque = deque()
+        self._lock = asyncio.Lock()
+
+    @abc.abstractmethod
+    async def lease_block(self, size: int) -> list:
+        """Резервирует в общем счетчике не менее size идентификаторов"""
+
+    async def next_ids(self, count: int) -> list:
+        """Возвращает count уникальных идентификаторов"""
+        async with self._lock:
+            if len(self._ids) < count:
+                self._ids.extend(await self.lease_block(max(self.block_size, count - len(self._ids))))
+            return [self._ids.popleft() for _ in range(count)]
+
+    async def next_id(self) -> int:
+        return (await self.next_ids(1))[0]
+
+
+async def get_leased_until() -> int:
+    """Конец последнего блока, выданного счетчиком в Redis, по записям в БД"""
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.max(ShortCodeBlock.end_id))) or 0
+
+async def save_leased_until(end: int) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(ShortCodeBlock.__table__), {"end_id": end})
+        await db.commit()
+
+
+class RedisBlockAllocator(BlockAllocator):
+    """Блоки из счетчика в Redis: один INCRBY на блок.
+
+    Конец каждого блока записывается в БД до выдачи кодов, поэтому счетчик,
+    потерянный вместе с данными Redis, продолжается после уже выданных кодов.
+    """
+
+    async def lease_block(self, size: int) -> list:
+        end = await lease_block_script(keys=[SHORT_CODE_COUNTER_KEY], args=[size], client=async_cache.redis_client)
+        if end is None:
+            # SET NX: из нескольких воркеров счетчик восстанавливает один
+            await async_cache.redis_client.set(SHORT_CODE_COUNTER_KEY, await get_leased_until(), nx=True)
+            end = await async_cache.redis_client.incrby(SHORT_CODE_COUNTER_KEY, size)
+        await save_leased_until(end)
+        return list(range(end - size, end))
+
+
+class PostgresSequenceAllocator(BlockAllocator):
+    """Блоки из последовательности Postgres: один запрос на блок"""
+
+    def __init__(self, block_size: int):
+        super().__init__(block_size)
+        self._sequence_ready = False
+
+    async def lease_block(self, size: int) -> list:
+        async with AsyncSessionLocal() as db:
+            if not self._sequence_ready:
+                await db.execute(text(
+                    f"CREATE SEQUENCE IF NOT EXISTS {SHORT_CODE_SEQUENCE} MINVALUE 0 START 0"
+                ))
+                self._sequence_ready = True
+            result = await db.scalars(
+                text(f"SELECT nextval('{SHORT_CODE_SEQUENCE}') FROM generate_series(1, :size)"),
+                {"size": size}
+            )
+            ids = list(result)
+            await db.commit()
+        return ids
+
+
+ALLOCATORS = {
+    "redis": RedisBlockAllocator,
+    "postgres": PostgresSequenceAllocator,
+}
+
+def get_allocator(name: str = settings.SHORT_CODE_ALLOCATOR) -> BlockAllocator:
+    """Создает распределитель идентификаторов по имени из настроек"""
+    try:
+        allocator_class = ALLOCATORS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный распределитель коротких кодов: {name}")
+    return allocator_class(settings.SHORT_CODE_BLOCK_SIZE)
+
+allocator = get_allocator()
+
+async def allocate_short_code() -> str:
+    """Выдает новый короткий код без проверки в БД"""
+    return encode_short_code(await allocator.next_id())
+
+async def allocate_short_codes(count: int) -> list:
+    """Выдает count новых коротких кодов за одну аренду блока"""
+    return [encode_short_code(number) for number in await allocator.next_ids(count)]
@@ -0,0 +1,80 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+from app import async_cache
+from app.config import settings
+from app.metrics import SINGLE_FLIGHT_EVENTS, SINGLE_FLIGHT_IN_FLIGHT
+
+FILL_LOCK_PREFIX = "fill_lock:"  # Воркер, который сейчас загружает ключ из БД
+FILL_POLL_INTERVAL = 0.02
+
+# Снимает блокировку, только если она все еще принадлежит этому воркеру
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+release_lock_script = async_cache.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+# Статистика объединения промахов
+single_flight_stats = {"loads": 0, "coalesced": 0, "lock_waits": 0, "lock_wait_hits": 0}
+SINGLE_FLIGHT_EVENTS.set_function(lambda: {(event,): value for event, value in single_flight_stats.items()})
+
+# Загрузки, выполняющиеся в этом процессе, по ключу
+_in_flight: dict = {}
+SINGLE_FLIGHT_IN_FLIGHT.set_function(lambda: len(_in_flight))
+
+async def load_once(
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    read_cache: Callable[[], Awaitable[Optional[Any]]]
+) -> Any:
+    """Выполняет loader один раз на ключ: в процессе через общую задачу, между воркерами через блокировку"""
+    task = _in_flight.get(key)
+    if task is not None:
+        single_flight_stats["coalesced"] += 1
+    else:
+        task = asyncio.ensure_future(_load_with_lock(key, loader, read_cache))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # Отмена одного запроса не должна прерывать загрузку для остальных
+    return await asyncio.shield(task)
+
+async def _load_with_lock(
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    read_cache: Callable[[], Awaitable[Optional[Any]]]
+) -> Any:
+    client = async_cache.redis_client
+    lock_key = f"{FILL_LOCK_PREFIX}{key}"
+    token = uuid.uuid4().hex
+
+    if await client.set(lock_key, token, nx=True, px=settings.FILL_LOCK_TTL_MS):
+        try:
+            single_flight_stats["loads"] += 1
+            return await loader()
+        finally:
+            await release_lock_script(keys=[lock_key], args=[token], client=client)
+
+    # Ключ загружает другой воркер: ждем, пока он заполнит кеш
+    single_flight_stats["lock_waits"] += 1
+    deadline = time.monotonic() + settings.FILL_WAIT_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(FILL_POLL_INTERVAL)
+        value = await read_cache()
+        if value is not None:
+            single_flight_stats["lock_wait_hits"] += 1
+            return value
+
+    # Кеш так и не заполнился (например, ссылки нет): загружаем сами
+    single_flight_stats["loads"] += 1
+    return await loader()
+
+def get_single_flight_stats() -> dict:
+    """Возвращает число загрузок из БД и объединенных промахов"""
+    return {"in_flight": len(_in_flight), **single_flight_stats}
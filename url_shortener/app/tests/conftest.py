@@ -4,20 +4,25 @@ os.environ["TESTING"] = "True"
 
 import pytest
 import fakeredis
+import fakeredis.aioredis
 import asyncio
-from fastapi import HTTPException, status
+from unittest.mock import patch, AsyncMock
+from fastapi import HTTPException, status, Depends
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from datetime import datetime, timezone
 
-from app.database import Base, get_db, SessionLocal, engine
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import Base, get_db, SessionLocal, AsyncSessionLocal, engine
 from app.main import app as fastapi_app
 from app.models import User, Link, Click
 from app.utils import get_password_hash
 from app.dependencies import get_current_active_user, get_link_owner_or_admin, get_client_info
 import app.cache
+import app.async_cache
 from app.utils import extract_client_info
 from fastapi import Request
 
@@ -25,14 +30,37 @@ from fastapi import Request
 @pytest.fixture(scope="function")
 def redis_mock():
     original_redis = app.cache.redis_client
+    original_async_redis = app.async_cache.redis_client
+    original_binary_redis = app.cache.redis_binary_client
+    original_async_binary_redis = app.async_cache.redis_binary_client
 
-    fake_redis = fakeredis.FakeStrictRedis(decode_responses=True)
+    # Синхронный и асинхронный клиенты работают с одним фейковым сервером
+    server = fakeredis.FakeServer()
+    fake_redis = fakeredis.FakeStrictRedis(server=server, decode_responses=True)
 
     app.cache.redis_client = fake_redis
+    app.async_cache.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    app.cache.redis_binary_client = fakeredis.FakeStrictRedis(server=server)
+    app.async_cache.redis_binary_client = fakeredis.aioredis.FakeRedis(server=server)
+    app.cache.url_l1_cache.clear()
+    app.cache.user_l1_cache.clear()
+    app.cache.token_l1_cache.clear()
+    app.cache.click_text_ids.clear()
+    app.cache.click_texts.clear()
+    app.cache.click_dict_state["epoch"] = None
     
     yield fake_redis
     
     app.cache.redis_client = original_redis
+    app.async_cache.redis_client = original_async_redis
+    app.cache.redis_binary_client = original_binary_redis
+    app.async_cache.redis_binary_client = original_async_binary_redis
+    app.cache.url_l1_cache.clear()
+    app.cache.user_l1_cache.clear()
+    app.cache.token_l1_cache.clear()
+    app.cache.click_text_ids.clear()
+    app.cache.click_texts.clear()
+    app.cache.click_dict_state["epoch"] = None
     
 @pytest.fixture(scope="function")
 def db():
@@ -56,16 +84,19 @@ async def mock_client_info(request: Request = None):
 
 @pytest.fixture
 def client(db, redis_mock):
-    def override_get_db():
-        try:
-            yield db
-        finally:
-            pass
+    # Приложение работает через AsyncSession с той же тестовой базой
+    async def override_get_db():
+        async with AsyncSessionLocal() as session:
+            yield session
     
     fastapi_app.dependency_overrides[get_db] = override_get_db
     fastapi_app.dependency_overrides[get_client_info] = mock_client_info
     
-    with TestClient(fastapi_app) as client:
+    # Фоновые задачи и построение фильтра известных кодов не гоняются с тестом: фильтр,
+    # построенный после прямой вставки в БД, отсекал бы такие ссылки. Тесты строят его явно
+    with patch('app.main.settings.RUN_BACKGROUND_JOBS', False), \
+            patch('app.main.build_known_codes', AsyncMock()), \
+            TestClient(fastapi_app) as client:
         yield client
     
     fastapi_app.dependency_overrides = {}
@@ -94,8 +125,8 @@ def auth_client(client, db):
     
     fastapi_app.dependency_overrides[get_current_active_user] = override_get_current_user
     
-    async def override_get_link_owner_or_admin(short_code: str):
-        link = db.query(Link).filter(Link.short_code == short_code).first()
+    async def override_get_link_owner_or_admin(short_code: str, session: AsyncSession = Depends(get_db)):
+        link = await session.scalar(select(Link).filter(Link.short_code == short_code))
         if not link:
 
             raise HTTPException(
@@ -1,5 +1,8 @@
 import pytest
 from fastapi import status
+from passlib.context import CryptContext
+from app.config import settings
+from app.models import User
 
 def test_register_user(client):
     # Test successful registration
@@ -72,4 +75,44 @@ def test_login(client, db):
             "password": "password123"
         }
     )
-    assert response.status_code == status.HTTP_401_UNAUTHORIZED
\ No newline at end of file
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+def test_login_rehashes_weak_password_hash(client, db):
+    weak_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("password123")
+    db.add(User(username="legacy", email="legacy@example.com", hashed_password=weak_hash))
+    db.commit()
+    
+    response = client.post(
+        "/auth/token",
+        data={"username": "legacy", "password": "password123"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    
+    db.expire_all()
+    user = db.query(User).filter(User.username == "legacy").first()
+    assert user.hashed_password != weak_hash
+    assert user.hashed_password.startswith(f"$2b${settings.BCRYPT_ROUNDS:02d}$")
+    
+    response = client.get("/auth/hashing/stats")
+    assert response.json()["rehashed"] >= 1
+
+def test_deactivate_account(client):
+    client.post(
+        "/auth/register",
+        json={"username": "leaving", "email": "leaving@example.com", "password": "password123"}
+    )
+    response = client.post(
+        "/auth/token",
+        data={"username": "leaving", "password": "password123"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    
+    # Первый запрос кеширует пользователя
+    response = client.post("/links/shorten", json={"original_url": "https://example.com/a"}, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    
+    response = client.post("/auth/deactivate", headers=headers)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    
+    # Кеш сброшен, поэтому деактивация видна сразу
+    response = client.post("/links/shorten", json={"original_url": "https://example.com/b"}, headers=headers)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -1,7 +1,14 @@
+import csv
+import io
+import json
 import pytest
+from sqlalchemy import text
 from datetime import datetime, timedelta, timezone
 from fastapi import status
-from app.models import Click, Link
+from unittest.mock import patch, AsyncMock
+from app.models import Click, Link, HourlyClickRollup, DailyClickRollup
+from app.utils import url_fingerprint
+from app.config import settings
 
 def test_create_short_link(auth_client):
     # Test creating a link with auto-generated short code
@@ -48,6 +55,24 @@ def test_create_short_link(auth_client):
     )
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
+def test_create_short_link_code_collision(auth_client):
+    auth_client.post(
+        "/links/shorten",
+        json={"original_url": "https://example.org", "custom_alias": "taken01"}
+    )
+    
+    # Выданный код совпал с алиасом: ссылка создается со следующим кодом
+    allocate = AsyncMock(side_effect=["taken01", "fresh01"])
+    with patch("app.routers.links.allocate_short_code", allocate):
+        response = auth_client.post(
+            "/links/shorten",
+            json={"original_url": "https://example.com/collision"}
+        )
+    
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["short_code"] == "fresh01"
+    assert allocate.await_count == 2
+
 def test_get_link_info(auth_client):
     # Create a link first
     response = auth_client.post(
@@ -121,6 +146,24 @@ def test_update_link(auth_client):
     assert data["short_code"] == short_code
     assert data["original_url"] == "https://updated-example.com"
 
+def test_update_link_keeps_clicks_recorded_during_update(auth_client, redis_mock):
+    response = auth_client.post("/links/shorten", json={"original_url": "https://example.com"})
+    short_code = response.json()["short_code"]
+    redis_mock.set(f"clicks:{short_code}", 3)
+    redis_mock.sadd("links_to_sync", short_code)
+    
+    # Клик приходит после того, как обработчик прочитал счетчик
+    async def click_during_update(code):
+        redis_mock.incr(f"clicks:{code}")
+        return None
+    
+    with patch("app.routers.links.get_buffered_last_access", side_effect=click_during_update):
+        response = auth_client.put(f"/links/{short_code}", json={"original_url": "https://updated-example.com"})
+    
+    assert response.status_code == status.HTTP_200_OK
+    assert redis_mock.get(f"clicks:{short_code}") == "1"
+    assert redis_mock.sismember("links_to_sync", short_code)
+
 def test_delete_link(auth_client):
     # Create a link first
     response = auth_client.post(
@@ -178,4 +221,258 @@ def test_get_link_stats(auth_client, db):
     assert stats["click_count"] == 3
     assert "last_accessed" in stats
     assert "recent_clicks" in stats
-    assert len(stats["recent_clicks"]) > 0
\ No newline at end of file
+    assert len(stats["recent_clicks"]) > 0
+
+def test_expiry_schedule_follows_link(auth_client, redis_mock):
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    response = auth_client.post(
+        "/links/shorten",
+        json={"original_url": "https://example.com/scheduled", "expires_at": expires_at.isoformat()}
+    )
+    short_code = response.json()["short_code"]
+    assert redis_mock.zscore("link_expiry", short_code) == pytest.approx(expires_at.timestamp())
+    
+    later = expires_at + timedelta(days=1)
+    response = auth_client.put(f"/links/{short_code}", json={"expires_at": later.isoformat()})
+    assert response.status_code == status.HTTP_200_OK
+    assert redis_mock.zscore("link_expiry", short_code) == pytest.approx(later.timestamp())
+    
+    # null снимает срок действия и убирает ссылку из расписания
+    response = auth_client.put(f"/links/{short_code}", json={"expires_at": None})
+    assert response.json()["expires_at"] is None
+    assert redis_mock.zscore("link_expiry", short_code) is None
+    
+    auth_client.put(f"/links/{short_code}", json={"expires_at": later.isoformat()})
+    auth_client.delete(f"/links/{short_code}")
+    assert redis_mock.zscore("link_expiry", short_code) is None
+
+def test_search_link_with_invalid_port(auth_client):
+    response = auth_client.get("/links/search", params={"original_url": "http://example.com:abc/"})
+    assert response.status_code == 200
+    assert response.json()["count"] == 0
+
+def test_search_link_cache(auth_client, redis_mock):
+    url = f"https://search-cache-{datetime.now().timestamp()}.com/"
+    response = auth_client.post("/links/shorten", json={"original_url": url})
+    short_code = response.json()["short_code"]
+    
+    response = auth_client.get("/links/search", params={"original_url": url})
+    assert response.json()["count"] == 1
+    cache_key = f"search:{url_fingerprint(url)}"
+    assert redis_mock.exists(cache_key)
+    
+    # Поиск находит ссылку и по неканонической записи того же URL
+    response = auth_client.get("/links/search", params={"original_url": url.upper().rstrip("/")})
+    assert response.json()["links"][0]["short_code"] == short_code
+    
+    # Создание ссылки с тем же URL сбрасывает кеш
+    response = auth_client.post("/links/shorten", json={"original_url": url, "custom_alias": "srchdup"})
+    assert not redis_mock.exists(cache_key)
+    response = auth_client.get("/links/search", params={"original_url": url})
+    assert response.json()["count"] == 2
+    
+    # Смена URL сбрасывает кеш и старого, и нового отпечатка
+    auth_client.put("/links/srchdup", json={"original_url": "https://search-cache-moved.com"})
+    assert not redis_mock.exists(cache_key)
+    response = auth_client.get("/links/search", params={"original_url": url})
+    assert [link["short_code"] for link in response.json()["links"]] == [short_code]
+    
+    auth_client.delete(f"/links/{short_code}")
+    response = auth_client.get("/links/search", params={"original_url": url})
+    assert response.json()["count"] == 0
+
+
+def test_create_short_links_batch(auth_client, redis_mock):
+    existing = auth_client.post("/links/shorten", json={"original_url": "https://batch-existing.com/"}).json()
+    auth_client.post("/links/shorten", json={"original_url": "https://batch-taken.com", "custom_alias": "batchtaken"})
+    expires_at = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    
+    response = auth_client.post("/links/shorten/batch", json={"links": [
+        {"original_url": "https://batch-new.com/1", "expires_at": expires_at},
+        {"original_url": "https://batch-existing.com"},
+        {"original_url": "https://batch-new.com/1"},
+        {"original_url": "https://batch-alias.com", "custom_alias": "batchalias"},
+        {"original_url": "https://batch-alias.com", "custom_alias": "batchalias"},
+        {"original_url": "https://batch-taken.com", "custom_alias": "batchtaken"},
+        {"original_url": "https://batch-new.com/2"},
+    ]})
+    
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    results = data["results"]
+    assert [result["index"] for result in results] == list(range(7))
+    assert (data["created"], data["existing"], data["failed"]) == (3, 2, 2)
+    
+    assert results[0]["created"] and results[0]["link"]["expires_at"] is not None
+    assert results[1]["link"]["short_code"] == existing["short_code"] and not results[1]["created"]
+    assert results[2]["link"] == results[0]["link"] and not results[2]["created"]
+    assert results[3]["link"]["short_code"] == "batchalias"
+    assert results[4]["error"] and results[4]["link"] is None
+    assert results[5]["error"] == "Пользовательский алиас уже занят"
+    assert results[6]["created"]
+    
+    # Созданные ссылки работают так же, как созданные по одной
+    new_code = results[0]["link"]["short_code"]
+    assert redis_mock.zscore("link_expiry", new_code) is not None
+    assert redis_mock.get("url:batchalias") == "https://batch-alias.com"
+    response = auth_client.get(f"/{new_code}", follow_redirects=False)
+    assert response.headers["location"] == "https://batch-new.com/1"
+    response = auth_client.get("/links/search", params={"original_url": "https://batch-new.com/2"})
+    assert response.json()["links"][0]["short_code"] == results[6]["link"]["short_code"]
+
+def test_create_short_links_batch_limits(auth_client):
+    response = auth_client.post("/links/shorten/batch", json={"links": []})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    # Ошибка валидации указывает на индекс элемента
+    response = auth_client.post("/links/shorten/batch", json={"links": [
+        {"original_url": "https://example.com"}, {"original_url": "not-a-url"}
+    ]})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json()["detail"][0]["loc"][:3] == ["body", "links", 1]
+
+def test_create_short_links_batch_revives_expired(auth_client, db):
+    db.add(Link(short_code="batchold", original_url="https://batch-expired.com",
+                expires_at=datetime.now(timezone.utc) - timedelta(days=1)))
+    db.commit()
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    
+    response = auth_client.post("/links/shorten/batch", json={"links": [
+        {"original_url": "https://batch-expired.com", "expires_at": expires_at.isoformat()}
+    ]})
+    
+    result = response.json()["results"][0]
+    assert result["link"]["short_code"] == "batchold"
+    db.expire_all()
+    stored = db.query(Link).filter(Link.short_code == "batchold").one()
+    assert stored.expires_at.replace(tzinfo=timezone.utc) == expires_at
+
+def test_create_short_links_batch_code_collision(auth_client):
+    auth_client.post("/links/shorten", json={"original_url": "https://example.org", "custom_alias": "taken02"})
+    
+    # Один из выданных кодов совпал с алиасом: вся пачка вставляется с новыми кодами
+    allocate = AsyncMock(side_effect=[["fresh02", "taken02"], ["fresh03", "fresh04"]])
+    with patch("app.routers.links.allocate_short_codes", allocate):
+        response = auth_client.post("/links/shorten/batch", json={"links": [
+            {"original_url": "https://batch-collision.com/1"},
+            {"original_url": "https://batch-collision.com/2"},
+        ]})
+    
+    assert [result["link"]["short_code"] for result in response.json()["results"]] == ["fresh03", "fresh04"]
+    assert allocate.await_count == 2
+
+def create_owned_links(db, owner_id: int, count: int) -> list:
+    links = [
+        Link(short_code=f"mine{i:03d}", original_url=f"https://mine.com/{i}", owner_id=owner_id, click_count=i)
+        for i in range(count)
+    ]
+    db.add_all(links)
+    db.add(Link(short_code="notmine", original_url="https://other.com", owner_id=None))
+    db.commit()
+    return links
+
+def test_list_my_links(auth_client, db, redis_mock):
+    owner_id = db.execute(text("SELECT id FROM users WHERE username = 'testuser'")).scalar()
+    create_owned_links(db, owner_id, 5)
+    redis_mock.set("clicks:mine001", 3)
+    
+    response = auth_client.get("/links/mine", params={"limit": 2})
+    page = response.json()
+    assert [link["short_code"] for link in page["links"]] == ["mine000", "mine001"]
+    # Буферизованные клики прибавляются к сохраненным
+    assert page["links"][1]["click_count"] == 4
+    
+    codes = [link["short_code"] for link in page["links"]]
+    while page["next_cursor"] is not None:
+        page = auth_client.get("/links/mine", params={"limit": 2, "cursor": page["next_cursor"]}).json()
+        codes += [link["short_code"] for link in page["links"]]
+    assert codes == [f"mine{i:03d}" for i in range(5)]
+
+def test_list_my_links_requires_auth(client):
+    assert client.get("/links/mine").status_code == status.HTTP_401_UNAUTHORIZED
+    assert client.get("/links/mine/export").status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_export_my_links(auth_client, db, redis_mock):
+    owner_id = db.execute(text("SELECT id FROM users WHERE username = 'testuser'")).scalar()
+    create_owned_links(db, owner_id, 5)
+    redis_mock.set("clicks:mine004", 10)
+    
+    with patch.object(settings, "EXPORT_CHUNK_SIZE", 2):
+        response = auth_client.get("/links/mine/export")
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["short_code"] for row in rows] == [f"mine{i:03d}" for i in range(5)]
+        assert rows[4]["click_count"] == 14
+        
+        response = auth_client.get("/links/mine/export", params={"format": "csv"})
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert len(rows) == 5
+        assert rows[0]["short_url"].endswith("/mine000")
+        assert rows[4]["click_count"] == "14"
+
+def test_link_stats_timeseries(client, db):
+    link = Link(short_code="series1", original_url="https://example.com/series")
+    db.add(link)
+    db.commit()
+    day = datetime(2026, 3, 5, tzinfo=timezone.utc)
+    db.add_all([
+        HourlyClickRollup(link_id=link.id, bucket_start=day + timedelta(hours=1), clicks=5),
+        HourlyClickRollup(link_id=link.id, bucket_start=day + timedelta(hours=3), clicks=2),
+        DailyClickRollup(link_id=link.id, bucket_start=day, clicks=7),
+    ])
+    db.commit()
+    
+    response = client.get("/links/series1/stats/timeseries", params={
+        "bucket": "hour", "from": day.isoformat(), "to": (day + timedelta(hours=3, minutes=30)).isoformat()
+    })
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [point["clicks"] for point in data["points"]] == [0, 5, 0, 2]
+    assert data["total"] == 7
+    
+    response = client.get("/links/series1/stats/timeseries", params={
+        "bucket": "day", "from": (day - timedelta(days=1)).isoformat(), "to": day.isoformat()
+    })
+    assert [point["clicks"] for point in response.json()["points"]] == [0, 7]
+    
+    # Без диапазона возвращаются последние 24 часа
+    response = client.get("/links/series1/stats/timeseries")
+    assert len(response.json()["points"]) == 24
+    
+    response = client.get("/links/series1/stats/timeseries", params={"from": day.isoformat(), "to": (day - timedelta(days=1)).isoformat()})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = client.get("/links/series1/stats/timeseries", params={"from": (day - timedelta(days=365)).isoformat(), "to": day.isoformat()})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert client.get("/links/nothere/stats/timeseries").status_code == status.HTTP_404_NOT_FOUND
+
+def test_link_stats_include_buffered_clicks(client, db, redis_mock):
+    db.add(Link(short_code="live001", original_url="https://example.com/live", click_count=5))
+    db.commit()
+    last_access = datetime(2026, 3, 5, 12, 30, tzinfo=timezone.utc)
+    
+    # Клики после перенаправлений еще в буфере и не синхронизированы с БД
+    for _ in range(3):
+        client.get("/live001", follow_redirects=False)
+    redis_mock.set("last_access:live001", last_access.isoformat())
+    
+    data = client.get("/links/live001/stats").json()
+    assert data["click_count"] == 8
+    assert datetime.fromisoformat(data["last_accessed"]) == last_access
+
+def test_links_stats_batch(client, db, redis_mock):
+    db.add_all([
+        Link(short_code="bstat01", original_url="https://example.com/1", click_count=1),
+        Link(short_code="bstat02", original_url="https://example.com/2", click_count=2),
+    ])
+    db.commit()
+    redis_mock.set("clicks:bstat02", 5)
+    
+    response = client.post("/links/stats/batch", json={"short_codes": ["bstat02", "missing", "bstat01", "bstat02"]})
+    
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [(link["short_code"], link["click_count"]) for link in data["links"]] == [("bstat02", 7), ("bstat01", 1)]
+    assert data["missing"] == ["missing"]
+    
+    response = client.post("/links/stats/batch", json={"short_codes": []})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
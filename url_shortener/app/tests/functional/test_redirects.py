@@ -2,9 +2,15 @@ import pytest
 from fastapi import status
 from datetime import datetime, timedelta, timezone
 from app.models import Link
-from app.cache import cache_url, get_cached_url, get_buffered_clicks, increment_access_counter
+from app.cache import (
+    cache_url, get_cached_url, get_buffered_clicks, increment_access_counter,
+    ensure_click_stream_group, read_click_events
+)
+from app import async_cache
+from app.bloom import might_exist, ensure_known_codes
 import time
 from unittest.mock import patch
+from fastapi.responses import RedirectResponse
 
 def test_redirect_to_url(client, db):
     response = client.post(
@@ -19,8 +25,15 @@ def test_redirect_to_url(client, db):
     assert response.status_code in [301, 302, 307, 308]
     assert response.headers["location"] == "https://example.com/redirect-test"
     
+    # Промах кеша не пишет в БД: клик буферизуется, а ссылка сразу кешируется
     link = db.query(Link).filter(Link.short_code == short_code).first()
-    assert link.click_count >= 1
+    assert link.click_count == 0
+    assert get_buffered_clicks(short_code) == 1
+    assert get_cached_url(short_code) == "https://example.com/redirect-test"
+    
+    response = client.get(f"/{short_code}", follow_redirects=False)
+    assert response.status_code in [301, 302, 307, 308]
+    assert get_buffered_clicks(short_code) == 2
 
 def test_redirect_with_caching(client, db, redis_mock):
     original_url = "https://example.com/cache-test"
@@ -34,10 +47,11 @@ def test_redirect_with_caching(client, db, redis_mock):
     
     assert get_cached_url(short_code) == original_url
     
-    with patch('app.routers.links.get_cached_url', wraps=get_cached_url) as mock_get_cached:
+    # Попадание в кеш обслуживает быстрый путь до роутера
+    with patch('app.fast_redirect.resolve_and_record_click', wraps=async_cache.resolve_and_record_click) as mock_resolve:
         response = client.get(f"/{short_code}", follow_redirects=False)
         
-        mock_get_cached.assert_called_with(short_code)
+        assert mock_resolve.call_args.args[0] == short_code
     
     clicks = get_buffered_clicks(short_code)
     assert clicks >= 1
@@ -66,4 +80,107 @@ def test_redirect_expired_link(client, auth_client, db):
     if link:
         now = datetime.now(timezone.utc)
         link_expires_at = link.expires_at.replace(tzinfo=timezone.utc) if link.expires_at.tzinfo is None else link.expires_at
-        assert now > link_expires_at
\ No newline at end of file
+        assert now > link_expires_at
+def test_redirect_unknown_code_skips_db(client, db, redis_mock):
+    response = client.post(
+        "/links/shorten",
+        json={"original_url": "https://example.com/known"}
+    )
+    short_code = response.json()["short_code"]
+    
+    # Фильтр строится в фоне при старте; здесь он перестраивается явно
+    client.portal.call(ensure_known_codes, True)
+    
+    with patch('app.routers.links.might_exist', wraps=might_exist) as mock_might_exist:
+        response = client.get("/definitely-missing", follow_redirects=False)
+        assert response.status_code == 404
+        assert mock_might_exist.await_count == 1
+    
+    response = client.get(f"/{short_code}", follow_redirects=False)
+    assert response.status_code in [301, 302, 307, 308]
+
+def test_metrics_endpoint(client, redis_mock):
+    client.post("/links/shorten", json={"original_url": "https://example.com/metrics", "custom_alias": "metric1"})
+    client.get("/metric1", follow_redirects=False)
+    redis_mock.sadd("links_to_sync", "metric1", "other")
+    
+    response = client.get("/metrics")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/{short_code}"}' in text
+    assert 'http_requests_total{method="POST",route="/links/shorten",status="201"}' in text
+    assert 'redirect_cache_lookups_total{result="l1"}' in text
+    assert 'db_query_duration_seconds_count{statement="INSERT"}' in text
+    assert "links_to_sync 2" in text
+    assert 'l1_cache_events_total{cache="url",event="hits"}' in text
+    assert 'single_flight_events_total{event="loads"}' in text
+
+def test_pool_diagnostics_endpoint(client):
+    client.post("/links/shorten", json={"original_url": "https://example.com/pools"})
+    
+    response = client.get("/diagnostics/pools")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["db"]["checkouts"] > 0
+    assert data["db"]["in_use"] == 0
+    assert data["redis"]["max_connections"] > 0
+    assert {"in_use", "idle", "timeouts", "wait_time_avg"} <= set(data["redis"])
+
+def test_fast_path_serves_cache_hits_without_router(client, redis_mock):
+    original_url = "https://example.com/путь с пробелом?q=1&x=[2]"
+    client.post("/links/shorten", json={"original_url": "https://example.com/fast", "custom_alias": "fast001"})
+    async_cache.url_l1_cache.clear()
+    redis_mock.set("url:fast001", original_url)
+    
+    with patch('app.routers.links.resolve_and_record_click') as mock_router_resolve:
+        response = client.get("/fast001", follow_redirects=False, headers={"User-Agent": "Fast Browser"})
+        head_response = client.head("/fast001", follow_redirects=False)
+        # Ответ на HEAD не зависит от того, есть ли ссылка в кеше
+        async_cache.url_l1_cache.clear()
+        redis_mock.delete("url:fast001")
+        cold_head_response = client.head("/fast001", follow_redirects=False)
+    
+    mock_router_resolve.assert_not_called()
+    assert response.status_code == 307
+    assert head_response.status_code == cold_head_response.status_code == 405
+    # Location кодируется так же, как в RedirectResponse
+    assert response.headers["location"] == RedirectResponse(original_url).headers["location"]
+    assert get_buffered_clicks("fast001") == 1
+    ensure_click_stream_group()
+    _, _, click = read_click_events("test-consumer", 10)[0]
+    assert click["user_agent"] == "Fast Browser"
+    assert click["ip_address"] == "testclient"
+
+def test_fast_path_falls_back_to_router(client, redis_mock):
+    client.post("/links/shorten", json={"original_url": "https://example.com/slow", "custom_alias": "slow001"})
+    async_cache.url_l1_cache.clear()
+    redis_mock.delete("url:slow001")
+    
+    # Промах кеша загружает ссылку через redirect_to_url, клик учитывается один раз
+    response = client.get("/slow001", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://example.com/slow"
+    assert get_buffered_clicks("slow001") == 1
+    
+    assert client.get("/missing1", follow_redirects=False).status_code == 404
+    
+    # Промах проверяет кеш скриптом один раз: redirect_to_url не повторяет проверку быстрого пути
+    with patch('app.async_cache.record_click_script', wraps=async_cache.record_click_script) as script:
+        assert client.get("/missing1", follow_redirects=False).status_code == 404
+    assert script.call_count == 1
+    
+    # Запросы с Origin проходят через CORSMiddleware
+    response = client.get("/slow001", follow_redirects=False, headers={"Origin": "https://site.example"})
+    assert response.status_code == 307
+    assert response.headers["access-control-allow-origin"] == "https://site.example"
+    
+    # Маршруты без параметров не принимаются за короткие коды
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/openapi.json").status_code == 200
+    
+    with patch('app.fast_redirect.settings.REDIRECT_FAST_PATH', False), \
+            patch('app.fast_redirect.resolve_and_record_click') as mock_fast_resolve:
+        assert client.get("/slow001", follow_redirects=False).status_code == 307
+    mock_fast_resolve.assert_not_called()
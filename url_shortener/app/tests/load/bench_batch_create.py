@@ -0,0 +1,96 @@
+"""Пакетное создание ссылок против цикла по одиночному эндпоинту.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_batch_create 5000
+
+Аргумент — число создаваемых ссылок. Сначала ссылки создаются по одной
+через POST /links/shorten, затем те же по числу URL — пачками по
+BATCH_SHORTEN_MAX_ITEMS через POST /links/shorten/batch. Каждая десятая
+ссылка повторяет уже отправленный URL, чтобы дедупликация тоже
+участвовала в замере. Считаются ссылки в секунду и SQL-запросы на
+1000 ссылок. Используются тестовая SQLite-база и fakeredis.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import time
+import asyncio
+import contextlib
+import httpx
+import fakeredis
+import fakeredis.aioredis
+from sqlalchemy import event
+
+import app.async_cache
+from app.config import settings
+from app.database import Base, engine, async_engine
+from app.main import app as fastapi_app
+
+statements = 0
+
+
+def count_statement(*args) -> None:
+    global statements
+    statements += 1
+
+
+def prepare() -> None:
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    app.async_cache.redis_client = fakeredis.aioredis.FakeRedis(
+        server=fakeredis.FakeServer(), decode_responses=True
+    )
+    app.async_cache.url_l1_cache.clear()
+
+
+def build_urls(count: int, campaign: str) -> list:
+    return [f"https://example.com/{campaign}/{i - i % 10 if i % 10 == 9 else i}" for i in range(count)]
+
+
+async def create_single(urls: list) -> None:
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for url in urls:
+            response = await client.post("/links/shorten", json={"original_url": url})
+            assert response.status_code == 201
+
+
+async def create_batch(urls: list) -> None:
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        for start in range(0, len(urls), settings.BATCH_SHORTEN_MAX_ITEMS):
+            chunk = urls[start:start + settings.BATCH_SHORTEN_MAX_ITEMS]
+            response = await client.post(
+                "/links/shorten/batch",
+                json={"links": [{"original_url": url} for url in chunk]}
+            )
+            assert response.status_code == 200
+            assert response.json()["failed"] == 0
+
+
+def run(name: str, campaign: str, create, count: int) -> None:
+    global statements
+    prepare()
+    statements = 0
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        asyncio.run(create(build_urls(count, campaign)))
+        elapsed = time.perf_counter() - started
+
+    print(f"{name:<8}: {count / elapsed:9.0f} ссылок/с, {statements * 1000 / count:7.0f} SQL-запросов на 1000 ссылок")
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    run("по одной", "single", create_single, count)
+    run("пачками", "batch", create_batch, count)
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Размер и скорость кодирования записи клика: JSON против двоичной записи версии 1.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_click_encoding 100000
+
+Аргумент — число кликов. Клики получают типичные значения: короткие коды
+из 6-8 символов, 90% IPv4 и 10% IPv6, user-agent из набора популярных
+браузеров, треть кликов без referer. Двоичная запись замеряется дважды:
+с текстами в самой записи (словарь заполнен или еще пуст) и с id словаря.
+Размер — байты поля data записи потока; служебные байты Redis на запись
+(ID, имя поля, узел radix-дерева) одинаковы для обоих форматов, поэтому
+разница в байтах равна экономии памяти на клик.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import json
+import time
+import random
+from datetime import datetime, timezone
+
+from app.cache import build_click_record
+from app.click_codec import decode_click
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+    "Version/17.4.1 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+    "Version/17.4.1 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/124.0.6367.82 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "TelegramBot (like TwitterBot)",
+]
+REFERERS = [
+    None,
+    "https://www.google.com/",
+    "https://t.me/",
+    "https://news.example.com/2026/03/05/article-about-something-interesting",
+    "https://www.facebook.com/",
+]
+
+
+def build_clicks(count: int) -> list:
+    rng = random.Random(42)
+    clicks = []
+    for i in range(count):
+        if rng.random() < 0.9:
+            ip_address = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        else:
+            ip_address = f"2001:db8:{rng.randint(0, 0xffff):x}::{rng.randint(1, 0xffff):x}"
+        referer_index = 0 if rng.random() < 1 / 3 else rng.randrange(1, len(REFERERS))
+        user_agent_index = rng.randrange(len(USER_AGENTS))
+        clicks.append((
+            f"{rng.randint(0, 36 ** 7):x}"[:rng.randint(6, 8)],
+            {"ip_address": ip_address, "user_agent": USER_AGENTS[user_agent_index],
+             "referer": REFERERS[referer_index] or ""},
+            # Эпоха словарей и id с единицы, 0 — значение в записи
+            (1, user_agent_index + 1, referer_index + 1 if referer_index else 0)
+        ))
+    return clicks
+
+
+def encode_json(short_code: str, client_info: dict, clicked_at: datetime) -> bytes:
+    """Формат до версии 1"""
+    return json.dumps({
+        "short_code": short_code,
+        "timestamp": clicked_at.isoformat(),
+        "ip_address": client_info.get("ip_address", ""),
+        "user_agent": client_info.get("user_agent", ""),
+        "referer": client_info.get("referer", "")
+    }).encode()
+
+
+def measure(name: str, encode, clicks: list) -> tuple:
+    clicked_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    records = [encode(short_code, client_info, text_ids, clicked_at) for short_code, client_info, text_ids in clicks]
+    encode_us = (time.perf_counter() - started) / len(clicks) * 1e6
+
+    started = time.perf_counter()
+    for record in records:
+        decode_click(record)
+    decode_us = (time.perf_counter() - started) / len(clicks) * 1e6
+
+    return name, sum(map(len, records)) / len(records), encode_us, decode_us
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    clicks = build_clicks(count)
+
+    results = [
+        measure("JSON", lambda code, info, ids, at: encode_json(code, info, at), clicks),
+        measure("v1, тексты в записи", lambda code, info, ids, at: build_click_record(code, info, (0, 0, 0), at), clicks),
+        measure("v1, id словаря", lambda code, info, ids, at: build_click_record(code, info, ids, at), clicks),
+    ]
+
+    baseline = results[0][1]
+    print(f"Кликов: {count}")
+    print(f"{'Формат':<22} {'байт/клик':>10} {'экономия':>9} {'кодирование, мкс':>17} {'разбор, мкс':>12}")
+    for name, size, encode_us, decode_us in results:
+        print(f"{name:<22} {size:>10.1f} {1 - size / baseline:>8.0%} {encode_us:>17.2f} {decode_us:>12.2f}")
+    saved = baseline - results[-1][1]
+    print(f"Экономия на 1 млн кликов в буфере: {saved * 1e6 / 2 ** 20:.0f} МиБ")
+
+
+if __name__ == "__main__":
+    main()
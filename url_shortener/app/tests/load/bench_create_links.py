@@ -0,0 +1,121 @@
+"""Замер скорости создания ссылок в зависимости от заполненности таблицы.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_create_links 10000 100000 200000
+
+Сравнивает прежний подбор случайного кода с проверкой SELECT на каждую
+попытку и выдачу кодов из арендованных блоков идентификаторов. Чтобы
+заполненность пространства кодов была заметна на небольших таблицах,
+используются коды длины SHORT_CODE_LENGTH (62^3 ≈ 238 тыс. кодов).
+Таблица заполняется кодами той же схемы, которой потом создаются ссылки.
+
+На тестовой SQLite время создания определяется коммитом каждой ссылки,
+поэтому основная разница видна в числе SELECT на ссылку: на 200 тыс.
+кодах случайный подбор делает ~6 запросов, выдача из блоков — ни одного.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import time
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+import app.async_cache
+from app.database import Base, engine, AsyncSessionLocal
+from app.models import Link
+from app.utils import generate_short_code
+from app.short_codes import RedisBlockAllocator, encode_short_code, SHORT_CODE_COUNTER_KEY
+
+SHORT_CODE_LENGTH = 3
+CREATES = 2000
+
+
+def prepare(codes: list) -> None:
+    """Пересоздает таблицы и заполняет links готовыми кодами"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        for start in range(0, len(codes), 50000):
+            conn.execute(insert(Link.__table__), [
+                {"short_code": code, "original_url": f"https://example.com/{code}", "click_count": 0}
+                for code in codes[start:start + 50000]
+            ])
+
+
+async def create_random(count: int) -> int:
+    """Прежний способ: случайный код и SELECT до первого свободного"""
+    queries = 0
+    async with AsyncSessionLocal() as db:
+        for i in range(count):
+            while True:
+                short_code = generate_short_code(SHORT_CODE_LENGTH)
+                queries += 1
+                if not await db.scalar(select(Link).filter(Link.short_code == short_code)):
+                    break
+            db.add(Link(short_code=short_code, original_url=f"https://example.org/{i}"))
+            await db.commit()
+    return queries
+
+
+async def create_allocated(count: int, allocator: RedisBlockAllocator) -> int:
+    """Новый способ: код из блока идентификаторов, без проверок в БД"""
+    retries = 0
+    async with AsyncSessionLocal() as db:
+        for i in range(count):
+            while True:
+                short_code = encode_short_code(await allocator.next_id(), SHORT_CODE_LENGTH)
+                db.add(Link(short_code=short_code, original_url=f"https://example.org/{i}"))
+                try:
+                    await db.commit()
+                    break
+                except IntegrityError:
+                    await db.rollback()
+                    retries += 1
+    return retries
+
+
+def run_random(size: int) -> tuple:
+    codes = set()
+    while len(codes) < size:
+        codes.add(generate_short_code(SHORT_CODE_LENGTH))
+    prepare(list(codes))
+
+    started = time.perf_counter()
+    queries = asyncio.run(create_random(CREATES))
+    return time.perf_counter() - started, queries
+
+
+def run_allocated(size: int) -> tuple:
+    prepare([encode_short_code(number, SHORT_CODE_LENGTH) for number in range(size)])
+
+    server = fakeredis.FakeServer()
+    fakeredis.FakeStrictRedis(server=server).set(SHORT_CODE_COUNTER_KEY, size)
+    app.async_cache.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+    started = time.perf_counter()
+    retries = asyncio.run(create_allocated(CREATES, RedisBlockAllocator(block_size=1000)))
+    return time.perf_counter() - started, retries
+
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 200000]
+    for size in sizes:
+        elapsed, queries = run_random(size)
+        print(f"{size:>9} ссылок, случайный код: {CREATES / elapsed:8.0f} созданий/с, "
+              f"{queries / CREATES:6.2f} SELECT на ссылку")
+
+        elapsed, retries = run_allocated(size)
+        print(f"{size:>9} ссылок, блоки ID:      {CREATES / elapsed:8.0f} созданий/с, "
+              f"{retries} повторов")
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
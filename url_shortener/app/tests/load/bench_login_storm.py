@@ -0,0 +1,136 @@
+"""Задержка перенаправлений во время потока логинов.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_login_storm 32 5
+
+Первый аргумент — число одновременных клиентов, которые непрерывно
+логинятся, второй — длительность замера в секундах. Параллельно каждые
+10 мс выполняется перенаправление по закешированной ссылке и замеряется
+его задержка. Сначала замеряется фон без логинов, потом bcrypt вызывается прямо в цикле событий (как до
+переноса в пул), затем через пул потоков app.password_hashing.
+Используются тестовая SQLite-база и fakeredis.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import time
+import asyncio
+import contextlib
+import httpx
+import fakeredis
+import fakeredis.aioredis
+from unittest.mock import patch
+from sqlalchemy import insert
+
+import app.async_cache
+import app.routers.auth
+from app.database import Base, engine
+from app.models import Link, User
+from app.main import app as fastapi_app
+from app.utils import get_password_hash, verify_and_update_password
+
+SHORT_CODE = "storm01"
+
+
+async def hash_inline(password: str) -> str:
+    return get_password_hash(password)
+
+
+async def verify_inline(plain_password: str, hashed_password: str) -> tuple:
+    return verify_and_update_password(plain_password, hashed_password)
+
+
+def prepare(logins: int) -> None:
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    hashed_password = get_password_hash("password123")
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {"username": f"user{i}", "email": f"user{i}@example.com",
+             "hashed_password": hashed_password, "is_active": True}
+            for i in range(logins)
+        ])
+        conn.execute(insert(Link.__table__), [
+            {"short_code": SHORT_CODE, "original_url": "https://example.com/storm", "click_count": 0}
+        ])
+
+    app.async_cache.redis_client = fakeredis.aioredis.FakeRedis(
+        server=fakeredis.FakeServer(), decode_responses=True
+    )
+    app.async_cache.url_l1_cache.clear()
+
+
+async def storm(logins: int, duration: float) -> tuple:
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.get(f"/{SHORT_CODE}", follow_redirects=False)
+        deadline = time.perf_counter() + duration
+        completed_logins = 0
+
+        async def login_loop(i: int):
+            nonlocal completed_logins
+            while time.perf_counter() < deadline:
+                response = await client.post(
+                    "/auth/token",
+                    data={"username": f"user{i}", "password": "password123"}
+                )
+                assert response.status_code == 200
+                completed_logins += 1
+
+        async def redirect_probe():
+            # Задержка считается от запланированного момента запроса, поэтому
+            # время, на которое цикл событий был заблокирован, тоже учитывается
+            latencies = []
+            scheduled = time.perf_counter()
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                response = await client.get(f"/{SHORT_CODE}", follow_redirects=False)
+                finished = time.perf_counter()
+                latencies.append(finished - scheduled)
+                assert response.status_code == 307
+                scheduled = finished + 0.01
+            return latencies
+
+        results = await asyncio.gather(redirect_probe(), *(login_loop(i) for i in range(logins)))
+    return results[0], completed_logins
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(logins: int, duration: float, inline: bool) -> None:
+    prepare(logins)
+    patches = [
+        patch.object(app.routers.auth, "hash_password", hash_inline),
+        patch.object(app.routers.auth, "verify_password", verify_inline),
+    ] if inline else []
+
+    with contextlib.ExitStack() as stack, open(os.devnull, "w") as devnull:
+        for item in patches:
+            stack.enter_context(item)
+        # Middleware печатает каждый запрос
+        stack.enter_context(contextlib.redirect_stdout(devnull))
+        latencies, completed_logins = asyncio.run(storm(logins, duration))
+
+    mode = "без логинов" if not logins else "в цикле событий" if inline else "в пуле потоков"
+    print(f"bcrypt {mode:<16}: {completed_logins / duration:7.1f} логинов/с, "
+          f"перенаправления p50 {percentile(latencies, 0.5) * 1000:7.1f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} мс ({len(latencies)} замеров)")
+
+
+def main() -> None:
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(0, duration, inline=False)
+    run(logins, duration, inline=True)
+    run(logins, duration, inline=False)
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
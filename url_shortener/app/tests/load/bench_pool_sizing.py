@@ -0,0 +1,98 @@
+"""Размер пула БД против пропускной способности и ожидания соединения.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_pool_sizing 100 0.02 3
+
+Первый аргумент — число одновременных запросов, второй — сколько секунд
+запрос держит соединение (время запросов к БД внутри одного HTTP-запроса),
+третий — длительность замера для каждого размера пула. Для пулов разного
+размера (max_overflow=0, pool_timeout=1 с) запросы в замкнутом цикле берут
+соединение, выполняют SELECT и держат соединение заданное время.
+Пропускная способность сравнивается с оценкой по закону Литтла
+min(пул, запросы) / время удержания, ожидание соединения и таймауты
+берутся из статистики app.database. Используется тестовая SQLite-база.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import time
+import asyncio
+from sqlalchemy import select, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.database import Base, engine, get_async_database_url, InstrumentedAsyncQueuePool, db_pool_stats
+from app.models import Link
+
+POOL_SIZES = (5, 10, 25, 50, 100)
+POOL_TIMEOUT = 1.0
+
+
+async def run_pool(pool_size: int, concurrency: int, hold: float, duration: float) -> dict:
+    pool_engine = create_async_engine(
+        get_async_database_url(str(engine.url)),
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=POOL_TIMEOUT
+    )
+    session_factory = async_sessionmaker(pool_engine, expire_on_commit=False)
+    latencies = []
+    timeouts = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker() -> None:
+        nonlocal timeouts
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with session_factory() as session:
+                    await session.scalar(select(Link.id).limit(1))
+                    await asyncio.sleep(hold)
+            except exc.TimeoutError:
+                timeouts += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    # Соединения открываются заранее, чтобы в замер не попала их установка
+    connections = [await pool_engine.connect() for _ in range(pool_size)]
+    for connection in connections:
+        await connection.close()
+
+    before = dict(db_pool_stats)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await pool_engine.dispose()
+
+    checkouts = db_pool_stats["checkouts"] - before["checkouts"]
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "expected_rps": min(pool_size, concurrency) / hold,
+        "wait_avg": (db_pool_stats["wait_time_total"] - before["wait_time_total"]) / checkouts if checkouts else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        "timeouts": timeouts,
+    }
+
+
+async def main(concurrency: int, hold: float, duration: float) -> None:
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    print(f"Запросов одновременно: {concurrency}, удержание соединения: {hold * 1000:.0f} мс, "
+          f"pool_timeout: {POOL_TIMEOUT:.0f} с")
+    print(f"{'Пул':>5} {'Запросов/с':>11} {'Оценка':>8} {'Ожидание, мс':>13} {'p99, мс':>8} {'Таймауты':>9}")
+    for pool_size in POOL_SIZES:
+        result = await run_pool(pool_size, concurrency, hold, duration)
+        print(f"{pool_size:>5} {result['rps']:>11.0f} {result['expected_rps']:>8.0f} "
+              f"{result['wait_avg'] * 1000:>13.1f} {result['p99'] * 1000:>8.1f} {result['timeouts']:>9}")
+
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    hold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+    asyncio.run(main(concurrency, hold, duration))
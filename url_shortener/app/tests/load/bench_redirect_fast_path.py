@@ -0,0 +1,125 @@
+"""Перенаправления в секунду на одно ядро: полный обработчик FastAPI против быстрого ASGI-пути.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_redirect_fast_path 20000 64
+
+Первый аргумент — число перенаправлений в замере, второй — число
+одновременных запросов. Запросы подаются прямо в ASGI-приложение в одном
+процессе и одном цикле событий, без HTTP-сервера, поэтому замер показывает
+стоимость стека приложения на ядро. Все ссылки в L1-кеше. Сначала клик
+пишется в fakeredis (его Lua-скрипт эмулируется на Python и занимает
+заметную часть времени), затем запись клика заменяется пустой корутиной,
+чтобы сравнить только накладные расходы обработчиков. Используются
+тестовая SQLite-база и fakeredis.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import time
+import asyncio
+import contextlib
+import fakeredis
+import fakeredis.aioredis
+from unittest.mock import patch
+
+import app.async_cache
+from app.config import settings
+from app.database import Base, engine
+from app.main import app as fastapi_app
+
+LINKS = 1000
+
+
+def prepare() -> None:
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    app.async_cache.redis_client = fakeredis.aioredis.FakeRedis(
+        server=fakeredis.FakeServer(), decode_responses=True
+    )
+    for i in range(LINKS):
+        app.async_cache.url_l1_cache.set(f"bench{i:03d}", f"https://example.com/landing/{i}")
+
+
+def build_scope(short_code: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("test", 80),
+        "client": ("203.0.113.7", 50000),
+        "root_path": "",
+        "path": f"/{short_code}",
+        "raw_path": f"/{short_code}".encode(),
+        "query_string": b"",
+        "headers": [
+            (b"host", b"test"),
+            (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) Bench/1.0"),
+            (b"referer", b"https://news.example.com/article"),
+        ],
+    }
+
+
+async def request(scope: dict) -> None:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await fastapi_app(scope, receive, send)
+    assert status == 307, status
+
+
+async def run(count: int, concurrency: int) -> float:
+    scopes = [build_scope(f"bench{i % LINKS:03d}") for i in range(count)]
+
+    async def worker(offset: int) -> None:
+        for i in range(offset, count, concurrency):
+            await request(scopes[i])
+
+    # Прогрев: сборка стека middleware и компиляция скриптов
+    await asyncio.gather(*(request(scopes[i]) for i in range(min(concurrency, count))))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    return count / (time.perf_counter() - started)
+
+
+async def noop_record_click(*args, **kwargs) -> None:
+    return None
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    prepare()
+
+    results = {}
+    for recording in ("fakeredis", "без записи клика"):
+        patcher = patch("app.async_cache.record_click_script", noop_record_click) \
+            if recording != "fakeredis" else contextlib.nullcontext()
+        with patcher:
+            for fast_path in (False, True):
+                with patch.object(settings, "REDIRECT_FAST_PATH", fast_path):
+                    results[(recording, fast_path)] = asyncio.run(run(count, concurrency))
+
+    print(f"Перенаправлений: {count}, одновременно: {concurrency}, все ссылки в L1-кеше")
+    print(f"{'Запись клика':<18} {'FastAPI, зап/с':>15} {'ASGI, зап/с':>12} {'Ускорение':>10}")
+    for recording in ("fakeredis", "без записи клика"):
+        before = results[(recording, False)]
+        after = results[(recording, True)]
+        print(f"{recording:<18} {before:>15.0f} {after:>12.0f} {after / before:>9.1f}x")
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
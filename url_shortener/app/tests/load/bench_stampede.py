@@ -0,0 +1,96 @@
+"""Воспроизведение лавины промахов кеша по одной популярной ссылке.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_stampede 200
+
+Отправляет N одновременных запросов на перенаправление и N запросов
+GET /links/{short_code} по ссылке, которой нет в кеше, и считает
+SELECT-запросы к таблице links. Сначала объединение промахов отключено
+(каждый запрос идет в БД, как до его появления), затем включено.
+Используются тестовая SQLite-база и fakeredis.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import time
+import asyncio
+import httpx
+import fakeredis
+import fakeredis.aioredis
+from unittest.mock import patch
+from sqlalchemy import event, insert
+
+import app.async_cache
+import app.routers.links
+from app.database import Base, engine, async_engine
+from app.models import Link
+from app.main import app as fastapi_app
+from app.single_flight import load_once
+
+SHORT_CODE = "hot0001"
+link_selects = 0
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def count_link_selects(conn, cursor, statement, parameters, context, executemany):
+    global link_selects
+    if statement.lstrip().upper().startswith("SELECT") and "FROM links" in statement:
+        link_selects += 1
+
+
+async def load_without_coalescing(key, loader, read_cache):
+    return await loader()
+
+
+def prepare() -> None:
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Link.__table__), [
+            {"short_code": SHORT_CODE, "original_url": "https://example.com/hot", "click_count": 0}
+        ])
+
+
+async def stampede(requests: int, path: str) -> float:
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.get(path, follow_redirects=False) for _ in range(requests)
+        ))
+        elapsed = time.perf_counter() - started
+    assert all(response.status_code in (200, 307) for response in responses)
+    return elapsed
+
+
+def run(requests: int, coalesce: bool) -> None:
+    global link_selects
+    for path in (f"/{SHORT_CODE}", f"/links/{SHORT_CODE}"):
+        prepare()
+        app.async_cache.redis_client = fakeredis.aioredis.FakeRedis(
+            server=fakeredis.FakeServer(), decode_responses=True
+        )
+        app.async_cache.url_l1_cache.clear()
+        link_selects = 0
+
+        loader = load_once if coalesce else load_without_coalescing
+        with patch.object(app.routers.links, "load_once", loader):
+            elapsed = asyncio.run(stampede(requests, path))
+
+        mode = "с объединением" if coalesce else "без объединения"
+        print(f"{path:<18} {mode:<16} {requests:>5} запросов: {elapsed:6.2f} с, "
+              f"{link_selects:>5} SELECT к links")
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    run(requests, coalesce=False)
+    run(requests, coalesce=True)
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Замер пропускной способности sync_stats_with_db.
+
+Запуск из каталога url_shortener:
+
+    python -m app.tests.load.bench_sync_stats 10000 100000
+
+Использует тестовую SQLite-базу и fakeredis, поэтому цифры показывают
+число запросов к хранилищам и накладные расходы Python, а не сеть.
+Операции над множествами в fakeredis линейны от размера множества,
+так что на 100k+ ссылок время определяется эмулятором, а не кодом синхронизации.
+"""
+import os
+
+os.environ["TESTING"] = "True"
+
+import sys
+import time
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+from datetime import datetime, timezone
+from sqlalchemy import insert
+
+import app.async_cache
+from app.database import Base, engine
+from app.models import Link
+from app.main import sync_stats_with_db
+
+
+def prepare(pending: int, server: fakeredis.FakeServer) -> None:
+    """Создает ссылки в БД и буферизованные клики в Redis"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(insert(Link.__table__), [
+            {"short_code": f"b{i:09d}", "original_url": f"https://example.com/{i}", "click_count": 0}
+            for i in range(pending)
+        ])
+
+    now = datetime.now(timezone.utc).isoformat()
+    client = fakeredis.FakeStrictRedis(server=server, decode_responses=True)
+    pipe = client.pipeline(transaction=False)
+    for i in range(pending):
+        short_code = f"b{i:09d}"
+        pipe.set(f"clicks:{short_code}", 3)
+        pipe.set(f"last_access:{short_code}", now)
+        pipe.sadd("links_to_sync", short_code)
+        if i % 10000 == 9999:
+            pipe.execute()
+    pipe.execute()
+
+
+async def run(pending: int) -> float:
+    server = fakeredis.FakeServer()
+    prepare(pending, server)
+    app.async_cache.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    app.async_cache.redis_binary_client = fakeredis.aioredis.FakeRedis(server=server)
+
+    started = time.perf_counter()
+    await sync_stats_with_db()
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for pending in sizes:
+        elapsed = asyncio.run(run(pending))
+        print(f"{pending:>9} ссылок: {elapsed:8.2f} с, {pending / elapsed:10.0f} ссылок/с")
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import pytest
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+import redis.asyncio as aioredis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from unittest.mock import patch, call, AsyncMock
+from datetime import datetime, timezone
+from app import cache
+from app.async_cache import (
+    get_cached_url, cache_url, invalidate_url_cache,
+    increment_access_counter, add_popular_url, is_popular_url,
+    get_links_to_sync, get_buffered_clicks, get_buffered_last_access,
+    reset_buffered_stats, add_click_details, ensure_click_stream_group,
+    read_click_events, ack_click_events,
+    run_invalidation_listener, url_l1_cache, resolve_and_record_click,
+    record_click, get_cached_link_info, cache_link_info,
+    InstrumentedConnectionPool, redis_pool_stats, get_sync_backlog
+)
+from app.click_codec import decode_click
+from app.cache import URL_INVALIDATION_CHANNEL, USER_INVALIDATION_CHANNEL
+
+@pytest.mark.asyncio
+async def test_get_cached_url(redis_mock):
+    redis_mock.set("url:abc123", "https://example.com")
+    
+    assert await get_cached_url("abc123") == "https://example.com"
+    assert await get_cached_url("nonexistent") is None
+
+@pytest.mark.asyncio
+async def test_cache_url(redis_mock):
+    await cache_url("abc123", "https://example.com")
+    assert redis_mock.get("url:abc123") == "https://example.com"
+    
+    await cache_url("def456", "https://example.org", expire=60)
+    assert 0 < redis_mock.ttl("url:def456") <= 60
+
+@pytest.mark.asyncio
+async def test_invalidate_url_cache(redis_mock):
+    await cache_url("abc123", "https://example.com")
+    
+    await invalidate_url_cache("abc123")
+    
+    assert redis_mock.get("url:abc123") is None
+    assert await get_cached_url("abc123") is None
+
+@pytest.mark.asyncio
+async def test_popular_urls(redis_mock):
+    assert not await is_popular_url("abc123")
+    
+    await add_popular_url("abc123")
+    assert await is_popular_url("abc123")
+
+@pytest.mark.asyncio
+async def test_increment_access_counter(redis_mock):
+    assert await increment_access_counter("abc123") == 1
+    assert await increment_access_counter("abc123") == 2
+    
+    assert redis_mock.exists("last_access:abc123")
+    assert await get_links_to_sync() == {"abc123"}
+    assert await get_buffered_clicks("abc123") == 2
+    
+    last_access = await get_buffered_last_access("abc123")
+    assert isinstance(last_access, datetime)
+
+@pytest.mark.asyncio
+async def test_reset_buffered_stats(redis_mock):
+    await increment_access_counter("abc123")
+    
+    await reset_buffered_stats("abc123")
+    
+    assert await get_buffered_clicks("abc123") == 0
+    assert await get_buffered_last_access("abc123") is None
+    assert await get_links_to_sync() == set()
+
+@pytest.mark.asyncio
+async def test_click_events(redis_mock):
+    client_info = {
+        "ip_address": "192.168.1.1",
+        "user_agent": "Test Browser",
+        "referer": "https://example.com"
+    }
+    await ensure_click_stream_group()
+    for _ in range(3):
+        await add_click_details("abc123", client_info)
+    
+    events = await read_click_events("worker-1", 2)
+    assert len(events) == 2
+    assert events[0][2]["ip_address"] == "192.168.1.1"
+    
+    await ack_click_events(events)
+    
+    events = await read_click_events("worker-1", 10)
+    assert len(events) == 1
+    await ack_click_events(events)
+    
+    assert await read_click_events("worker-1", 10) == []
+    assert redis_mock.xlen("click_stream") == 0
+
+@pytest.mark.asyncio
+async def test_unacked_click_events_are_reclaimed(redis_mock):
+    await ensure_click_stream_group()
+    await add_click_details("abc123", {"ip_address": "192.168.1.1"})
+    
+    # Первый потребитель получил событие и упал, не подтвердив его
+    assert len(await read_click_events("worker-1", 10)) == 1
+    
+    with patch("app.async_cache.settings.CLICK_STREAM_CLAIM_IDLE_MS", 0):
+        events = await read_click_events("worker-2", 10)
+    
+    assert len(events) == 1
+    assert events[0][2]["short_code"] == "abc123"
+
+@pytest.mark.asyncio
+async def test_reclaim_handles_redis_6_reply(redis_mock):
+    import app.async_cache
+    await ensure_click_stream_group()
+    await add_click_details("abc123", {"ip_address": "192.168.1.1"})
+    assert len(await read_click_events("worker-1", 10)) == 1
+
+    # Redis 6.2 отвечает на XAUTOCLAIM без списка удаленных записей
+    xautoclaim = app.async_cache.redis_binary_client.xautoclaim
+    async def xautoclaim_redis_6(*args, **kwargs):
+        return (await xautoclaim(*args, **kwargs))[:2]
+
+    with patch("app.async_cache.settings.CLICK_STREAM_CLAIM_IDLE_MS", 0), \
+         patch.object(app.async_cache.redis_binary_client, "xautoclaim", xautoclaim_redis_6):
+        events = await read_click_events("worker-2", 10)
+
+    assert [data["short_code"] for _, _, data in events] == ["abc123"]
+
+@pytest.mark.asyncio
+async def test_sharded_click_stream(redis_mock):
+    with patch("app.cache.settings.CLICK_STREAM_SHARDS", 4):
+        await ensure_click_stream_group()
+        for i in range(20):
+            await add_click_details(f"code{i}", {})
+        
+        events = await read_click_events("worker-1", 100)
+        assert len(events) == 20
+        assert len({stream for stream, _, _ in events}) > 1
+        
+        await ack_click_events(events)
+        assert sum(redis_mock.xlen(f"click_stream:{shard}") for shard in range(4)) == 0
+
+@pytest.mark.asyncio
+async def test_resolve_and_record_click_miss(redis_mock):
+    client_info = {"ip_address": "192.168.1.1", "user_agent": "Test Browser", "referer": ""}
+    
+    assert await resolve_and_record_click("abc123", client_info) is None
+    
+    # Промах не должен оставлять следов клика
+    assert not redis_mock.exists("clicks:abc123")
+    assert not redis_mock.exists("click_stream")
+    assert not redis_mock.sismember("links_to_sync", "abc123")
+
+@pytest.mark.asyncio
+async def test_record_click(redis_mock):
+    client_info = {"ip_address": "192.168.1.1", "user_agent": "Test Browser", "referer": ""}
+    
+    await record_click("abc123", client_info)
+    
+    assert redis_mock.get("clicks:abc123") == "1"
+    assert redis_mock.sismember("links_to_sync", "abc123")
+    assert redis_mock.xlen("click_stream") == 1
+    assert not redis_mock.exists("url:abc123")
+
+@pytest.mark.asyncio
+async def test_link_info_cache(redis_mock):
+    await cache_link_info("abc123", '{"short_code": "abc123"}', expire=60)
+    assert await get_cached_link_info("abc123") == '{"short_code": "abc123"}'
+    assert 0 < redis_mock.ttl("link_info:abc123") <= 60
+    
+    await invalidate_url_cache("abc123")
+    assert await get_cached_link_info("abc123") is None
+
+@pytest.mark.asyncio
+async def test_resolve_and_record_click_hit(redis_mock):
+    client_info = {"ip_address": "192.168.1.1", "user_agent": "Test Browser", "referer": ""}
+    redis_mock.set("url:abc123", "https://example.com", ex=120)
+    
+    assert await resolve_and_record_click("abc123", client_info) == "https://example.com"
+    
+    assert redis_mock.get("clicks:abc123") == "1"
+    assert redis_mock.exists("last_access:abc123")
+    assert redis_mock.sismember("links_to_sync", "abc123")
+    assert redis_mock.xlen("click_stream") == 1
+    detail = decode_click(cache.redis_binary_client.xrange("click_stream")[0][1][b"data"])
+    assert detail["ip_address"] == "192.168.1.1"
+    # User-agent записан id словаря, пустой referer — пустым значением в записи
+    assert detail["user_agent"] is None and detail["user_agent_id"] == 1
+    assert redis_mock.hget(f"click_dict:{detail['dict_epoch']}:user_agent:ids", "1") == "Test Browser"
+    assert detail["referer"] is None and detail["referer_id"] == 0
+    assert url_l1_cache.get("abc123") == "https://example.com"
+
+@pytest.mark.asyncio
+async def test_resolve_and_record_click_l1_hit(redis_mock):
+    client_info = {"ip_address": "192.168.1.1", "user_agent": "Test Browser", "referer": ""}
+    url_l1_cache.set("abc123", "https://example.com")
+    
+    # URL берется из L1, а клик все равно учитывается в Redis
+    assert await resolve_and_record_click("abc123", client_info) == "https://example.com"
+    assert await resolve_and_record_click("abc123", client_info) == "https://example.com"
+    
+    assert redis_mock.get("clicks:abc123") == "2"
+    assert redis_mock.xlen("click_stream") == 2
+
+@pytest.mark.asyncio
+async def test_sync_and_async_api_share_data(redis_mock):
+    # Данные, записанные синхронным API, видны асинхронному и наоборот
+    cache.increment_access_counter("abc123")
+    await increment_access_counter("abc123")
+    
+    assert cache.get_buffered_clicks("abc123") == 2
+    assert await get_buffered_clicks("abc123") == 2
+
+@pytest.mark.asyncio
+async def test_run_invalidation_listener(redis_mock):
+    url_l1_cache.set("abc123", "https://example.com")
+    
+    listener = asyncio.create_task(run_invalidation_listener())
+    try:
+        await asyncio.sleep(0.1)
+        redis_mock.publish(URL_INVALIDATION_CHANNEL, "abc123")
+        
+        for _ in range(50):
+            if url_l1_cache.get("abc123") is None:
+                break
+            await asyncio.sleep(0.05)
+        
+        assert url_l1_cache.get("abc123") is None
+    finally:
+        listener.cancel()
+
+@pytest.mark.asyncio
+async def test_run_invalidation_listener_users(redis_mock):
+    cache.user_l1_cache.set("1", {"id": 1})
+    
+    listener = asyncio.create_task(run_invalidation_listener())
+    try:
+        await asyncio.sleep(0.1)
+        redis_mock.publish(USER_INVALIDATION_CHANNEL, "1")
+        
+        for _ in range(50):
+            if cache.user_l1_cache.get("1") is None:
+                break
+            await asyncio.sleep(0.05)
+        
+        assert cache.user_l1_cache.get("1") is None
+    finally:
+        listener.cancel()
+
+@pytest.mark.asyncio
+async def test_instrumented_connection_pool_counts_waits_and_timeouts():
+    pool = InstrumentedConnectionPool(
+        max_connections=1,
+        timeout=0.05,
+        connection_class=fakeredis.aioredis.FakeConnection,
+        server=fakeredis.FakeServer()
+    )
+    checkouts = redis_pool_stats["checkouts"]
+    timeouts = redis_pool_stats["timeouts"]
+    
+    connection = await pool.get_connection()
+    assert pool.get_connection_counts() == {"in_use": 1, "idle": 0}
+    
+    with pytest.raises(RedisConnectionError):
+        await pool.get_connection()
+    assert redis_pool_stats["timeouts"] == timeouts + 1
+    assert redis_pool_stats["wait_time_max"] >= 0.05
+    
+    await pool.release(connection)
+    assert pool.get_connection_counts() == {"in_use": 0, "idle": 1}
+    assert redis_pool_stats["checkouts"] == checkouts + 2
+    await pool.disconnect()
+
+@pytest.mark.asyncio
+async def test_instrumented_connection_pool_forwards_command_name():
+    pool = InstrumentedConnectionPool(
+        max_connections=1,
+        connection_class=fakeredis.aioredis.FakeConnection,
+        server=fakeredis.FakeServer()
+    )
+    
+    # Так пул вызывают клиенты redis 5.0-5.2
+    with patch.object(aioredis.BlockingConnectionPool, "get_connection", new_callable=AsyncMock) as get_connection:
+        await pool.get_connection("GET", "key")
+        await pool.get_connection()
+    
+    assert get_connection.call_args_list == [call("GET", "key"), call()]
+
+@pytest.mark.asyncio
+async def test_get_sync_backlog(redis_mock):
+    assert await get_sync_backlog() == {"links": 0, "clicks": 0, "oldest_ms": None}
+    
+    started_ms = datetime.now(timezone.utc).timestamp() * 1000
+    for short_code in ("abc123", "abc123", "def456"):
+        await record_click(short_code, {"ip_address": "192.168.1.1"})
+    
+    backlog = await get_sync_backlog()
+    assert backlog["links"] == 2
+    assert backlog["clicks"] == 3
+    assert started_ms - 1000 <= backlog["oldest_ms"] <= started_ms + 1000
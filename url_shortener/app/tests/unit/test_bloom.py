@@ -0,0 +1,79 @@
+import pytest
+from app import bloom
+from app.bloom import (
+    bloom_parameters, get_counter_offsets, might_exist, add_known_code,
+    remove_known_code, rebuild_known_codes, ensure_known_codes,
+    KNOWN_CODES_KEY, KNOWN_CODES_META_KEY, FILTER_SIGNATURE
+)
+from app.models import Link
+
+def test_bloom_parameters():
+    num_counters, num_hashes = bloom_parameters(1000000, 0.01)
+
+    # ~9.6 счетчика на элемент и 7 хеш-функций для 1% ложных срабатываний
+    assert 9500000 < num_counters < 9700000
+    assert num_hashes == 7
+
+    assert bloom_parameters(1000, 0.001)[1] > bloom_parameters(1000, 0.1)[1]
+
+def test_get_counter_offsets():
+    offsets = get_counter_offsets("abc123")
+
+    assert offsets == get_counter_offsets("abc123")
+    assert len(offsets) == bloom.NUM_HASHES
+    assert all(offset % bloom.COUNTER_BITS == 0 for offset in offsets)
+
+@pytest.mark.asyncio
+async def test_might_exist_without_filter(redis_mock):
+    # Пока фильтр не построен, любой код может существовать
+    assert await might_exist("unknown")
+
+@pytest.mark.asyncio
+async def test_might_exist_with_other_parameters(db, redis_mock):
+    await rebuild_known_codes()
+    redis_mock.set(KNOWN_CODES_META_KEY, "1:1:4")
+
+    assert await might_exist("unknown")
+
+@pytest.mark.asyncio
+async def test_add_and_remove_known_code(db, redis_mock):
+    await rebuild_known_codes()
+    before = dict(bloom.known_codes_stats)
+
+    assert not await might_exist("abc123")
+
+    await add_known_code("abc123")
+    assert await might_exist("abc123")
+
+    await remove_known_code("abc123")
+    assert not await might_exist("abc123")
+
+    assert bloom.known_codes_stats["checks"] - before["checks"] == 3
+    assert bloom.known_codes_stats["db_lookups_avoided"] - before["db_lookups_avoided"] == 2
+
+@pytest.mark.asyncio
+async def test_rebuild_known_codes(db, redis_mock):
+    db.add_all([
+        Link(short_code=f"code{i}", original_url=f"https://example.com/{i}")
+        for i in range(10)
+    ])
+    db.commit()
+
+    assert await rebuild_known_codes() == 10
+    assert redis_mock.get(KNOWN_CODES_META_KEY) == FILTER_SIGNATURE
+
+    for i in range(10):
+        assert await might_exist(f"code{i}")
+    assert not await might_exist("missing")
+
+@pytest.mark.asyncio
+async def test_ensure_known_codes(db, redis_mock):
+    assert await ensure_known_codes()
+    assert redis_mock.exists(KNOWN_CODES_KEY)
+
+    # Фильтр с актуальными параметрами не перестраивается без force
+    assert not await ensure_known_codes()
+    assert await ensure_known_codes(force=True)
+
+    redis_mock.set("known_codes:lock", "1")
+    assert not await ensure_known_codes(force=True)
@@ -1,11 +1,14 @@
 import pytest
-import json
+import time
 from datetime import datetime, timezone, timedelta
 from app.cache import (
     get_url_cache_key, get_cached_url, cache_url, invalidate_url_cache,
     increment_access_counter, add_popular_url, is_popular_url, 
     get_links_to_sync, get_buffered_clicks, get_buffered_last_access,
-    reset_buffered_stats, add_click_details, get_and_clear_click_details
+    reset_buffered_stats, add_click_details, ensure_click_stream_group,
+    read_click_events, ack_click_events,
+    url_l1_cache, get_l1_cache_stats, start_invalidation_listener,
+    _handle_invalidation_message, URL_INVALIDATION_CHANNEL, resolve_and_record_click
 )
 
 def test_get_url_cache_key():
@@ -77,6 +80,10 @@ def test_get_links_to_sync(redis_mock):
     
     # Check links are returned
     assert get_links_to_sync() == {"abc123", "def456"}
+    
+    # Limited fetch returns a subset without reading the whole set
+    limited = get_links_to_sync(1)
+    assert len(limited) == 1 and limited < {"abc123", "def456"}
 
 def test_get_buffered_clicks(redis_mock):
     # No clicks initially
@@ -123,26 +130,109 @@ def test_add_click_details(redis_mock):
     # Add click details
     add_click_details("abc123", client_info)
     
-    # Check details were added to the list
-    assert redis_mock.llen("click_details:abc123") == 1
+    # Check details were added to the click stream
+    assert redis_mock.xlen("click_stream") == 1
+    assert not redis_mock.exists("click_details:abc123")
 
-def test_get_and_clear_click_details(redis_mock):
-    # Add some click details
+def test_read_and_ack_click_events(redis_mock):
+    ensure_click_stream_group()
+    # Repeated creation of the group is not an error
+    ensure_click_stream_group()
+    
     for i in range(3):
-        click_data = {
-            "short_code": "abc123",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "ip_address": f"192.168.1.{i}",
-            "user_agent": "Test Browser",
-            "referer": "https://example.com"
-        }
-        redis_mock.lpush("click_details:abc123", json.dumps(click_data))
-    
-    # Get and clear details
-    details = get_and_clear_click_details("abc123")
-    
-    # Should have 3 details
-    assert len(details) == 3
-    
-    # List should be empty now
-    assert redis_mock.llen("click_details:abc123") == 0
\ No newline at end of file
+        add_click_details("abc123", {"ip_address": f"192.168.1.{i}"})
+    
+    events = read_click_events("worker-1", 10)
+    assert len(events) == 3
+    assert events[0][2]["short_code"] == "abc123"
+    assert events[0][2]["ip_address"] == "192.168.1.0"
+    
+    # Delivered but unacknowledged events are not handed to other consumers
+    assert read_click_events("worker-2", 10) == []
+    
+    ack_click_events(events)
+    assert redis_mock.xlen("click_stream") == 0
+    assert redis_mock.xpending("click_stream", "stats_sync")["pending"] == 0
+
+def test_get_cached_url_uses_l1(redis_mock):
+    redis_mock.set("url:abc123", "https://example.com")
+    before = get_l1_cache_stats()
+    
+    # First lookup goes to Redis and fills L1
+    assert get_cached_url("abc123") == "https://example.com"
+    
+    # Second lookup is served from L1 even if Redis changed
+    redis_mock.set("url:abc123", "https://changed.com")
+    assert get_cached_url("abc123") == "https://example.com"
+    
+    stats = get_l1_cache_stats()
+    assert stats["hits"] - before["hits"] == 1
+    assert stats["misses"] - before["misses"] == 1
+
+def test_cache_url_fills_l1(redis_mock):
+    cache_url("abc123", "https://example.com", expire=60)
+    redis_mock.delete("url:abc123")
+    
+    assert get_cached_url("abc123") == "https://example.com"
+
+def test_invalidate_url_cache_clears_l1(redis_mock):
+    cache_url("abc123", "https://example.com")
+    
+    invalidate_url_cache("abc123")
+    
+    assert url_l1_cache.get("abc123") is None
+    assert get_cached_url("abc123") is None
+
+def test_invalidate_url_cache_publishes(redis_mock):
+    pubsub = redis_mock.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(URL_INVALIDATION_CHANNEL)
+    
+    invalidate_url_cache("abc123")
+    
+    message = None
+    for _ in range(10):
+        message = pubsub.get_message(timeout=0.1)
+        if message:
+            break
+    assert message["data"] == "abc123"
+    pubsub.close()
+
+def test_handle_invalidation_message(redis_mock):
+    url_l1_cache.set("abc123", "https://example.com")
+    
+    _handle_invalidation_message({"type": "message", "data": "abc123"})
+    
+    assert url_l1_cache.get("abc123") is None
+
+def test_invalidation_listener(redis_mock):
+    listener = start_invalidation_listener()
+    try:
+        url_l1_cache.set("abc123", "https://example.com")
+        
+        # Another worker invalidates the link
+        redis_mock.publish(URL_INVALIDATION_CHANNEL, "abc123")
+        
+        for _ in range(50):
+            if url_l1_cache.get("abc123") is None:
+                break
+            time.sleep(0.05)
+        
+        assert url_l1_cache.get("abc123") is None
+    finally:
+        listener.stop()
+
+def test_resolve_and_record_click(redis_mock):
+    client_info = {"ip_address": "192.168.1.1", "user_agent": "Test Browser", "referer": ""}
+    
+    # Cache miss records nothing
+    assert resolve_and_record_click("abc123", client_info) is None
+    assert not redis_mock.exists("clicks:abc123")
+    
+    # Cache hit resolves the URL and records the click
+    redis_mock.set("url:abc123", "https://example.com")
+    assert resolve_and_record_click("abc123", client_info) == "https://example.com"
+    
+    assert get_buffered_clicks("abc123") == 1
+    assert get_buffered_last_access("abc123") is not None
+    assert get_links_to_sync() == {"abc123"}
+    assert redis_mock.xlen("click_stream") == 1
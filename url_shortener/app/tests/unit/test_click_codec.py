@@ -0,0 +1,136 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from app import cache
+from app.cache import CLICK_DICT_EPOCH_KEY, get_click_stream_key
+from app.config import settings
+from app.click_codec import encode_click, decode_click, CLICK_RECORD_VERSION
+from app.async_cache import get_click_text_ids, ensure_click_stream_group, read_click_events, record_click
+
+CLICKED_AT_MS = int(datetime(2026, 3, 5, 10, 15, 30, 123000, tzinfo=timezone.utc).timestamp() * 1000)
+
+@pytest.mark.parametrize("ip_address", ["203.0.113.7", "2001:db8::1", "testclient", None])
+def test_encode_decode_round_trip(ip_address):
+    record = encode_click("abc123", CLICKED_AT_MS, ip_address, 0, 0, "Test Browser", 0, "https://example.com/ссылка")
+    click = decode_click(record)
+
+    assert click == {
+        "short_code": "abc123",
+        "timestamp": datetime(2026, 3, 5, 10, 15, 30, 123000, tzinfo=timezone.utc),
+        "ip_address": ip_address,
+        "user_agent": "Test Browser",
+        "referer": "https://example.com/ссылка",
+        "dict_epoch": 0,
+        "user_agent_id": 0,
+        "referer_id": 0,
+    }
+
+def test_dictionary_ids_replace_texts():
+    inline = encode_click("abc123", CLICKED_AT_MS, "203.0.113.7", 0, 0, "Test Browser", 0, None)
+    record = encode_click("abc123", CLICKED_AT_MS, "203.0.113.7", 5, 7, "Test Browser", 0, None)
+
+    # Текст с id словаря в запись не попадает
+    assert len(record) == len(inline) - len("Test Browser") - 2
+    click = decode_click(record)
+    assert click["dict_epoch"] == 5
+    assert click["user_agent"] is None and click["user_agent_id"] == 7
+    assert click["referer"] is None and click["referer_id"] == 0
+
+def test_ip_is_packed():
+    v4 = encode_click("abc123", CLICKED_AT_MS, "203.0.113.7", 5, 1, None, 1, None)
+    v6 = encode_click("abc123", CLICKED_AT_MS, "2001:db8::1", 5, 1, None, 1, None)
+
+    assert len(v6) - len(v4) == 12
+    assert b"203.0.113.7" not in v4
+
+def test_decode_legacy_json():
+    record = json.dumps({
+        "short_code": "abc123", "timestamp": "2026-03-05T10:15:30+00:00",
+        "ip_address": "203.0.113.7", "user_agent": "Test Browser", "referer": ""
+    }).encode()
+    click = decode_click(record)
+
+    assert click["short_code"] == "abc123"
+    assert click["timestamp"] == datetime(2026, 3, 5, 10, 15, 30, tzinfo=timezone.utc)
+    assert click["dict_epoch"] == click["user_agent_id"] == click["referer_id"] == 0
+
+def test_decode_unknown_version():
+    record = encode_click("abc123", CLICKED_AT_MS, None, 0, 0, None, 0, None)
+
+    with pytest.raises(ValueError):
+        decode_click(bytes((CLICK_RECORD_VERSION + 1,)) + record[1:])
+
+@pytest.mark.asyncio
+async def test_click_texts_are_interned(redis_mock):
+    client_info = {"ip_address": "203.0.113.7", "user_agent": "Test Browser", "referer": "https://example.com"}
+
+    epoch, *text_ids = await get_click_text_ids(client_info)
+    assert epoch == int(redis_mock.get(CLICK_DICT_EPOCH_KEY)) and text_ids == [1, 1]
+    assert await get_click_text_ids({**client_info, "user_agent": "Other Browser"}) == (epoch, 2, 1)
+    # Пустые и слишком длинные значения хранятся в записи
+    long_referer = "https://example.com/?" + "q" * settings.CLICK_DICT_MAX_TEXT_LENGTH
+    assert await get_click_text_ids({"user_agent": "", "referer": long_referer}) == (0, 0, 0)
+
+    # Повторные тексты берутся из кеша процесса, а другой процесс получает те же id из Redis
+    cache.click_text_ids.clear()
+    cache.click_dict_state["epoch"] = None
+    assert cache.get_click_text_ids(client_info) == (epoch, 1, 1)
+    assert redis_mock.hgetall(f"click_dict:{epoch}:user_agent") == {"Test Browser": "1", "Other Browser": "2"}
+
+@pytest.mark.asyncio
+async def test_full_dictionary_keeps_texts_inline(redis_mock):
+    with patch.object(settings, "CLICK_DICT_MAX_SIZE", 1):
+        await record_click("abc123", {"user_agent": "First Browser"})
+        await record_click("abc123", {"user_agent": "Second Browser"})
+
+    await ensure_click_stream_group()
+    events = await read_click_events("test-consumer", 10)
+
+    assert [data["user_agent"] for _, _, data in events] == ["First Browser", "Second Browser"]
+    assert redis_mock.hlen(f"click_dict:{cache.click_dict_state['epoch']}:user_agent") == 1
+
+@pytest.mark.asyncio
+async def test_read_click_events_resolves_dictionary_texts(redis_mock):
+    long_referer = "https://example.com/?" + "q" * settings.CLICK_DICT_MAX_TEXT_LENGTH
+    await record_click("abc123", {"ip_address": "2001:db8::1", "user_agent": "Test Browser", "referer": long_referer})
+    await ensure_click_stream_group()
+
+    # Читатель без кеша процесса подставляет тексты из Redis
+    cache.click_texts.clear()
+    (_, _, data), = await read_click_events("test-consumer", 10)
+
+    assert data["short_code"] == "abc123"
+    assert data["ip_address"] == "2001:db8::1"
+    assert data["user_agent"] == "Test Browser"
+    assert data["referer"] == long_referer
+    assert "user_agent_id" not in data
+
+@pytest.mark.asyncio
+async def test_lost_dictionaries_start_new_epoch(redis_mock):
+    await record_click("abc123", {"user_agent": "Test Browser"})
+    old_epoch = cache.click_dict_state["epoch"]
+    old_record = cache.build_click_record("abc123", {}, (old_epoch, 1, 0))
+
+    # Redis потерял данные, и другой процесс уже завел словари новой эпохи с тем же id 1
+    redis_mock.flushall()
+    redis_mock.set(CLICK_DICT_EPOCH_KEY, old_epoch + 1)
+    redis_mock.hset(f"click_dict:{old_epoch + 1}:user_agent", "Other Browser", 1)
+    redis_mock.hset(f"click_dict:{old_epoch + 1}:user_agent:ids", 1, "Other Browser")
+    redis_mock.set(f"click_dict:{old_epoch + 1}:user_agent:next", 1)
+    await ensure_click_stream_group()
+
+    # id из кеша процесса прежней эпохи не записываются, а кеши словарей сбрасываются
+    await record_click("abc123", {"user_agent": "Test Browser"})
+    assert cache.click_dict_state["epoch"] is None
+    await record_click("abc123", {"user_agent": "Test Browser"})
+    assert cache.click_dict_state["epoch"] == old_epoch + 1
+    # Запись прежней эпохи не получает текст из новых словарей
+    redis_mock.xadd(get_click_stream_key("abc123"), {"data": old_record})
+
+    cache.click_texts.clear()
+    events = await read_click_events("test-consumer", 10)
+
+    assert [data["user_agent"] for _, _, data in events] == ["Test Browser", "Test Browser", None]
+    assert redis_mock.hget(f"click_dict:{old_epoch + 1}:user_agent", "Test Browser") == "2"
@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import select, exc
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.database import get_async_database_url, get_db, get_db_pool_stats, db_pool_stats, InstrumentedAsyncQueuePool
+from app.models import Link
+
+def test_get_async_database_url():
+    assert get_async_database_url("postgresql://user:pass@db/app") == "postgresql+asyncpg://user:pass@db/app"
+    assert get_async_database_url("postgres://user:pass@db/app") == "postgresql+asyncpg://user:pass@db/app"
+    assert get_async_database_url("postgresql+psycopg2://db/app") == "postgresql+asyncpg://db/app"
+    assert get_async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    assert get_async_database_url("postgresql+asyncpg://db/app") == "postgresql+asyncpg://db/app"
+
+@pytest.mark.asyncio
+async def test_get_db_yields_async_session(db):
+    db.add(Link(short_code="abc123", original_url="https://example.com"))
+    db.commit()
+    
+    async for session in get_db():
+        assert isinstance(session, AsyncSession)
+        link = await session.scalar(select(Link).filter(Link.short_code == "abc123"))
+        assert link.original_url == "https://example.com"
+
+@pytest.mark.asyncio
+async def test_instrumented_pool_counts_timeouts():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05
+    )
+    checkouts = db_pool_stats["checkouts"]
+    timeouts = db_pool_stats["timeouts"]
+    
+    async with engine.connect():
+        with pytest.raises(exc.TimeoutError):
+            async with engine.connect():
+                pass
+    
+    assert db_pool_stats["timeouts"] == timeouts + 1
+    assert db_pool_stats["checkouts"] == checkouts + 2
+    assert db_pool_stats["wait_time_max"] >= 0.05
+    await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_get_db_pool_stats_tracks_connections_in_use(db):
+    in_use = get_db_pool_stats()["in_use"]
+    
+    async for session in get_db():
+        await session.scalar(select(Link.id))
+        assert get_db_pool_stats()["in_use"] == in_use + 1
+    
+    assert get_db_pool_stats()["in_use"] == in_use
@@ -1,34 +1,59 @@
 import pytest
 from fastapi import HTTPException
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from datetime import datetime, timezone
 from jose import JWTError
 
 from app.dependencies import get_current_user, get_current_active_user, get_link_owner_or_admin, get_client_info
 from app.models import User, Link
+from app.user_cache import invalidate_cached_user
 
 @pytest.mark.asyncio
-async def test_get_current_user_valid_token():
+async def test_get_current_user_valid_token(redis_mock):
     token_data = {"sub": "testuser", "user_id": 1}
-    with patch('app.dependencies.jwt.decode', return_value=token_data):
+    with patch('app.user_cache.jwt.decode', return_value=token_data):
 
-        mock_db = MagicMock()
+        mock_db = AsyncMock()
         mock_user = User(id=1, username="testuser", email="test@example.com")
-        mock_db.query.return_value.filter.return_value.first.return_value = mock_user
+        mock_db.scalar.return_value = mock_user
         
         user = await get_current_user("valid_token", mock_db)
         assert user == mock_user
 
 @pytest.mark.asyncio
-async def test_get_current_user_invalid_token():
-    with patch('app.dependencies.jwt.decode', side_effect=JWTError("Invalid token")):
-        mock_db = MagicMock()
+async def test_get_current_user_invalid_token(redis_mock):
+    with patch('app.user_cache.jwt.decode', side_effect=JWTError("Invalid token")):
+        mock_db = AsyncMock()
         
         with pytest.raises(HTTPException) as exc_info:
             await get_current_user("invalid_token", mock_db)
         
         assert exc_info.value.status_code == 401
 
+@pytest.mark.asyncio
+async def test_get_current_user_cached(redis_mock):
+    token_data = {"sub": "testuser", "user_id": 1}
+    mock_db = AsyncMock()
+    mock_db.scalar.return_value = User(
+        id=1, username="testuser", email="test@example.com",
+        created_at=datetime.now(timezone.utc), is_active=True
+    )
+    
+    with patch('app.user_cache.jwt.decode', return_value=token_data) as mock_decode:
+        await get_current_user("cached_token", mock_db)
+        user = await get_current_user("cached_token", mock_db)
+    
+    # Повторный запрос с тем же токеном не расшифровывает его и не ходит в БД
+    assert mock_decode.call_count == 1
+    assert mock_db.scalar.await_count == 1
+    assert user.id == 1
+    assert user.username == "testuser"
+    assert user.is_active is True
+    
+    await invalidate_cached_user(1)
+    await get_current_user("cached_token", mock_db)
+    assert mock_db.scalar.await_count == 2
+
 @pytest.mark.asyncio
 async def test_get_current_active_user():
     active_user = User(id=1, username="active", email="active@example.com", is_active=True)
@@ -49,8 +74,8 @@ async def test_get_link_owner_or_admin():
     
     link = Link(id=1, short_code="abc123", original_url="https://example.com", owner_id=1)
     
-    mock_db = MagicMock()
-    mock_db.query.return_value.filter.return_value.first.return_value = link
+    mock_db = AsyncMock()
+    mock_db.scalar.return_value = link
     
     result = await get_link_owner_or_admin("abc123", owner, mock_db)
     assert result == link
@@ -60,7 +85,7 @@ async def test_get_link_owner_or_admin():
         await get_link_owner_or_admin("abc123", other_user, mock_db)
     assert exc_info.value.status_code == 403
     
-    mock_db.query.return_value.filter.return_value.first.return_value = None
+    mock_db.scalar.return_value = None
     with pytest.raises(HTTPException) as exc_info:
         await get_link_owner_or_admin("nonexistent", owner, mock_db)
     assert exc_info.value.status_code == 404
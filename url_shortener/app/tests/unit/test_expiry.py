@@ -0,0 +1,87 @@
+import pytest
+from unittest.mock import patch
+from datetime import datetime, timezone, timedelta
+from app.models import Link
+from app.expiry import (
+    schedule_expiry, unschedule_expiry, pop_due_expiries, expire_due_links,
+    ensure_expiry_schedule, expiry_score, EXPIRY_SCHEDULE_KEY
+)
+
+@pytest.mark.asyncio
+async def test_schedule_expiry(redis_mock):
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    
+    await schedule_expiry("abc123", expires_at)
+    assert redis_mock.zscore(EXPIRY_SCHEDULE_KEY, "abc123") == pytest.approx(expires_at.timestamp())
+    
+    # Бессрочная ссылка убирается из расписания
+    await schedule_expiry("abc123", None)
+    assert redis_mock.zscore(EXPIRY_SCHEDULE_KEY, "abc123") is None
+    
+    await schedule_expiry("abc123", expires_at)
+    await unschedule_expiry("abc123")
+    assert redis_mock.zcard(EXPIRY_SCHEDULE_KEY) == 0
+
+def test_expiry_score_naive_datetime():
+    aware = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    assert expiry_score(aware.replace(tzinfo=None)) == aware.timestamp()
+
+@pytest.mark.asyncio
+async def test_pop_due_expiries(redis_mock):
+    now = datetime.now(timezone.utc)
+    redis_mock.zadd(EXPIRY_SCHEDULE_KEY, {
+        "old1": (now - timedelta(minutes=2)).timestamp(),
+        "old2": (now - timedelta(minutes=1)).timestamp(),
+        "new1": (now + timedelta(minutes=1)).timestamp(),
+    })
+    
+    assert list(await pop_due_expiries(now, 1)) == ["old1"]
+    assert list(await pop_due_expiries(now, 10)) == ["old2"]
+    assert await pop_due_expiries(now, 10) == {}
+    assert redis_mock.zrange(EXPIRY_SCHEDULE_KEY, 0, -1) == ["new1"]
+
+@pytest.mark.asyncio
+async def test_expire_due_links(db, redis_mock):
+    now = datetime.now(timezone.utc)
+    due = Link(short_code="due001", original_url="https://due.com", expires_at=now - timedelta(seconds=1))
+    # Срок продлен, но старая запись расписания еще не обновлена
+    extended = Link(short_code="ext001", original_url="https://ext.com", expires_at=now + timedelta(days=1))
+    db.add_all([due, extended])
+    db.commit()
+    
+    redis_mock.zadd(EXPIRY_SCHEDULE_KEY, {"due001": (now - timedelta(seconds=1)).timestamp(),
+                                          "ext001": (now - timedelta(seconds=1)).timestamp()})
+    redis_mock.set("url:due001", "https://due.com")
+    
+    assert await expire_due_links() == ["due001"]
+    
+    db.expire_all()
+    assert [link.short_code for link in db.query(Link).all()] == ["ext001"]
+    assert not redis_mock.exists("url:due001")
+    assert redis_mock.zcard(EXPIRY_SCHEDULE_KEY) == 0
+
+@pytest.mark.asyncio
+async def test_expire_due_links_requeues_on_error(redis_mock):
+    score = (datetime.now(timezone.utc) - timedelta(seconds=1)).timestamp()
+    redis_mock.zadd(EXPIRY_SCHEDULE_KEY, {"due001": score})
+    
+    with patch("app.expiry.delete_expired_links", side_effect=RuntimeError("db down")):
+        with pytest.raises(RuntimeError):
+            await expire_due_links()
+    
+    assert redis_mock.zscore(EXPIRY_SCHEDULE_KEY, "due001") == pytest.approx(score)
+
+@pytest.mark.asyncio
+async def test_ensure_expiry_schedule(db, redis_mock):
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    db.add_all([
+        Link(short_code="exp001", original_url="https://a.com", expires_at=expires_at),
+        Link(short_code="forever", original_url="https://b.com"),
+    ])
+    db.commit()
+    
+    assert await ensure_expiry_schedule()
+    assert redis_mock.zrange(EXPIRY_SCHEDULE_KEY, 0, -1) == ["exp001"]
+    
+    # Повторно расписание не заполняется
+    assert not await ensure_expiry_schedule()
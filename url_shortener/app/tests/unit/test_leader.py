@@ -0,0 +1,79 @@
+import pytest
+import asyncio
+
+from app.leader import (
+    acquire_lease, renew_lease, release_lease, get_lease_holder, run_as_leader, leader_jobs
+)
+
+@pytest.mark.asyncio
+async def test_lease_belongs_to_one_token(redis_mock):
+    assert await acquire_lease("sync", "worker-1", 10)
+    assert not await acquire_lease("sync", "worker-2", 10)
+
+    assert await renew_lease("sync", "worker-1", 10)
+    assert not await renew_lease("sync", "worker-2", 10)
+
+    # Чужой токен не может снять аренду
+    await release_lease("sync", "worker-2")
+    assert await get_lease_holder("sync") == "worker-1"
+
+    await release_lease("sync", "worker-1")
+    assert await get_lease_holder("sync") is None
+    assert await acquire_lease("sync", "worker-2", 10)
+
+@pytest.mark.asyncio
+async def test_only_one_contender_runs_job(redis_mock):
+    running = []
+
+    def make_job(contender):
+        async def job():
+            running.append(contender)
+            await asyncio.Event().wait()
+        return job
+
+    contenders = [
+        asyncio.create_task(run_as_leader("cleanup", make_job(i), ttl=0.5, renew_interval=0.05))
+        for i in range(3)
+    ]
+    await asyncio.sleep(0.3)
+    assert len(running) == 1
+    assert "cleanup" in leader_jobs
+
+    # Остановленный лидер отпускает аренду, и задачу подхватывает другой процесс
+    leader = running[0]
+    contenders[leader].cancel()
+    await asyncio.gather(contenders[leader], return_exceptions=True)
+    await asyncio.sleep(0.3)
+    assert len(running) == 2
+    assert running[1] != leader
+
+    for task in contenders:
+        task.cancel()
+    await asyncio.gather(*contenders, return_exceptions=True)
+    assert "cleanup" not in leader_jobs
+    assert redis_mock.get("leader:cleanup") is None
+
+@pytest.mark.asyncio
+async def test_job_is_cancelled_when_lease_is_lost(redis_mock):
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def job():
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    contender = asyncio.create_task(run_as_leader("expiry", job, ttl=0.5, renew_interval=0.05))
+    await asyncio.wait_for(started.wait(), timeout=1)
+
+    # Аренда истекла, пока лидер стоял, и ее забрал другой процесс
+    redis_mock.set("leader:expiry", "other-worker", px=10000)
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert "expiry" not in leader_jobs
+    assert redis_mock.get("leader:expiry") == "other-worker"
+
+    contender.cancel()
+    await asyncio.gather(contender, return_exceptions=True)
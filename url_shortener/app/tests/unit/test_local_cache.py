@@ -0,0 +1,74 @@
+import time
+from unittest.mock import patch
+
+from app.local_cache import LocalCache
+
+def test_get_and_set():
+    cache = LocalCache(max_size=10, ttl=60)
+    
+    # Test miss
+    assert cache.get("abc123") is None
+    
+    # Test hit
+    cache.set("abc123", "https://example.com")
+    assert cache.get("abc123") == "https://example.com"
+    
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 1
+
+def test_lru_eviction():
+    cache = LocalCache(max_size=2, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    
+    # "a" becomes the most recently used entry
+    assert cache.get("a") == "1"
+    
+    cache.set("c", "3")
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry():
+    cache = LocalCache(max_size=10, ttl=60)
+    
+    with patch("app.local_cache.time.monotonic", return_value=1000.0):
+        cache.set("abc123", "https://example.com", ttl=5)
+    
+    with patch("app.local_cache.time.monotonic", return_value=1004.0):
+        assert cache.get("abc123") == "https://example.com"
+    
+    with patch("app.local_cache.time.monotonic", return_value=1006.0):
+        assert cache.get("abc123") is None
+    
+    assert cache.stats()["expirations"] == 1
+
+def test_ttl_is_capped_by_default():
+    cache = LocalCache(max_size=10, ttl=10)
+    
+    with patch("app.local_cache.time.monotonic", return_value=1000.0):
+        cache.set("abc123", "https://example.com", ttl=3600)
+    
+    with patch("app.local_cache.time.monotonic", return_value=1011.0):
+        assert cache.get("abc123") is None
+
+def test_delete_and_clear():
+    cache = LocalCache(max_size=10, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+    
+    cache.clear()
+    assert len(cache) == 0
+
+def test_disabled_cache():
+    cache = LocalCache(max_size=0, ttl=60)
+    cache.set("abc123", "https://example.com")
+    assert cache.get("abc123") is None
@@ -1,12 +1,14 @@
 import pytest
+import json
 import asyncio
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import patch, MagicMock, AsyncMock
 from datetime import datetime, timezone, timedelta
 from fastapi.testclient import TestClient
 
 from app.main import app, lifespan, periodically_cleanup_expired_links, root
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
 from app.models import Link
+from app.config import settings
 
 @pytest.mark.asyncio
 async def test_lifespan():    
@@ -14,98 +16,47 @@ async def test_lifespan():
     mock_app = MagicMock()
     mock_app.state = MagicMock()
     
-    # Create db mock
-    mock_db = MagicMock()
-    
-    with patch('app.main.SessionLocal', return_value=mock_db):
+    with patch('app.main.AsyncSessionLocal') as mock_session:
         with patch('asyncio.create_task') as mock_create_task:
             async with lifespan(mock_app) as _:
-                assert mock_create_task.call_count == 2
+                assert mock_create_task.call_count == 5
                 
                 assert hasattr(mock_app.state, 'background_tasks')
-                assert len(mock_app.state.background_tasks) == 2
-                
-    # Check, that db.commit was called once
-    mock_db.__enter__.return_value.commit.assert_called_once()
+                assert len(mock_app.state.background_tasks) == 5
+    
+    # Очистка истекших ссылок не выполняется на старте синхронно
+    mock_session.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_cleanup_expired_links():    
-    with patch('asyncio.sleep', side_effect=[None, asyncio.CancelledError()]):
-        mock_db = MagicMock()
-        with patch('app.main.SessionLocal', return_value=mock_db):
-            with patch('app.main.invalidate_url_cache') as mock_invalidate:
-                with patch('app.main.reset_buffered_stats') as mock_reset:
-                    try:
-                        await periodically_cleanup_expired_links()
-                    except asyncio.CancelledError:
-                        pass
-                    
-                    mock_db.__enter__.assert_called()
-                    mock_db.__exit__.assert_called()
+async def test_lifespan_without_background_jobs():
+    mock_app = MagicMock()
+    mock_app.state = MagicMock()
+    
+    with patch('app.main.settings.RUN_BACKGROUND_JOBS', False):
+        with patch('asyncio.create_task') as mock_create_task:
+            async with lifespan(mock_app) as _:
+                # Остаются только задачи, нужные каждому веб-процессу
+                assert set(mock_app.state.background_tasks) == {"invalidation", "known_codes"}
+                assert mock_create_task.call_count == 2
 
 @pytest.mark.asyncio
 async def test_cleanup_expired_links():
-    from app.main import periodically_cleanup_expired_links
-    from app.models import Link
-    
-    # Create test links
-    expired_link1 = MagicMock()
-    expired_link1.short_code = "abc123"
-    expired_link1.id = 1
-    
-    expired_link2 = MagicMock()
-    expired_link2.short_code = "def456"
-    expired_link2.id = 2
-    
-    expired_links = [expired_link1, expired_link2]
-    
-    # Create db mock
-    mock_db = MagicMock()
-    mock_query = MagicMock()
-    mock_filter = MagicMock()
-    
-    mock_db.__enter__.return_value = mock_db
-    mock_db.query.return_value = mock_query
-    mock_query.filter.return_value = mock_filter
-    mock_filter.all.return_value = expired_links
-    
-    # Mock methods
-    with patch('app.main.SessionLocal', return_value=mock_db):
-        with patch('app.main.invalidate_url_cache') as mock_invalidate:
-            with patch('app.main.reset_buffered_stats') as mock_reset:
-                with patch('asyncio.sleep', side_effect=[None, asyncio.CancelledError()]):
-                    try:
-                        await periodically_cleanup_expired_links()
-                    except asyncio.CancelledError:
-                        pass
-    
-    # Asserts
-    mock_db.query.assert_called_with(Link)
-    
-    assert mock_query.filter.called
-    
-    assert mock_invalidate.call_count == 2
-    mock_invalidate.assert_has_calls([
-        call("abc123"),
-        call("def456")
-    ], any_order=True)
-    
-    assert mock_reset.call_count == 2
-    mock_reset.assert_has_calls([
-        call("abc123"),
-        call("def456")
-    ], any_order=True)
-    
-    assert mock_db.delete.call_count == 2
-    mock_db.delete.assert_has_calls([
-        call(expired_link1),
-        call(expired_link2)
-    ], any_order=True)
-    
-    mock_db.commit.assert_called_once()
-    
-    mock_db.__enter__.assert_called()
-    mock_db.__exit__.assert_called()
+    # Первый проход упирается в бюджет, второй дочищает очередь
+    passes = [
+        {"deleted": 1000, "finished": False, "duration": 5.0},
+        {"deleted": 10, "finished": True, "duration": 0.1},
+    ]
+    
+    with patch('app.main.purge_expired_links', AsyncMock(side_effect=passes)) as mock_purge:
+        with patch('app.main.ensure_known_codes', AsyncMock()) as mock_ensure:
+            with patch('asyncio.sleep', AsyncMock(side_effect=[None, asyncio.CancelledError()])) as mock_sleep:
+                await periodically_cleanup_expired_links()
+    
+    assert mock_purge.await_count == 2
+    # Удаленные коды убираются из фильтра по пачкам, без перестройки по всей таблице
+    mock_ensure.assert_not_awaited()
+    assert mock_sleep.await_args_list[0].args == (1,)
+    assert mock_sleep.await_args_list[1].args == (settings.PURGE_INTERVAL,)
 
 @pytest.mark.asyncio
 async def test_log_requests_middleware():
@@ -135,4 +86,233 @@ async def test_root_endpoint():
     assert "docs_url" in result
     assert "version" in result
     assert result["message"] == "URL Shortener API"
-    assert result["docs_url"] == "/docs"
\ No newline at end of file
+    assert result["docs_url"] == "/docs"
+
+
+@pytest.mark.asyncio
+async def test_sync_stats_with_db(db, redis_mock):
+    from app.main import sync_stats_with_db
+    from app.models import Click
+    from app.async_cache import resolve_and_record_click
+    
+    live = Link(short_code="live01", original_url="https://example.com/live")
+    expired = Link(
+        short_code="old001",
+        original_url="https://example.com/old",
+        expires_at=datetime.now(timezone.utc) - timedelta(days=1)
+    )
+    db.add_all([live, expired])
+    db.commit()
+    
+    client_info = {"ip_address": "192.168.1.1", "user_agent": "Test Browser", "referer": ""}
+    for short_code, url in [("live01", live.original_url), ("old001", expired.original_url), ("gone01", "https://gone.com")]:
+        redis_mock.set(f"url:{short_code}", url)
+        for _ in range(3):
+            await resolve_and_record_click(short_code, client_info)
+    
+    with patch('app.main.settings.SYNC_BATCH_SIZE', 2):
+        await sync_stats_with_db()
+    
+    db.expire_all()
+    live = db.query(Link).filter(Link.short_code == "live01").first()
+    assert live.click_count == 3
+    assert live.last_accessed is not None
+    assert db.query(Click).filter(Click.link_id == live.id).count() == 3
+    
+    # Буферы сброшены, кеш устаревших ссылок инвалидирован
+    assert redis_mock.smembers("links_to_sync") == set()
+    assert not redis_mock.exists("clicks:live01")
+    assert not redis_mock.exists("url:old001")
+    assert not redis_mock.exists("url:gone01")
+
+@pytest.mark.asyncio
+async def test_sync_stats_keeps_clicks_arrived_during_sync(db, redis_mock):
+    from app.main import sync_stats_with_db
+    from app.async_cache import increment_access_counter
+    
+    db.add(Link(short_code="live01", original_url="https://example.com/live"))
+    db.commit()
+    
+    await increment_access_counter("live01")
+    await increment_access_counter("live01")
+    
+    from app.main import reset_buffered_stats_bulk as original_reset
+    
+    async def reset_after_new_click(flushed):
+        # Клик приходит между чтением буфера и его сбросом
+        await increment_access_counter("live01")
+        await original_reset(flushed)
+    
+    with patch('app.main.reset_buffered_stats_bulk', side_effect=reset_after_new_click):
+        await sync_stats_with_db()
+    
+    db.expire_all()
+    assert db.query(Link).filter(Link.short_code == "live01").first().click_count == 2
+    assert redis_mock.get("clicks:live01") == "1"
+    assert redis_mock.sismember("links_to_sync", "live01")
+
+@pytest.mark.asyncio
+async def test_sync_stats_with_db_bounds_batches_per_pass(db, redis_mock):
+    from app import async_cache
+    from app.main import sync_stats_with_db
+    from app.async_cache import increment_access_counter
+    
+    for i in range(3):
+        db.add(Link(short_code=f"bound{i}", original_url=f"https://example.com/{i}"))
+        await increment_access_counter(f"bound{i}")
+    db.commit()
+    
+    with patch('app.main.settings.SYNC_BATCH_SIZE', 1), \
+         patch.object(async_cache.redis_client, "smembers") as mock_smembers:
+        result = await sync_stats_with_db(max_batches=2)
+    
+    # Проход читает только свою долю links_to_sync, а не все множество
+    mock_smembers.assert_not_called()
+    assert result["links"] == 2
+    assert result["batches"] == 2
+    assert result["slowest_batch"] > 0
+    # Оставшаяся ссылка ждет следующего прохода
+    assert redis_mock.scard("links_to_sync") == 1
+
+@pytest.mark.asyncio
+async def test_sync_stats_with_db_reports_failed_link_batch(db, redis_mock):
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from app.main import sync_stats_with_db
+    from app.async_cache import increment_access_counter
+    
+    db.add(Link(short_code="fail01", original_url="https://example.com/fail"))
+    db.commit()
+    await increment_access_counter("fail01")
+    
+    with patch.object(AsyncSession, "commit", side_effect=Exception("db is down")):
+        result = await sync_stats_with_db()
+    
+    # Ошибка записи счетчиков включает отступ планировщика так же, как ошибка записи кликов
+    assert result["links"] == 0
+    assert result["slowest_batch"] == float("inf")
+    assert redis_mock.get("clicks:fail01") == "1"
+    assert redis_mock.sismember("links_to_sync", "fail01")
+
+def test_get_sync_trigger():
+    from app.main import get_sync_trigger
+    
+    now_ms = 1_000_000_000
+    with patch('app.main.settings.SYNC_BACKLOG_THRESHOLD', 100), patch('app.main.settings.SYNC_MAX_AGE', 60):
+        assert get_sync_trigger({"links": 0, "clicks": 0, "oldest_ms": None}, now_ms) is None
+        assert get_sync_trigger({"links": 5, "clicks": 99, "oldest_ms": now_ms - 59_000}, now_ms) is None
+        assert get_sync_trigger({"links": 5, "clicks": 100, "oldest_ms": now_ms}, now_ms) == "size"
+        assert get_sync_trigger({"links": 100, "clicks": 0, "oldest_ms": None}, now_ms) == "size"
+        assert get_sync_trigger({"links": 1, "clicks": 1, "oldest_ms": now_ms - 60_000}, now_ms) == "age"
+
+def test_next_sync_backoff():
+    from app.main import next_sync_backoff
+    
+    with patch('app.main.settings.SYNC_SLOW_BATCH_SECONDS', 1), \
+            patch('app.main.settings.SYNC_CHECK_INTERVAL', 1), \
+            patch('app.main.settings.SYNC_MAX_BACKOFF', 8):
+        assert next_sync_backoff(0, 0.5) == 0
+        assert next_sync_backoff(0, 2) == 1
+        assert next_sync_backoff(4, 2) == 8
+        assert next_sync_backoff(8, float("inf")) == 8
+        # Как только БД успевает, пауза сбрасывается
+        assert next_sync_backoff(8, 0.1) == 0
+
+@pytest.mark.asyncio
+async def test_periodically_sync_stats_flushes_on_threshold_and_backs_off():
+    from app.main import periodically_sync_stats
+    
+    now_ms = datetime.now(timezone.utc).timestamp() * 1000
+    backlogs = [
+        {"links": 0, "clicks": 0, "oldest_ms": None},
+        {"links": 3, "clicks": 10, "oldest_ms": now_ms},
+        {"links": 3, "clicks": 50000, "oldest_ms": now_ms},
+        {"links": 3, "clicks": 20000, "oldest_ms": now_ms},
+        {"links": 1, "clicks": 1, "oldest_ms": now_ms - 120_000},
+    ]
+    results = [
+        {"slowest_batch": 5.0},
+        {"slowest_batch": 5.0},
+        {"slowest_batch": 0.1},
+    ]
+    sleeps = [None] * len(backlogs) + [asyncio.CancelledError()]
+    
+    with patch('app.main.settings.SYNC_CHECK_INTERVAL', 1), \
+            patch('app.main.settings.SYNC_BACKLOG_THRESHOLD', 10000), \
+            patch('app.main.settings.SYNC_MAX_AGE', 60), \
+            patch('app.main.get_sync_backlog', AsyncMock(side_effect=backlogs)), \
+            patch('app.main.sync_stats_with_db', AsyncMock(side_effect=results)) as mock_sync, \
+            patch('asyncio.sleep', AsyncMock(side_effect=sleeps)) as mock_sleep:
+        await periodically_sync_stats()
+    
+    # Пустой и небольшой свежий буфер не синхронизируются, большой и старый — да
+    assert mock_sync.await_count == 3
+    mock_sync.assert_awaited_with(max_batches=settings.SYNC_MAX_BATCHES)
+    # Медленные пачки увеличивают паузу, быстрая сбрасывает ее
+    assert [c.args[0] for c in mock_sleep.await_args_list] == [1, 1, 1, 2, 3, 1]
+
+@pytest.mark.asyncio
+async def test_periodically_sync_stats_ages_links_without_events():
+    from app.main import periodically_sync_stats
+    
+    backlog = {"links": 2, "clicks": 0, "oldest_ms": None}
+    times = iter([1000.0, 1030.0, 1061.0])
+    
+    with patch('app.main.settings.SYNC_MAX_AGE', 60), \
+            patch('app.main.get_sync_backlog', AsyncMock(side_effect=lambda: dict(backlog))), \
+            patch('app.main.sync_stats_with_db', AsyncMock(return_value={"slowest_batch": 0.0})) as mock_sync, \
+            patch('app.main.time.time', side_effect=lambda: next(times)), \
+            patch('asyncio.sleep', AsyncMock(side_effect=[None, None, None, asyncio.CancelledError()])):
+        await periodically_sync_stats()
+    
+    mock_sync.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_sync_click_events_acks_only_after_commit(db, redis_mock):
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from app.main import sync_click_events
+    from app.models import Click
+    from app.async_cache import add_click_details
+    
+    db.add(Link(short_code="live01", original_url="https://example.com/live"))
+    db.commit()
+    
+    await add_click_details("live01", {"ip_address": "192.168.1.1"})
+    await add_click_details("gone01", {"ip_address": "192.168.1.2"})
+    
+    with patch.object(AsyncSession, "commit", side_effect=Exception("db is down")):
+        assert await sync_click_events() == 0
+    
+    # События остались неподтвержденными и будут забраны повторно
+    assert redis_mock.xpending("click_stream", "stats_sync")["pending"] == 2
+    
+    with patch('app.async_cache.settings.CLICK_STREAM_CLAIM_IDLE_MS', 0):
+        assert await sync_click_events() == 1
+    
+    assert db.query(Click).count() == 1
+    assert redis_mock.xpending("click_stream", "stats_sync")["pending"] == 0
+    assert redis_mock.xlen("click_stream") == 0
+
+@pytest.mark.asyncio
+async def test_sync_click_events_updates_rollups(db, redis_mock):
+    from app.main import sync_click_events
+    from app.models import HourlyClickRollup, DailyClickRollup
+    from app.cache import build_click_record, get_click_stream_key
+    
+    db.add(Link(short_code="roll02", original_url="https://example.com/roll"))
+    db.commit()
+    
+    clicked_at = datetime(2026, 3, 5, 10, 15, tzinfo=timezone.utc)
+    for minutes in (0, 10):
+        click_record = build_click_record("roll02", {}, clicked_at=clicked_at + timedelta(minutes=minutes))
+        redis_mock.xadd(get_click_stream_key("roll02"), {"data": click_record})
+    # Запись в JSON, оставшаяся в потоке с прошлой версии
+    redis_mock.xadd(get_click_stream_key("roll02"), {"data": json.dumps({
+        "short_code": "roll02", "timestamp": (clicked_at + timedelta(minutes=70)).isoformat(),
+        "ip_address": "", "user_agent": "", "referer": ""
+    })})
+    
+    assert await sync_click_events() == 3
+    
+    hourly = db.query(HourlyClickRollup).order_by(HourlyClickRollup.bucket_start).all()
+    assert [row.clicks for row in hourly] == [2, 1]
+    assert [row.clicks for row in db.query(DailyClickRollup).all()] == [3]
@@ -0,0 +1,88 @@
+import pytest
+import fakeredis
+import fakeredis.aioredis
+from app.metrics import Registry, Metric, Counter, Gauge, Histogram, REDIS_COMMAND_DURATION
+from app.async_cache import InstrumentedRedis
+
+def test_metric_requires_new_value():
+    class Summary(Metric):
+        kind = "summary"
+    
+    # Без _new_value метрика не создается, а не падает на первом labels()
+    with pytest.raises(TypeError):
+        Summary("latency_summary", "Задержка", registry=Registry())
+
+@pytest.mark.asyncio
+async def test_render_counter_and_gauge():
+    registry = Registry()
+    requests = Counter("requests_total", "Запросы", ("route",), registry=registry)
+    queue = Gauge("queue_depth", "Очередь", registry=registry)
+    
+    requests.labels("/a").inc()
+    requests.labels("/a").inc(2)
+    requests.labels('/"b"').inc()
+    queue.set(7)
+    queue.dec()
+    
+    text = await registry.render()
+    
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="/a"} 3' in text
+    assert 'requests_total{route="/\\"b\\""} 1' in text
+    assert "queue_depth 6" in text
+
+@pytest.mark.asyncio
+async def test_render_histogram():
+    registry = Registry()
+    latency = Histogram("latency_seconds", "Задержка", ("route",), buckets=(0.1, 1.0), registry=registry)
+    
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.labels("/a").observe(value)
+    
+    lines = (await registry.render()).splitlines()
+    
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/a"} 3.65' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
+
+@pytest.mark.asyncio
+async def test_set_function_and_collectors():
+    registry = Registry()
+    stats = {"hits": 4, "misses": 1}
+    events = Counter("cache_events_total", "События", ("event",), registry=registry)
+    events.set_function(lambda: {(event,): value for event, value in stats.items()})
+    depth = Gauge("depth", "Глубина", registry=registry)
+    
+    async def collect_depth():
+        depth.set(42)
+    
+    def broken_collector():
+        raise RuntimeError("redis down")
+    
+    registry.add_collector(broken_collector)
+    registry.add_collector(collect_depth)
+    
+    text = await registry.render()
+    
+    # Ошибка одного сборщика не мешает остальным
+    assert 'cache_events_total{event="hits"} 4' in text
+    assert "depth 42" in text
+
+@pytest.mark.asyncio
+async def test_instrumented_redis_observes_commands():
+    fake = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    client = InstrumentedRedis(connection_pool=fake.connection_pool)
+    before_get = REDIS_COMMAND_DURATION.labels("GET").count
+    before_pipeline = REDIS_COMMAND_DURATION.labels("PIPELINE").count
+    
+    await client.set("key", "value")
+    assert await client.get("key") == "value"
+    pipe = client.pipeline(transaction=False)
+    pipe.get("key")
+    pipe.exists("key")
+    assert await pipe.execute() == ["value", 1]
+    
+    assert REDIS_COMMAND_DURATION.labels("GET").count == before_get + 1
+    assert REDIS_COMMAND_DURATION.labels("PIPELINE").count == before_pipeline + 1
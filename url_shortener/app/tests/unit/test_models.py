@@ -2,6 +2,7 @@ import pytest
 from datetime import datetime, timezone, timedelta
 from sqlalchemy.exc import IntegrityError
 from app.models import User, Link, Click
+from app.utils import url_fingerprint
 
 def test_user_model(db):
     # Create user
@@ -150,4 +151,20 @@ def test_cascade_delete(db):
     
     # Verify click is also deleted
     remaining_clicks = db.query(Click).filter(Click.link_id == link.id).count()
-    assert remaining_clicks == 0
\ No newline at end of file
+    assert remaining_clicks == 0
+
+def test_link_url_hash_default(db):
+    link = Link(short_code="hash01", original_url="https://Example.com/page")
+    db.add(link)
+    db.commit()
+    db.refresh(link)
+    
+    assert link.url_hash == url_fingerprint("https://example.com/page")
+
+
+def test_timestamps_are_timezone_aware():
+    # asyncpg не принимает время с часовым поясом для колонок без него
+    for column in (User.created_at, Link.created_at, Click.timestamp):
+        assert column.type.timezone
+        # Значение по умолчанию вычисляется при каждой вставке, а не при импорте
+        assert column.default.is_callable
@@ -0,0 +1,55 @@
+import pytest
+import time
+import asyncio
+import threading
+from passlib.context import CryptContext
+from app.config import settings
+from app.password_hashing import (
+    hash_password, verify_password, run_in_hash_pool, get_password_hashing_stats
+)
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_password():
+    hashed = await hash_password("secret")
+
+    assert hashed.startswith(f"$2b${settings.BCRYPT_ROUNDS:02d}$")
+    assert await verify_password("secret", hashed) == (True, None)
+    assert (await verify_password("wrong", hashed))[0] is False
+
+@pytest.mark.asyncio
+async def test_verify_password_rehashes_weaker_hash():
+    weak_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("secret")
+
+    verified, new_hash = await verify_password("secret", weak_hash)
+
+    assert verified
+    assert new_hash.startswith(f"$2b${settings.BCRYPT_ROUNDS:02d}$")
+
+@pytest.mark.asyncio
+async def test_run_in_hash_pool_limits_concurrency():
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+    loop_thread = threading.get_ident()
+
+    def slow_hash():
+        nonlocal running, peak
+        # Хеширование выполняется не в потоке цикла событий
+        assert threading.get_ident() != loop_thread
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return "hash"
+
+    results = await asyncio.gather(*(run_in_hash_pool(slow_hash) for _ in range(settings.PASSWORD_HASH_WORKERS * 3)))
+
+    assert results == ["hash"] * (settings.PASSWORD_HASH_WORKERS * 3)
+    assert peak <= settings.PASSWORD_HASH_WORKERS
+
+    stats = get_password_hashing_stats()
+    assert stats["waiting"] == 0
+    assert stats["running"] == 0
+    assert stats["queue_time_max"] > 0
@@ -0,0 +1,69 @@
+import pytest
+from unittest.mock import patch
+from datetime import datetime, timezone, timedelta
+from app.models import Link, Click, HourlyClickRollup
+from app.purge import purge_expired_links
+from app.bloom import rebuild_known_codes, might_exist
+
+def add_links(db, expired: int, live: int):
+    past = datetime.now(timezone.utc) - timedelta(days=1)
+    future = datetime.now(timezone.utc) + timedelta(days=1)
+    links = [
+        Link(short_code=f"old{i:03d}", original_url=f"https://old.com/{i}", expires_at=past)
+        for i in range(expired)
+    ] + [
+        Link(short_code=f"new{i:03d}", original_url=f"https://new.com/{i}", expires_at=future)
+        for i in range(live)
+    ]
+    db.add_all(links)
+    db.commit()
+    return links
+
+@pytest.mark.asyncio
+async def test_purge_expired_links(db, redis_mock):
+    links = add_links(db, expired=25, live=5)
+    db.add_all([Click(link_id=link.id, ip_address="127.0.0.1") for link in links])
+    db.add_all([
+        HourlyClickRollup(link_id=link.id, bucket_start=datetime(2026, 3, 5, tzinfo=timezone.utc), clicks=1)
+        for link in links
+    ])
+    db.commit()
+    
+    redis_mock.set("url:old000", "https://old.com/0")
+    redis_mock.set("clicks:old000", 3)
+    redis_mock.sadd("links_to_sync", "old000", "new000")
+    await rebuild_known_codes()
+    
+    with patch("app.purge.settings.PURGE_CHUNK_SIZE", 10):
+        result = await purge_expired_links()
+    
+    assert result["deleted"] == 25
+    assert result["finished"]
+    
+    db.expire_all()
+    assert db.query(Link).count() == 5
+    # Клики и агрегаты удаленных ссылок удаляются вместе с ними
+    assert db.query(Click).count() == 5
+    assert db.query(HourlyClickRollup).count() == 5
+    
+    # Удаленные коды убираются из фильтра известных кодов
+    assert not await might_exist("old000")
+    assert await might_exist("new000")
+    
+    assert not redis_mock.exists("url:old000")
+    assert not redis_mock.exists("clicks:old000")
+    assert redis_mock.smembers("links_to_sync") == {"new000"}
+
+@pytest.mark.asyncio
+async def test_purge_expired_links_time_budget(db, redis_mock):
+    add_links(db, expired=25, live=0)
+    
+    with patch("app.purge.settings.PURGE_CHUNK_SIZE", 10):
+        # Нулевой бюджет: проход сразу останавливается, следующий продолжает
+        result = await purge_expired_links(time_budget=0)
+        assert result == {"deleted": 0, "finished": False, "duration": result["duration"]}
+        
+        result = await purge_expired_links()
+    
+    assert result["deleted"] == 25
+    assert result["finished"]
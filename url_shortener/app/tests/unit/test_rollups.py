@@ -0,0 +1,44 @@
+import pytest
+from datetime import datetime, timezone, timedelta
+from app.database import AsyncSessionLocal
+from app.models import Link, HourlyClickRollup, DailyClickRollup
+from app.rollups import bucket_start, add_clicks_to_rollups, delete_rollups, get_click_timeseries
+
+def test_bucket_start():
+    moment = datetime(2026, 3, 5, 14, 37, 12, 500, tzinfo=timezone.utc)
+    
+    assert bucket_start(moment, "hour") == datetime(2026, 3, 5, 14, tzinfo=timezone.utc)
+    assert bucket_start(moment, "day") == datetime(2026, 3, 5, tzinfo=timezone.utc)
+    # Наивное время считается UTC, остальные зоны приводятся к UTC
+    assert bucket_start(moment.replace(tzinfo=None), "hour") == datetime(2026, 3, 5, 14, tzinfo=timezone.utc)
+    assert bucket_start(moment.astimezone(timezone(timedelta(hours=3))), "day") == datetime(2026, 3, 5, tzinfo=timezone.utc)
+
+@pytest.mark.asyncio
+async def test_add_clicks_to_rollups(db):
+    link = Link(short_code="roll01", original_url="https://example.com/roll")
+    db.add(link)
+    db.commit()
+    base = datetime(2026, 3, 5, 10, 15, tzinfo=timezone.utc)
+    
+    async with AsyncSessionLocal() as session:
+        await add_clicks_to_rollups(session, [
+            {"link_id": link.id, "timestamp": base},
+            {"link_id": link.id, "timestamp": base + timedelta(minutes=30)},
+            {"link_id": link.id, "timestamp": base + timedelta(hours=2)},
+        ])
+        # Повторная пачка прибавляется к тем же корзинам
+        await add_clicks_to_rollups(session, [{"link_id": link.id, "timestamp": base}])
+        await session.commit()
+        
+        points = await get_click_timeseries(session, link.id, "hour", base, base + timedelta(hours=3))
+        assert [clicks for _, clicks in points] == [3, 0, 1, 0]
+        assert points[0][0] == datetime(2026, 3, 5, 10, tzinfo=timezone.utc)
+        
+        points = await get_click_timeseries(session, link.id, "day", base - timedelta(days=1), base)
+        assert [clicks for _, clicks in points] == [0, 4]
+        
+        await delete_rollups(session, [link.id])
+        await session.commit()
+    
+    assert db.query(HourlyClickRollup).count() == 0
+    assert db.query(DailyClickRollup).count() == 0
@@ -0,0 +1,63 @@
+import pytest
+from app.short_codes import (
+    encode_base62, decode_base62, permute, encode_short_code,
+    BlockAllocator, RedisBlockAllocator, get_allocator, SHORT_CODE_COUNTER_KEY, BASE
+)
+
+def test_base62_roundtrip():
+    assert encode_base62(0, 3) == "000"
+    assert encode_base62(61, 1) == "Z"
+
+    for number in (1, 62, 12345, 62 ** 7 - 1):
+        assert decode_base62(encode_base62(number, 7)) == number
+
+def test_permute_is_bijection():
+    domain = BASE ** 2
+    images = {permute(value, 2) for value in range(domain)}
+
+    assert images == set(range(domain))
+
+def test_encode_short_code():
+    codes = [encode_short_code(number) for number in range(10000)]
+
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == 7 for code in codes)
+    # Соседние идентификаторы не дают соседних кодов
+    assert sorted(codes) != codes
+
+    assert len(encode_short_code(BASE ** 7)) == 8
+
+@pytest.mark.asyncio
+async def test_redis_block_allocator(db, redis_mock):
+    # Два распределителя имитируют разные воркеры
+    first = RedisBlockAllocator(block_size=10)
+    second = RedisBlockAllocator(block_size=10)
+
+    ids = [await first.next_id() for _ in range(15)]
+    ids += [await second.next_id() for _ in range(15)]
+    ids += await first.next_ids(25)
+
+    assert len(set(ids)) == len(ids)
+    assert int(redis_mock.get(SHORT_CODE_COUNTER_KEY)) == 60
+
+@pytest.mark.asyncio
+async def test_redis_block_allocator_restores_lost_counter(db, redis_mock):
+    issued = await RedisBlockAllocator(block_size=10).next_ids(15)
+
+    # Данные Redis потеряны: новый блок начинается после уже выданных идентификаторов
+    redis_mock.delete(SHORT_CODE_COUNTER_KEY)
+    ids = await RedisBlockAllocator(block_size=10).next_ids(5)
+
+    assert min(ids) == 15
+    assert not set(ids) & set(issued)
+    assert int(redis_mock.get(SHORT_CODE_COUNTER_KEY)) == 25
+
+def test_block_allocator_requires_lease_block():
+    with pytest.raises(TypeError):
+        BlockAllocator(block_size=10)
+
+def test_get_allocator():
+    assert isinstance(get_allocator("redis"), RedisBlockAllocator)
+
+    with pytest.raises(ValueError):
+        get_allocator("unknown")
@@ -0,0 +1,105 @@
+import pytest
+import asyncio
+from app import single_flight
+from app.single_flight import load_once, get_single_flight_stats, FILL_LOCK_PREFIX
+
+@pytest.mark.asyncio
+async def test_load_once_coalesces_concurrent_calls(redis_mock):
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "https://example.com"
+
+    async def read_cache():
+        return None
+
+    results = await asyncio.gather(*(load_once("url:abc123", loader, read_cache) for _ in range(20)))
+
+    assert results == ["https://example.com"] * 20
+    assert calls == 1
+    assert get_single_flight_stats()["in_flight"] == 0
+    # Блокировка снимается после загрузки
+    assert not redis_mock.exists(f"{FILL_LOCK_PREFIX}url:abc123")
+
+@pytest.mark.asyncio
+async def test_load_once_propagates_errors(redis_mock):
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise LookupError("abc123")
+
+    async def read_cache():
+        return None
+
+    results = await asyncio.gather(
+        *(load_once("url:abc123", loader, read_cache) for _ in range(5)),
+        return_exceptions=True
+    )
+
+    assert all(isinstance(result, LookupError) for result in results)
+
+    # После ошибки следующая загрузка выполняется заново
+    async def good_loader():
+        return "ok"
+
+    assert await load_once("url:abc123", good_loader, read_cache) == "ok"
+
+@pytest.mark.asyncio
+async def test_load_once_waits_for_other_worker(redis_mock):
+    # Другой воркер держит блокировку и заполняет кеш
+    redis_mock.set(f"{FILL_LOCK_PREFIX}url:abc123", "other", px=2000)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        return "from-db"
+
+    async def read_cache():
+        return redis_mock.get("url:abc123")
+
+    async def fill_later():
+        await asyncio.sleep(0.05)
+        redis_mock.set("url:abc123", "https://example.com")
+
+    before = dict(single_flight.single_flight_stats)
+    result, _ = await asyncio.gather(load_once("url:abc123", loader, read_cache), fill_later())
+
+    assert result == "https://example.com"
+    assert calls == 0
+    assert single_flight.single_flight_stats["lock_wait_hits"] - before["lock_wait_hits"] == 1
+    # Чужая блокировка не снимается
+    assert redis_mock.get(f"{FILL_LOCK_PREFIX}url:abc123") == "other"
+
+@pytest.mark.asyncio
+async def test_load_once_falls_back_after_wait(redis_mock):
+    redis_mock.set(f"{FILL_LOCK_PREFIX}url:abc123", "other", px=2000)
+
+    async def loader():
+        return "from-db"
+
+    async def read_cache():
+        return None
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(single_flight.settings, "FILL_WAIT_MS", 50)
+        assert await load_once("url:abc123", loader, read_cache) == "from-db"
+
+@pytest.mark.asyncio
+async def test_coalesced_link_load_survives_first_caller_cancel(db, redis_mock):
+    from app.models import Link
+    from app.routers.links import get_link_info
+    
+    db.add(Link(short_code="sf0001", original_url="https://example.com/sf"))
+    db.commit()
+    
+    # Первый запрос отменяется, пока загрузка идет; ожидающие ее запросы получают результат
+    first = asyncio.create_task(get_link_info("sf0001"))
+    second = asyncio.create_task(get_link_info("sf0001"))
+    await asyncio.sleep(0)
+    first.cancel()
+    
+    assert (await second).original_url == "https://example.com/sf"
+    assert first.cancelled()
@@ -3,7 +3,8 @@ from jose import jwt
 from datetime import datetime, timedelta, timezone
 from app.utils import (
     generate_short_code, verify_password, get_password_hash,
-    create_access_token, build_short_url, is_expired, extract_client_info
+    create_access_token, build_short_url, is_expired, extract_client_info, extract_client_info_from_scope,
+    normalize_url, url_fingerprint, URL_FINGERPRINT_LENGTH
 )
 from app.config import settings
 
@@ -107,4 +108,39 @@ def test_extract_client_info():
     assert info["ip_address"] == "192.168.1.1"
     assert info["user_agent"] == "Test Agent"
     assert info["referer"] == "https://example.com/page"
-    assert isinstance(info["timestamp"], datetime)
\ No newline at end of file
+    assert isinstance(info["timestamp"], datetime)
+
+def test_extract_client_info_from_scope():
+    scope = {
+        "client": ("192.168.1.1", 5000),
+        "headers": [
+            (b"user-agent", b"Test Agent"),
+            (b"referer", b"https://example.com/page"),
+            (b"referer", b"https://example.com/other"),
+        ]
+    }
+    
+    assert extract_client_info_from_scope(scope) == {
+        "ip_address": "192.168.1.1",
+        "user_agent": "Test Agent",
+        "referer": "https://example.com/page"
+    }
+    assert extract_client_info_from_scope({"client": None, "headers": []}) == {
+        "ip_address": None, "user_agent": None, "referer": None
+    }
+
+def test_normalize_url():
+    assert normalize_url("HTTPS://Example.COM:443") == "https://example.com/"
+    assert normalize_url("http://example.com:8080/Path?q=1#Top") == "http://example.com:8080/Path?q=1#Top"
+    assert normalize_url("http://user:pw@[::1]:80/") == "http://user:pw@[::1]/"
+    # Неразбираемый адрес не нормализуется, но и не приводит к ошибке
+    assert normalize_url(" http://example.com:abc/ ") == "http://example.com:abc/"
+    assert normalize_url("http://[::1/") == "http://[::1/"
+
+def test_url_fingerprint():
+    fingerprint = url_fingerprint("https://example.com")
+    
+    assert len(fingerprint) == URL_FINGERPRINT_LENGTH
+    assert fingerprint == url_fingerprint("HTTPS://EXAMPLE.com:443/")
+    assert fingerprint != url_fingerprint("https://example.com/other")
+
@@ -0,0 +1,71 @@
+import time
+import hashlib
+from datetime import datetime
+from typing import Optional
+from jose import jwt
+
+from app import async_cache
+from app.config import settings
+from app.json_utils import dumps, loads
+from app.models import User
+from app.cache import USER_CACHE_PREFIX, USER_INVALIDATION_CHANNEL, user_l1_cache, token_l1_cache
+
+# Поля пользователя, которые кешируются; хеш пароля в кеш не попадает
+USER_CACHE_FIELDS = ("id", "username", "email", "created_at", "is_active")
+
+def get_user_cache_key(user_id: int) -> str:
+    """Формирует ключ кеша пользователя"""
+    return f"{USER_CACHE_PREFIX}{user_id}"
+
+def decode_access_token(token: str) -> dict:
+    """Расшифровывает JWT; результат запоминается до exp токена"""
+    token_key = hashlib.sha256(token.encode()).hexdigest()
+    payload = token_l1_cache.get(token_key)
+    if payload is not None:
+        # Запись могла пережить exp на долю секунды из-за округления TTL
+        if payload.get("exp") is None or payload["exp"] > time.time():
+            return payload
+
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+
+    exp = payload.get("exp")
+    ttl = exp - time.time() if exp is not None else None
+    if ttl is None or ttl > 0:
+        token_l1_cache.set(token_key, payload, ttl)
+
+    return payload
+
+def _user_from_data(data: dict) -> User:
+    data = dict(data)
+    if isinstance(data.get("created_at"), str):
+        data["created_at"] = datetime.fromisoformat(data["created_at"])
+    return User(**data)
+
+async def get_cached_user(user_id: int) -> Optional[User]:
+    """Возвращает пользователя из кеша процесса или Redis; None при промахе"""
+    key = str(user_id)
+    data = user_l1_cache.get(key)
+    if data is None:
+        cached = await async_cache.redis_client.get(get_user_cache_key(user_id))
+        if cached is None:
+            return None
+        data = loads(cached)
+        user_l1_cache.set(key, data)
+
+    # Каждый запрос получает свой объект, не привязанный к сессии
+    return _user_from_data(data)
+
+async def cache_user(user: User) -> None:
+    """Кеширует пользователя в процессе и в Redis на USER_CACHE_TTL"""
+    data = {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+    await async_cache.redis_client.set(get_user_cache_key(user.id), dumps(data), ex=settings.USER_CACHE_TTL)
+    user_l1_cache.set(str(user.id), loads(dumps(data)))
+
+async def invalidate_cached_user(user_id: int) -> None:
+    """Сбрасывает пользователя во всех воркерах, например после деактивации"""
+    user_l1_cache.delete(str(user_id))
+
+    pipe = async_cache.redis_client.pipeline(transaction=False)
+    pipe.delete(get_user_cache_key(user_id))
+    pipe.publish(USER_INVALIDATION_CHANNEL, str(user_id))
+    await pipe.execute()
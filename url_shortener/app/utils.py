@@ -1,12 +1,20 @@
 import random
 import string
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import jwt
 from passlib.context import CryptContext
 from app.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Хеши с меньшей стоимостью или устаревшей схемой считаются требующими обновления
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS
+)
 
 def generate_short_code(length: int = settings.DEFAULT_SHORT_CODE_LENGTH) -> str:
     """Генерирует случайный короткий код указанной длины"""
@@ -21,6 +29,10 @@ def get_password_hash(password: str) -> str:
     """Хеширует пароль"""
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple:
+    """Проверяет пароль и возвращает новый хеш, если старый нужно обновить"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Создает JWT токен доступа"""
     to_encode = data.copy()
@@ -38,6 +50,34 @@ def build_short_url(short_code: str) -> str:
     """Создает полный короткий URL с базовым URL приложения"""
     return f"{settings.BASE_URL}/{short_code}"
 
+# Порты по умолчанию не меняют адрес и отбрасываются при нормализации
+DEFAULT_PORTS = {"http": 80, "https": 443}
+URL_FINGERPRINT_LENGTH = 32  # Шестнадцатеричных символов, т.е. 128 бит SHA-256
+
+def normalize_url(url: str) -> str:
+    """Приводит URL к каноническому виду: схема и хост в нижнем регистре, без порта по умолчанию"""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        # Нечисловой порт или неверный IPv6-адрес: такой URL сравнивается как есть
+        return url
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if ":" in netloc:
+        netloc = f"[{netloc}]"
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password is not None else "")
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+def url_fingerprint(url: str) -> str:
+    """Усеченный SHA-256 нормализованного URL для индексированного поиска"""
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()[:URL_FINGERPRINT_LENGTH]
+
 def is_expired(expires_at: Optional[datetime]) -> bool:
     """Проверяет, истек ли срок действия ссылки"""
     if not expires_at:
@@ -50,6 +90,17 @@ def is_expired(expires_at: Optional[datetime]) -> bool:
     
     return now > expires_at
 
+def get_cache_ttl(expires_at: Optional[datetime]) -> Optional[int]:
+    """Возвращает оставшееся время жизни ссылки в секундах для TTL кеша"""
+    if not expires_at:
+        return None
+    
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    
+    remaining = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+    return remaining if remaining > 0 else None
+
 def extract_client_info(request) -> dict:
     """Извлекает информацию о клиенте из запроса"""
     return {
@@ -57,4 +108,21 @@ def extract_client_info(request) -> dict:
         "user_agent": request.headers.get("user-agent"),
         "referer": request.headers.get("referer"),
         "timestamp": datetime.now(timezone.utc)
-    }
\ No newline at end of file
+    }
+
+
+def extract_client_info_from_scope(scope: dict) -> dict:
+    """Те же сведения о клиенте, что и extract_client_info, но прямо из ASGI scope без объекта Request"""
+    user_agent = referer = None
+    for name, value in scope["headers"]:
+        # Как и Request.headers.get, берется первое значение повторяющегося заголовка
+        if name == b"user-agent" and user_agent is None:
+            user_agent = value.decode("latin-1")
+        elif name == b"referer" and referer is None:
+            referer = value.decode("latin-1")
+    client = scope.get("client")
+    return {
+        "ip_address": client[0] if client else None,
+        "user_agent": user_agent,
+        "referer": referer
+    }
@@ -0,0 +1,38 @@
+"""Периодические задачи вне веб-процессов.
+
+Запуск из каталога url_shortener:
+
+    python -m app.worker
+
+Выполняет очистку и истечение ссылок и синхронизацию статистики под теми же
+арендами, что и веб-процессы, поэтому можно запустить несколько воркеров для
+отказоустойчивости, а веб-процессам выставить RUN_BACKGROUND_JOBS=False.
+"""
+import asyncio
+import signal
+
+from app import async_cache
+from app.main import start_leader_jobs
+
+
+async def run_worker() -> None:
+    """Выполняет периодические задачи до SIGINT или SIGTERM"""
+    print("Запуск воркера фоновых задач...")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    tasks = start_leader_jobs()
+    await stop.wait()
+
+    print("Завершение работы воркера...")
+    # Отмена отпускает аренды, и задачи сразу переходят к другим процессам
+    for task in tasks.values():
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    await async_cache.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
@@ -0,0 +1,58 @@
+"""Отпечаток original_url в links.url_hash
+
+Revision ID: 0001_link_url_hash
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils import url_fingerprint, URL_FINGERPRINT_LENGTH
+
+revision = "0001_link_url_hash"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+BACKFILL_CHUNK_SIZE = 5000
+
+links = sa.table(
+    "links",
+    sa.column("id", sa.Integer),
+    sa.column("original_url", sa.Text),
+    sa.column("url_hash", sa.String),
+)
+
+def upgrade() -> None:
+    # Новые базы создаются через create_all уже с колонкой, поэтому миграция идемпотентна
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("links"):
+        return
+
+    if "url_hash" not in {column["name"] for column in inspector.get_columns("links")}:
+        op.add_column("links", sa.Column("url_hash", sa.String(URL_FINGERPRINT_LENGTH), nullable=True))
+    if "ix_links_url_hash" not in {index["name"] for index in inspector.get_indexes("links")}:
+        op.create_index("ix_links_url_hash", "links", ["url_hash"])
+
+    # Нормализация делается в Python, поэтому отпечатки считаются пачками по id
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(links.c.id, links.c.original_url)
+            .where(links.c.id > last_id, links.c.url_hash.is_(None))
+            .order_by(links.c.id)
+            .limit(BACKFILL_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        conn.execute(
+            links.update().where(links.c.id == sa.bindparam("row_id")).values(url_hash=sa.bindparam("hash")),
+            [{"row_id": row.id, "hash": url_fingerprint(row.original_url)} for row in rows]
+        )
+        last_id = rows[-1].id
+
+def downgrade() -> None:
+    op.drop_index("ix_links_url_hash", table_name="links")
+    op.drop_column("links", "url_hash")
@@ -0,0 +1,24 @@
+"""Индекс links (owner_id, id) для списка ссылок пользователя
+
+Revision ID: 0002_links_owner_id_index
+Revises: 0001_link_url_hash
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_links_owner_id_index"
+down_revision = "0001_link_url_hash"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("links"):
+        return
+
+    if "ix_links_owner_id_id" not in {index["name"] for index in inspector.get_indexes("links")}:
+        op.create_index("ix_links_owner_id_id", "links", ["owner_id", "id"])
+
+def downgrade() -> None:
+    op.drop_index("ix_links_owner_id_id", table_name="links")
@@ -0,0 +1,58 @@
+"""Часовые и дневные агрегаты кликов
+
+Revision ID: 0003_click_rollups
+Revises: 0002_links_owner_id_index
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_click_rollups"
+down_revision = "0002_links_owner_id_index"
+branch_labels = None
+depends_on = None
+
+ROLLUP_TABLES = {
+    "click_rollups_hourly": "hour",
+    "click_rollups_daily": "day",
+}
+
+# Начало корзины из clicks.timestamp (наивное время в UTC) для каждого диалекта
+BUCKET_EXPRESSIONS = {
+    "postgresql": {
+        "hour": "date_trunc('hour', timestamp) AT TIME ZONE 'UTC'",
+        "day": "date_trunc('day', timestamp) AT TIME ZONE 'UTC'",
+    },
+    "sqlite": {
+        "hour": "strftime('%Y-%m-%d %H:00:00.000000', timestamp)",
+        "day": "strftime('%Y-%m-%d 00:00:00.000000', timestamp)",
+    },
+}
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if not inspector.has_table("links"):
+        return
+
+    for table_name, bucket in ROLLUP_TABLES.items():
+        if not inspector.has_table(table_name):
+            op.create_table(
+                table_name,
+                sa.Column("link_id", sa.Integer, sa.ForeignKey("links.id"), primary_key=True),
+                sa.Column("bucket_start", sa.DateTime(timezone=True), primary_key=True),
+                sa.Column("clicks", sa.Integer, nullable=False),
+            )
+
+        # Агрегаты пересчитываются по clicks целиком, поэтому повторный запуск дает тот же результат
+        bucket_expression = BUCKET_EXPRESSIONS[conn.dialect.name][bucket]
+        op.execute(f"DELETE FROM {table_name}")
+        op.execute(
+            f"INSERT INTO {table_name} (link_id, bucket_start, clicks) "
+            f"SELECT link_id, {bucket_expression}, COUNT(*) FROM clicks "
+            f"WHERE timestamp IS NOT NULL GROUP BY link_id, {bucket_expression}"
+        )
+
+def downgrade() -> None:
+    for table_name in ROLLUP_TABLES:
+        op.drop_table(table_name)
@@ -0,0 +1,45 @@
+"""users.created_at и clicks.timestamp с часовым поясом
+
+Revision ID: 0004_timestamps_with_time_zone
+Revises: 0003_click_rollups
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_timestamps_with_time_zone"
+down_revision = "0003_click_rollups"
+branch_labels = None
+depends_on = None
+
+# Наивные значения в этих колонках записывались в UTC
+COLUMNS = {
+    "users": "created_at",
+    "clicks": "timestamp",
+}
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # В SQLite время хранится строкой одного формата при любом timezone
+    if conn.dialect.name != "postgresql":
+        return
+
+    inspector = sa.inspect(conn)
+    for table_name, column_name in COLUMNS.items():
+        if inspector.has_table(table_name):
+            op.alter_column(
+                table_name, column_name,
+                type_=sa.DateTime(timezone=True),
+                postgresql_using=f"\"{column_name}\" AT TIME ZONE 'UTC'"
+            )
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    for table_name, column_name in COLUMNS.items():
+        op.alter_column(
+            table_name, column_name,
+            type_=sa.DateTime(),
+            postgresql_using=f"\"{column_name}\" AT TIME ZONE 'UTC'"
+        )
@@ -0,0 +1,23 @@
+"""Концы блоков идентификаторов коротких кодов, выданных счетчиком в Redis
+
+Revision ID: 0005_short_code_blocks
+Revises: 0004_timestamps_with_time_zone
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_short_code_blocks"
+down_revision = "0004_timestamps_with_time_zone"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table("short_code_blocks"):
+        op.create_table(
+            "short_code_blocks",
+            sa.Column("end_id", sa.BigInteger, primary_key=True, autoincrement=False),
+        )
+
+def downgrade() -> None:
+    op.drop_table("short_code_blocks")